@@ -5,10 +5,16 @@ Initial code taken from `(Brammer, Pirzkal, & Ryan 2014) <https://github.com/WFC
 explanation how the grism configuration parameters and coefficients are defined and evaluated.
 """
 import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
+from .utils_c import interp
+
 class aXeConf():
-    def __init__(self, conf_file='WFC3.IR.G141.V2.5.conf'):
+    def __init__(self, conf_file='WFC3.IR.G141.V2.5.conf', 
+                 trace_cache_bytes=64*1024**2, trace_cache_quantum=1.e-6):
         """Read an aXe-compatible configuration file
         
         Parameters
@@ -16,22 +22,46 @@ class aXeConf():
         conf_file: str
             Filename of the configuration file to read
         
+        trace_cache_bytes: int
+            Memory limit of the cache of traces and sensitivity curves 
+            computed with `get_beam_trace_sensitivity`.  Set to zero to 
+            disable the cache.
+        
+        trace_cache_quantum: float
+            Precision, in pixels, of the detector coordinates used as keys of
+            the trace cache.
         """
+        self.init_trace_cache(max_bytes=trace_cache_bytes, 
+                              quantum=trace_cache_quantum)
+        
         if conf_file is not None:
-            self.conf = self.read_conf_file(conf_file)
-            self.conf_file = conf_file
-            self.count_beam_orders()
-            
-            ## Global XOFF/YOFF offsets
-            if 'XOFF' in self.conf.keys():
-                self.xoff = np.float(conf['XOFF'])
-            else:
-                self.xoff = 0.
+            self.set_conf(self.read_conf_file(conf_file), conf_file)
+    
+    def set_conf(self, conf, conf_file):
+        """Set the configuration parameters
+        
+        Parameters
+        ----------
+        conf : `~collections.OrderedDict`
+            Parameters, e.g., from `read_conf_file`.
+        
+        conf_file : str
+            Filename of the configuration file.
+        """
+        self.conf = conf
+        self.conf_file = conf_file
+        self.count_beam_orders()
+        
+        ## Global XOFF/YOFF offsets
+        if 'XOFF' in self.conf.keys():
+            self.xoff = np.float(conf['XOFF'])
+        else:
+            self.xoff = 0.
 
-            if 'YOFF' in self.conf.keys():
-                self.yoff = np.float(conf['YOFF'])
-            else:
-                self.yoff = 0.
+        if 'YOFF' in self.conf.keys():
+            self.yoff = np.float(conf['YOFF'])
+        else:
+            self.yoff = 0.
             
     def read_conf_file(self, conf_file='WFC3.IR.G141.V2.5.conf'):
         """Read an aXe config file, convert floats and arrays
@@ -81,32 +111,40 @@ class aXeConf():
             
             self.orders[beam] = order-1
 
-    def get_beams(self):
+    def get_beams(self, sens_columns=None):
         """Get beam parameters and read sensitivity curves
+        
+        Parameters
+        ----------
+        sens_columns : dict or None
+            Optional dictionary of preloaded columns of the sensitivity 
+            files, `sens_columns[beam][col]`, e.g., from the binary cache 
+            of `load_grism_config`.  If None, read the files with 
+            `read_sensitivity_columns`.
         """
-        import os
         from collections import OrderedDict
-        from astropy.table import Table, Column
+        from astropy.table import Table
         
         self.dxlam = OrderedDict()
         self.nx = OrderedDict()
         self.sens = OrderedDict()
         self.beams = []
         
+        if sens_columns is None:
+            sens_columns = self.read_sensitivity_columns()
+            
         for beam in self.orders:
             if self.orders[beam] > 0:
                 self.beams.append(beam)
                 self.dxlam[beam] = np.arange(self.conf['BEAM{0}'.format(beam)].min(), self.conf['BEAM{0}'.format(beam)].max(), dtype=int)
                 self.nx[beam] = int(self.dxlam[beam].max()-self.dxlam[beam].min())+1
-                self.sens[beam] = Table.read('{0}/{1}'.format(os.path.dirname(self.conf_file), self.conf['SENSITIVITY_{0}'.format(beam)]))
-                #self.sens[beam].wave = np.cast[np.double](self.sens[beam]['WAVELENGTH'])
-                #self.sens[beam].sens = np.cast[np.double](self.sens[beam]['SENSITIVITY'])
                 
                 ### Need doubles for interpolating functions
-                for col in self.sens[beam].colnames:
-                    data = np.cast[np.double](self.sens[beam][col])
-                    self.sens[beam].remove_column(col)
-                    self.sens[beam].add_column(Column(data=data, name=col))
+                columns = OrderedDict()
+                for col in sens_columns[beam]:
+                    columns[col] = np.cast[np.double](sens_columns[beam][col])
+                    
+                self.sens[beam] = Table(columns)
                 
                 ### Scale BEAM F
                 if (beam == 'F') & ('G141' in self.conf_file): 
@@ -123,6 +161,44 @@ class aXeConf():
                 # self.sens[beam]['SENSITIVITY'] = )
         
         self.beams.sort()
+    
+    def get_sensitivity_files(self):
+        """Filenames of the sensitivity curves of the beams
+        
+        Returns
+        -------
+        files : `~collections.OrderedDict`
+            Paths of the `SENSITIVITY_[BEAM]` files, relative to the 
+            directory of `self.conf_file`.
+        """
+        files = OrderedDict()
+        for beam in self.orders:
+            if self.orders[beam] > 0:
+                key = 'SENSITIVITY_{0}'.format(beam)
+                files[beam] = '{0}/{1}'.format(os.path.dirname(self.conf_file),
+                                               self.conf[key])
+        
+        return files
+        
+    def read_sensitivity_columns(self):
+        """Read the columns of the sensitivity files
+        
+        Returns
+        -------
+        sens_columns : `~collections.OrderedDict`
+            Columns of the sensitivity tables, `sens_columns[beam][col]`, 
+            as double arrays.
+        """
+        from astropy.table import Table
+        
+        sens_columns = OrderedDict()
+        for beam, file in self.get_sensitivity_files().items():
+            tab = Table.read(file)
+            sens_columns[beam] = OrderedDict()
+            for col in tab.colnames:
+                sens_columns[beam][col] = np.cast[np.double](tab[col])
+        
+        return sens_columns
         
     def field_dependent(self, xi, yi, coeffs):
         """aXe field-dependent coefficients
@@ -164,6 +240,58 @@ class aXeConf():
     
         return a
     
+    def field_dependent_basis(self, xi, yi, order):
+        """Polynomial terms of the aXe field-dependent coefficients
+        
+        Parameters
+        ----------
+        xi, yi : array-like
+            Coordinates where to evaluate the basis, as in 
+            `field_dependent`.
+        
+        order : int
+            Polynomial order, i.e., the basis has `order*(order+1)/2` terms.
+        
+        Returns
+        -------
+        xy : `~numpy.ndarray`
+            Polynomial terms with shape `(order*(order+1)/2, len(xi))`, in 
+            the same order as in `field_dependent`.  The basis of order `n`
+            is the first `n*(n+1)/2` rows of the basis of any higher order.
+        """
+        xi = np.atleast_1d(xi)
+        yi = np.atleast_1d(yi)
+        
+        xy = []
+        for p in range(order):
+            for px in range(p+1):
+                xy.append(xi**(p-px)*yi**(px))
+        
+        return np.array(xy)
+    
+    def field_dependent_from_basis(self, xy, coeffs):
+        """Evaluate field-dependent coefficients on a precomputed basis
+        
+        Parameters
+        ----------
+        xy : `~numpy.ndarray`
+            Basis from `field_dependent_basis`, with at least as many terms 
+            as `coeffs`.
+        
+        coeffs : float or array-like
+            Field-dependency coefficients
+        
+        Returns
+        -------
+        a : `~numpy.ndarray`
+            Evaluated coefficients with shape `(xy.shape[1],)`.
+        """
+        if isinstance(coeffs, float):
+            coeffs = np.array([coeffs])
+        
+        n = len(coeffs)
+        return np.sum((xy[:n].T*coeffs).T, axis=0)
+        
     def evaluate_dp(self, dx, dydx):
         """Evalate arc length along the trace given trace polynomial coefficients
         
@@ -395,6 +523,258 @@ class aXeConf():
                     
         return dy, lam
         
+    def get_beam_traces(self, x=[507], y=[507], dx=0., beam='A', 
+                        fwcpos=None):
+        """Vectorized version of `get_beam_trace` for many positions
+        
+        Parameters
+        ----------
+        x, y : array-like
+            Detector coordinates of `N` sources.
+            
+        dx : float or array-like
+            Offsets in x pixels where to compute the traces.  Either a 1D 
+            array of `M` offsets common to all sources or an array with 
+            shape `(N, M)`.
+        
+        beam : str
+            Beam name (i.e., spectral order) to compute.
+            
+        fwcpos : None or float
+            For NIRISS, specify the filter wheel position to compute the 
+            trace rotation.  The rotated traces are computed separately for
+            each source with `get_beam_trace`.
+        
+        Returns
+        -------
+        dy, lam : `~numpy.ndarray`
+            Traces and wavelengths with shape `(N, M)`, identical to the 
+            results of `get_beam_trace` for the individual sources.
+        
+        The field-dependent polynomial basis is built once for all of the 
+        sources and the trace polynomials are evaluated analytically for 
+        all of them at the same time for traces up to quadratic order.  
+        """
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        N = len(x)
+        
+        dx = np.atleast_1d(dx)
+        if dx.ndim == 1:
+            dx = dx[None,:]*np.ones((N,1))
+            
+        NORDER = self.orders[beam]+1
+        
+        ### NIRISS rotation, not vectorized
+        if fwcpos is not None:
+            dy = np.zeros(dx.shape)
+            lam = np.zeros(dx.shape)
+            for i in range(N):
+                dy[i,:], lam[i,:] = self.get_beam_trace(x=x[i], y=y[i], 
+                                                       dx=dx[i,:], beam=beam,
+                                                       fwcpos=fwcpos)
+            
+            return dy, lam
+        
+        ### Basis of the field-dependent coefficients
+        keys = ['XOFF_{0}'.format(beam), 'YOFF_{0}'.format(beam)]
+        for i in range(NORDER):
+            keys += ['DYDX_{0:s}_{1:d}'.format(beam, i),
+                     'DLDP_{0:s}_{1:d}'.format(beam, i)]
+        
+        nterms = 1
+        for key in keys:
+            if key in self.conf.keys():
+                if not isinstance(self.conf[key], float):
+                    nterms = np.maximum(nterms, len(self.conf[key]))
+        
+        order = int(-1+np.sqrt(1+8*nterms)) // 2
+        xi, yi = x-self.xoff, y-self.yoff
+        xy = self.field_dependent_basis(xi, yi, order)
+        
+        xoff_beam = self.field_dependent_from_basis(xy, 
+                                        self.conf['XOFF_{0}'.format(beam)])
+        yoff_beam = self.field_dependent_from_basis(xy,
+                                        self.conf['YOFF_{0}'.format(beam)])
+        
+        dydx = np.zeros((NORDER, N))
+        dldp = np.zeros((NORDER, N))
+        for i in range(NORDER):
+            if 'DYDX_{0:s}_{1:d}'.format(beam, i) in self.conf.keys():
+                coeffs = self.conf['DYDX_{0:s}_{1:d}'.format(beam, i)]
+                dydx[i,:] = self.field_dependent_from_basis(xy, coeffs)
+            
+            if 'DLDP_{0:s}_{1:d}'.format(beam, i) in self.conf.keys():
+                coeffs = self.conf['DLDP_{0:s}_{1:d}'.format(beam, i)]
+                dldp[i,:] = self.field_dependent_from_basis(xy, coeffs)
+        
+        xarr = dx-xoff_beam[:,None]
+        
+        dy = yoff_beam[:,None]
+        for i in range(NORDER):
+            dy = dy + dydx[i,:,None]*xarr**i
+        
+        ### Arc length along the trace, see `evaluate_dp`
+        poly_order = NORDER-1
+        if poly_order == 0:
+            dp = xarr*1
+        elif poly_order == 1:
+            dp = np.sqrt(1+dydx[1,:,None]**2)*(xarr)
+        elif poly_order == 2:
+            dp = np.sqrt(1+dydx[1,:,None]**2)*(xarr)
+            quad = dydx[2,:] != 0
+            if quad.sum() > 0:
+                c1 = dydx[1,quad][:,None]
+                c2 = dydx[2,quad][:,None]
+                u0 = c1+2*c2*(0)
+                dp0 = (u0*np.sqrt(1+u0**2)+np.arcsinh(u0))/(4*c2)
+                u = c1+2*c2*(xarr[quad,:])
+                dp[quad,:] = (u*np.sqrt(1+u**2)+np.arcsinh(u))/(4*c2)-dp0
+        else:
+            ## Numerical integration for higher orders
+            dp = np.zeros(dx.shape)
+            for j in range(N):
+                dp[j,:] = self.evaluate_dp(xarr[j,:], dydx[:,j])
+        
+        lam = dp*0.
+        for i in range(NORDER):
+            lam += dldp[i,:,None]*dp**i
+        
+        return dy, lam
+        
+    def init_trace_cache(self, max_bytes=64*1024**2, quantum=1.e-6):
+        """Initialize (or reset) the LRU cache of `get_beam_trace_sensitivity`
+        
+        Parameters
+        ----------
+        max_bytes : int
+            Maximum size of the cached arrays.  The least-recently used 
+            entries are dropped when the limit is reached.
+        
+        quantum : float
+            Precision, in pixels, of the detector coordinates used as keys.
+        """
+        self.trace_cache = OrderedDict()
+        self.trace_cache_lock = threading.Lock()
+        self.trace_cache_max_bytes = max_bytes
+        self.trace_cache_quantum = quantum
+        self.trace_cache_nbytes = 0
+        self.trace_cache_stats = OrderedDict([('hits', 0), ('misses', 0),
+                                              ('evictions', 0)])
+    
+    def trace_cache_info(self):
+        """Statistics of the trace cache
+        
+        Returns
+        -------
+        info : `~collections.OrderedDict`
+            Number of cache 'hits', 'misses' and 'evictions', the number of 
+            cached 'entries', 'nbytes' used and the 'max_bytes' limit.
+        """
+        if not hasattr(self, 'trace_cache'):
+            self.init_trace_cache()
+            
+        info = OrderedDict(self.trace_cache_stats)
+        info['entries'] = len(self.trace_cache)
+        info['nbytes'] = self.trace_cache_nbytes
+        info['max_bytes'] = self.trace_cache_max_bytes
+        return info
+    
+    def get_beam_trace_sensitivity(self, x=507, y=507, dx=0., beam='A',
+                                   fwcpos=None):
+        """Beam trace, wavelengths and sensitivity with a memoized cache
+        
+        Parameters
+        ----------
+        x, y, dx, beam, fwcpos : 
+            See `get_beam_trace`.
+        
+        Returns
+        -------
+        dy, lam : `~numpy.ndarray`
+            Trace and wavelength from `get_beam_trace`.
+        
+        sens : `~numpy.ndarray`
+            Sensitivity curve of `beam` interpolated at `lam`, multiplied by 
+            1.e-17 times the wavelength step per pixel as used by 
+            `~grizli.model.GrismDisperser`.
+            
+        Results are cached with keys of the detector position quantized to
+        `self.trace_cache_quantum`, the beam, `fwcpos` and the bytes of the 
+        `dx` grid, which count towards `self.trace_cache_max_bytes`.  
+        Copies of the cached arrays are returned.  
+        """
+        if not hasattr(self, 'trace_cache'):
+            self.init_trace_cache()
+        
+        dx = np.atleast_1d(dx)
+        q = self.trace_cache_quantum
+        ### Raw bytes of the `dx` grid, not a hash that could collide
+        dx_bytes = dx.tobytes()
+        key = (int(np.round(x/q)), int(np.round(y/q)), beam, fwcpos, 
+               dx.dtype.str, dx_bytes)
+        
+        with self.trace_cache_lock:
+            if key in self.trace_cache:
+                ### Move to the end of the LRU list
+                value = self.trace_cache.pop(key)
+                self.trace_cache[key] = value
+                self.trace_cache_stats['hits'] += 1
+                return [v.copy() for v in value]
+            
+            self.trace_cache_stats['misses'] += 1
+        
+        dy, lam = self.get_beam_trace(x=x, y=y, dx=dx, beam=beam, 
+                                      fwcpos=fwcpos)
+        
+        ### Interpolate the sensitivity curve on the wavelength grid. 
+        sens = lam*0
+        so = np.argsort(lam)
+        sens[so] = interp.interp_conserve_c(lam[so],
+                                 self.sens[beam]['WAVELENGTH'], 
+                                 self.sens[beam]['SENSITIVITY'])
+        
+        ### Needs term of delta wavelength per pixel for flux densities
+        dl = np.abs(np.append(lam[1] - lam[0], np.diff(lam)))
+        sens *= 1.e-17*dl
+        
+        value = (dy, lam, sens)
+        nbytes = dy.nbytes + lam.nbytes + sens.nbytes + len(dx_bytes)
+        
+        if nbytes > self.trace_cache_max_bytes:
+            return [v.copy() for v in value]
+            
+        with self.trace_cache_lock:
+            if key not in self.trace_cache:
+                self.trace_cache[key] = value
+                self.trace_cache_nbytes += nbytes
+            
+            while self.trace_cache_nbytes > self.trace_cache_max_bytes:
+                old_key, old = self.trace_cache.popitem(last=False)
+                self.trace_cache_nbytes -= (np.sum([v.nbytes for v in old])
+                                            + len(old_key[-1]))
+                self.trace_cache_stats['evictions'] += 1
+                
+        return [v.copy() for v in value]
+    
+    def __getstate__(self):
+        """Don't pickle the trace cache
+        """
+        state = self.__dict__.copy()
+        for key in ['trace_cache', 'trace_cache_lock', 'trace_cache_stats',
+                    'trace_cache_nbytes']:
+            if key in state:
+                state.pop(key)
+        
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.init_trace_cache(max_bytes=state.get('trace_cache_max_bytes',
+                                                  64*1024**2),
+                              quantum=state.get('trace_cache_quantum', 
+                                                1.e-6))
+        
     def show_beams(self, beams=['E','D','C','B','A']):
         """
         Make a demo plot of the beams of a given configuration file
@@ -524,7 +904,197 @@ def get_config_filename(instrume='WFC3', filter='F140W',
     
     return conf_file
         
-def load_grism_config(conf_file):
+### Process-wide registry of loaded configuration files, see 
+### `load_grism_config`
+conf_registry = OrderedDict()
+conf_registry_lock = threading.Lock()
+
+CONF_CACHE_VERSION = 1
+
+### Default of `load_grism_config(write_cache=None)`.  Cache files are only
+### written next to the configuration files if requested.
+WRITE_CONF_CACHE = False
+
+def get_conf_cache_filename(conf_file):
+    """Filename of the binary cache of a configuration file
+    """
+    return '{0}.cache.npz'.format(conf_file)
+
+def get_file_mtimes(files):
+    """Modification times of a list of files, None if a file doesn't exist
+    """
+    mtimes = []
+    for file in files:
+        try:
+            mtimes.append(os.path.getmtime(file))
+        except OSError:
+            mtimes.append(None)
+    
+    return mtimes
+    
+def write_conf_cache(conf, sens_columns, cache_file=None):
+    """Write parsed configuration parameters and sensitivity curves 
+    to a binary `~numpy` (npz) file
+    
+    Parameters
+    ----------
+    conf : `~grizli.grismconf.aXeConf`
+        Configuration object.
+    
+    sens_columns : dict
+        Columns of the sensitivity files from 
+        `aXeConf.read_sensitivity_columns`.
+    
+    cache_file : str or None
+        Output filename.  If None, use `get_conf_cache_filename`.
+    
+    Returns
+    -------
+    status : bool
+        False if the file couldn't be written, e.g., if the directory is 
+        read-only.
+    """
+    if cache_file is None:
+        cache_file = get_conf_cache_filename(conf.conf_file)
+    
+    files = [conf.conf_file] + list(conf.get_sensitivity_files().values())
+    
+    arrays = OrderedDict()
+    arrays['version'] = np.array(CONF_CACHE_VERSION)
+    arrays['files'] = np.array(files)
+    arrays['mtimes'] = np.array(get_file_mtimes(files), dtype=float)
+    
+    ### Pack the parameters in a few arrays since each array in the npz 
+    ### file has some overhead: kind = 0 (float), 1 (str), 2 (array)
+    keys = list(conf.conf.keys())
+    kind = np.zeros(len(keys), dtype=int)
+    floats = np.zeros(len(keys))
+    strings = []
+    arr_values = []
+    arr_size = np.zeros(len(keys), dtype=int)
+    for i, key in enumerate(keys):
+        value = conf.conf[key]
+        if isinstance(value, np.ndarray):
+            kind[i] = 2
+            arr_values.append(value)
+            arr_size[i] = len(value)
+            strings.append('')
+        elif isinstance(value, float):
+            floats[i] = value
+            strings.append('')
+        else:
+            kind[i] = 1
+            strings.append(value)
+    
+    arrays['conf_keys'] = np.array(keys)
+    arrays['conf_kind'] = kind
+    arrays['conf_float'] = floats
+    arrays['conf_str'] = np.array(strings)
+    arrays['conf_arr_size'] = arr_size
+    if len(arr_values) > 0:
+        arrays['conf_arr'] = np.hstack(arr_values)
+    else:
+        arrays['conf_arr'] = np.zeros(0)
+    
+    ### Sensitivity columns stacked in a 2D array for each beam
+    arrays['sens_beams'] = np.array(list(sens_columns.keys()))
+    for beam in sens_columns:
+        cols = list(sens_columns[beam].keys())
+        arrays['sens_{0}_cols'.format(beam)] = np.array(cols)
+        arrays['sens_{0}'.format(beam)] = np.array([sens_columns[beam][col] 
+                                                    for col in cols])
+    
+    ### Write to a temporary file first so that other processes don't see 
+    ### partial files
+    tmp_file = '{0}.{1:d}.tmp.npz'.format(cache_file, os.getpid())
+    try:
+        np.savez(tmp_file, **arrays)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file):
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+                
+        return False
+    
+    return True
+
+def read_conf_cache(conf_file, cache_file=None):
+    """Read a configuration file from the binary cache
+    
+    Parameters
+    ----------
+    conf_file : str
+        Filename of the configuration file
+    
+    cache_file : str or None
+        Cache filename.  If None, use `get_conf_cache_filename`.
+        
+    Returns
+    -------
+    conf : `~grizli.grismconf.aXeConf` or None
+        Configuration object, or None if the cache doesn't exist or is out 
+        of date with respect to the modification times of the 
+        configuration and sensitivity files.
+    """
+    if cache_file is None:
+        cache_file = get_conf_cache_filename(conf_file)
+    
+    if not os.path.exists(cache_file):
+        return None
+    
+    try:
+        npz = np.load(cache_file)
+        if int(npz['version']) != CONF_CACHE_VERSION:
+            return None
+    
+        files = [str(f) for f in npz['files']]
+        if os.path.abspath(files[0]) != os.path.abspath(conf_file):
+            return None
+        
+        mtimes = get_file_mtimes(files)
+        if None in mtimes:
+            return None
+            
+        if not np.all(np.array(mtimes) == npz['mtimes']):
+            return None
+        
+        kind = npz['conf_kind']
+        floats = npz['conf_float']
+        strings = npz['conf_str']
+        arr = npz['conf_arr']
+        arr_index = np.append(0, np.cumsum(npz['conf_arr_size']))
+        
+        params = OrderedDict()
+        for i, key in enumerate(npz['conf_keys']):
+            if kind[i] == 0:
+                params[str(key)] = float(floats[i])
+            elif kind[i] == 1:
+                params[str(key)] = str(strings[i])
+            else:
+                params[str(key)] = arr[arr_index[i]:arr_index[i+1]]
+        
+        sens_columns = OrderedDict()
+        for beam in npz['sens_beams']:
+            beam = str(beam)
+            data = npz['sens_{0}'.format(beam)]
+            sens_columns[beam] = OrderedDict()
+            for j, col in enumerate(npz['sens_{0}_cols'.format(beam)]):
+                sens_columns[beam][str(col)] = data[j,:]
+    except:
+        ### Corrupt or incompatible file
+        return None
+        
+    conf = aXeConf(conf_file=None)
+    conf.set_conf(params, conf_file)
+    conf.get_beams(sens_columns=sens_columns)
+    
+    return conf
+    
+def load_grism_config(conf_file, use_registry=True, use_cache=True,
+                      write_cache=None):
     """Load parameters from an aXe configuration file
     
     Parameters
@@ -532,12 +1102,56 @@ def load_grism_config(conf_file):
     conf_file : str
         Filename of the configuration file
     
+    use_registry : bool
+        Return the `aXeConf` object already loaded for the same file in 
+        this process, if the configuration and sensitivity files haven't 
+        been modified since.  The registry is `grismconf.conf_registry`.
+        
+    use_cache : bool
+        Read the parsed configuration from a binary cache file next to 
+        `conf_file` (see `get_conf_cache_filename`) if it exists.  The 
+        cache is ignored if it's older than the configuration or 
+        sensitivity files.
+    
+    write_cache : bool or None
+        Create or update the cache file if necessary and possible, e.g., 
+        for a shared installation of the configuration files.  If None, 
+        use `grismconf.WRITE_CONF_CACHE`, which is False by default.
+        
     Returns
     -------
     conf : `~grizli.grismconf.aXeConf`
         Configuration file object.  Runs `conf.get_beams()` to read the 
-        sensitivity curves.
+        sensitivity curves.  Objects from the registry are shared and 
+        shouldn't be modified.
     """
-    conf = aXeConf(conf_file)
-    conf.get_beams()
+    key = os.path.abspath(conf_file)
+    
+    if use_registry:
+        with conf_registry_lock:
+            if key in conf_registry:
+                conf, files, mtimes = conf_registry[key]
+                if get_file_mtimes(files) == mtimes:
+                    return conf
+    
+    conf = None
+    if use_cache:
+        conf = read_conf_cache(conf_file)
+    
+    if conf is None:
+        conf = aXeConf(conf_file)
+        sens_columns = conf.read_sensitivity_columns()
+        conf.get_beams(sens_columns=sens_columns)
+        
+        if write_cache is None:
+            write_cache = WRITE_CONF_CACHE
+            
+        if write_cache:
+            write_conf_cache(conf, sens_columns)
+    
+    if use_registry:
+        files = [conf_file] + list(conf.get_sensitivity_files().values())
+        with conf_registry_lock:
+            conf_registry[key] = (conf, files, get_file_mtimes(files))
+        
     return conf
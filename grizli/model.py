@@ -80,7 +80,7 @@ class GrismDisperser(object):
                        segmentation=None, origin=[500, 500], 
                        xcenter=0., ycenter=0., pad=0, grow=1, beam='A',
                        conf=['WFC3','F140W', 'G141'], scale=1.,
-                       fwcpos=None):
+                       fwcpos=None, model_dtype=np.float64):
         """Object for computing dispersed model spectra
         
         Parameters
@@ -129,6 +129,14 @@ class GrismDisperser(object):
         
         fwcpos : float
             Rotation position of the NIRISS filter wheel
+        
+        model_dtype : type
+            Data type of the `model` arrays, `numpy.float64` or 
+            `numpy.float32`.  The flux of each pixel along the trace is 
+            computed in double precision, but the contributions are summed 
+            in the precision of the model array, so single precision models
+            take half the memory and agree with the double precision ones to
+            a relative tolerance of about 1e-6.
             
         Attributes
         ----------
@@ -169,6 +177,10 @@ class GrismDisperser(object):
         total_flux : float
             Total f_lambda flux in the thumbail within the segmentation 
             region.
+        
+        pixel_list : dict or None
+            Cached list of the pixels of the segmentation region used by 
+            `compute_model`, see `get_pixel_list`.
         """
         
         self.id = id
@@ -181,6 +193,7 @@ class GrismDisperser(object):
         
         self.fwcpos = fwcpos
         self.scale = scale
+        self.model_dtype = model_dtype
         
         ### Direct image
         if direct is None:
@@ -203,6 +216,7 @@ class GrismDisperser(object):
         
         ### Initialize attributes        
         self.spectrum_1d =  None
+        self.pixel_list = None
         
         self.xc = self.sh[1]/2+self.origin[1]
         self.yc = self.sh[0]/2+self.origin[0]
@@ -249,12 +263,17 @@ class GrismDisperser(object):
         #xoff = -2.5 # test
         
         self.xoff = xoff
-        self.ytrace_beam, self.lam_beam = self.conf.get_beam_trace(
+        
+        ### Trace, wavelength and sensitivity (times the wavelength step per 
+        ### pixel for flux densities), cached in `self.conf`
+        out = self.conf.get_beam_trace_sensitivity(
                             x=(self.xc+self.xcenter-self.pad)/self.grow,
                             y=(self.yc+self.ycenter-self.pad)/self.grow,
                             dx=(self.dx+self.xcenter*0+self.xoff)/self.grow,
                             beam=self.beam, fwcpos=self.fwcpos)
         
+        self.ytrace_beam, self.lam_beam, self.sensitivity_beam = out
+        
         self.ytrace_beam *= self.grow
         
         ### Integer trace
@@ -264,25 +283,14 @@ class GrismDisperser(object):
         ### Account for pixel centering of the trace
         self.yfrac_beam = self.ytrace_beam - np.floor(self.ytrace_beam)
         
-        ### Interpolate the sensitivity curve on the wavelength grid. 
-        ysens = self.lam_beam*0
-        so = np.argsort(self.lam_beam)
-        ysens[so] = interp.interp_conserve_c(self.lam_beam[so],
-                                 self.conf.sens[self.beam]['WAVELENGTH'], 
-                                 self.conf.sens[self.beam]['SENSITIVITY'])
-        self.lam_sort = so
-        
-        ### Needs term of delta wavelength per pixel for flux densities
-        dl = np.abs(np.append(self.lam_beam[1] - self.lam_beam[0],
-                              np.diff(self.lam_beam)))
-        ysens *= 1.e-17*dl
-        self.sensitivity_beam = ysens
+        self.lam_sort = np.argsort(self.lam_beam)
         
         ### Initialize the model arrays
         self.NX = len(self.dx)
         self.sh_beam = (self.sh[0], self.sh[1]+self.NX)
         
-        self.modelf = np.zeros(np.product(self.sh_beam), dtype=np.float)
+        model_dtype = getattr(self, 'model_dtype', np.float64)
+        self.modelf = np.zeros(np.product(self.sh_beam), dtype=model_dtype)
         self.model = self.modelf.reshape(self.sh_beam)
         self.idx = np.arange(self.modelf.size).reshape(self.sh_beam)
         
@@ -302,31 +310,26 @@ class GrismDisperser(object):
         # self.ytrace, self.lam = self.conf.get_beam_trace(x=self.xc,
         #                  y=self.yc, dx=self.dxfull, beam=self.beam)
         
-        self.ytrace, self.lam = self.conf.get_beam_trace(
+        out = self.conf.get_beam_trace_sensitivity(
                                 x=(self.xc+self.xcenter-self.pad)/self.grow,
                                 y=(self.yc+self.ycenter-self.pad)/self.grow,
                                 dx=(self.dxfull+self.xcenter+xoff)/self.grow,
                                 beam=self.beam, fwcpos=self.fwcpos)
         
+        self.ytrace, self.lam, self.sensitivity = out
         self.ytrace *= self.grow
         
-        ysens = self.lam*0
-        so = np.argsort(self.lam)
-        ysens[so] = interp.interp_conserve_c(self.lam[so],
-                                 self.conf.sens[self.beam]['WAVELENGTH'], 
-                                 self.conf.sens[self.beam]['SENSITIVITY'])
-        
-        dl = np.abs(np.append(self.lam[1] - self.lam[0],
-                              np.diff(self.lam)))
-        ysens *= 1.e-17*dl
-        self.sensitivity = ysens
-        
         # Slices of the parent array based on the origin parameter
         self.slx_parent = slice(self.origin[1] + self.dxfull[0] + self.x0[1],
                             self.origin[1] + self.dxfull[-1] + self.x0[1]+1)
         
         self.sly_parent = slice(self.origin[0], self.origin[0] + self.sh[0])
         
+        ### Trace changed, so any precomputed response operator is stale
+        self.sparse_operator = None
+        self.sparse_id = None
+        self.sparse_arrays = None
+        
         #print 'XXX wavelength: %s %s %s' %(self.lam[-5:], self.lam_beam[-5:], dl[-5:])
             
     def add_ytrace_offset(self, yoffset):
@@ -339,12 +342,14 @@ class GrismDisperser(object):
             
         """
         
-        self.ytrace_beam, self.lam_beam = self.conf.get_beam_trace(
+        out = self.conf.get_beam_trace_sensitivity(
                                 x=(self.xc+self.xcenter-self.pad)/self.grow,
                                 y=(self.yc+self.ycenter-self.pad)/self.grow,
                             dx=(self.dx+self.xcenter*0+self.xoff)/self.grow,
                                 beam=self.beam, fwcpos=self.fwcpos)
         
+        self.ytrace_beam, self.lam_beam = out[:2]
+        
         self.ytrace_beam *= self.grow
         
         self.ytrace_beam += yoffset
@@ -363,17 +368,201 @@ class GrismDisperser(object):
             raise IndexError
             
         ###### Trace, wavelength, sensitivity across entire 2D array
-        self.ytrace, self.lam = self.conf.get_beam_trace(
+        out = self.conf.get_beam_trace_sensitivity(
                                 x=(self.xc+self.xcenter-self.pad)/self.grow,
                                 y=(self.yc+self.ycenter-self.pad)/self.grow,
                             dx=(self.dxfull+self.xcenter+self.xoff)/self.grow,
                                 beam=self.beam, fwcpos=self.fwcpos)
         
+        self.ytrace, self.lam = out[:2]
+        
         self.ytrace *= self.grow
         self.ytrace += yoffset
-                
+        
+        ### Rebuild the response operator for the shifted trace
+        if getattr(self, 'sparse_operator', None) is not None:
+            self.init_sparse_operator(id=self.sparse_id)
+    
+    def init_sparse_operator(self, id=None):
+        """Precompute a sparse operator for fast template models
+        
+        The dispersed model is linear in the 1D spectrum sampled on the 
+        `lam_beam` grid, so the result of `disperse.disperse_grism_object` 
+        can be written as
+        
+            >>> modelf = self.sparse_operator.dot(self.sensitivity_beam*spec)
+        
+        where `spec` is the template interpolated to `lam_beam`.  Once the
+        operator has been computed, `compute_model` uses it in place of the
+        loop over the direct image pixels.
+        
+        Parameters
+        ----------
+        id : int or None
+            Segmentation ID to use.  If `None`, use `self.id`.
+        
+        Returns
+        -------
+        Stores the `~scipy.sparse.csr_matrix` operator with shape
+        `(N_beam_pixels, len(lam_beam))` in `self.sparse_operator`.
+        
+        As for `get_pixel_list`, the operator is only used while the 
+        `direct` and `seg` arrays are the same objects it was computed 
+        from (see `use_sparse_operator`).  Run `init_sparse_operator` 
+        again after modifying them in place.
+        """
+        import scipy.sparse
+        
+        if id is None:
+            id = self.id
+        
+        nk = len(self.flat_index)
+        nl = self.modelf.size
+        shg = self.sh_beam
+        
+        ### Same pixels, in the same order, as the loop in the C helper
+        j, i, fl = self.get_pixel_list(id=id)
+        
+        k1 = self.flat_index[None,:] + (j*shg[1]+i)[:,None]
+        k2 = k1 - shg[1]
+        v1 = fl[:,None]*self.yfrac_beam[None,:]
+        v2 = fl[:,None]*(1-self.yfrac_beam[None,:])
+        
+        kcol = np.arange(nk)[None,:] + 0*k1
+        
+        rows = np.hstack([k1.flatten(), k2.flatten()])
+        cols = np.hstack([kcol.flatten(), kcol.flatten()])
+        vals = np.hstack([v1.flatten(), v2.flatten()])
+        
+        ok = (rows >= 0) & (rows < nl)
+        
+        A = scipy.sparse.coo_matrix((vals[ok], (rows[ok], cols[ok])),
+                                    shape=(nl, nk))
+        
+        self.sparse_operator = A.tocsr()
+        self.sparse_id = id
+        self.sparse_arrays = (self.direct, self.seg)
+    
+    def use_sparse_operator(self, id=None, thumb=None):
+        """Can `compute_model` use the operator of `init_sparse_operator`?
+        
+        Parameters
+        ----------
+        id, thumb : 
+            See `compute_model`.
+        
+        Returns
+        -------
+        status : bool
+            True if the operator was computed for `id` from the current 
+            `direct` and `seg` arrays and `thumb` is None.
+        """
+        if id is None:
+            id = self.id
+            
+        if getattr(self, 'sparse_operator', None) is None:
+            return False
+            
+        if (thumb is not None) | (id != getattr(self, 'sparse_id', None)):
+            return False
+            
+        arrays = getattr(self, 'sparse_arrays', None)
+        if arrays is None:
+            return False
+            
+        return (arrays[0] is self.direct) & (arrays[1] is self.seg)
+        
+    def get_pixel_list(self, id=None, thumb=None):
+        """Compact list of the pixels that contribute to the model
+        
+        Parameters
+        ----------
+        id : int or None
+            Segmentation ID.  If `None`, use `self.id`.
+        
+        thumb : `~numpy.ndarray` with shape = `self.sh` or None
+            Direct image.  If `None`, use `self.direct`.
+        
+        Returns
+        -------
+        jpix, ipix : `~numpy.ndarray` (int64)
+            Row and column offsets of the pixels relative to the thumbnail
+            center `self.x0`, sorted in the same (column-major) order as the
+            loop in `disperse.disperse_grism_object`.
+        
+        flux : `~numpy.ndarray` (float64)
+            Pixel values divided by 1.e-17.
+        
+        The list is cached in `self.pixel_list` and recomputed if `id` or 
+        the `thumb` or `self.seg` arrays are replaced.  Call 
+        `clear_pixel_list` after modifying the arrays in place.
+        """
+        if id is None:
+            id = self.id
+        
+        if thumb is None:
+            thumb = self.direct
+            
+        cache = getattr(self, 'pixel_list', None)
+        if cache is not None:
+            if ((cache['id'] == id) & (cache['thumb'] is thumb) & 
+                (cache['seg'] is self.seg)):
+                return cache['jpix'], cache['ipix'], cache['flux']
+        
+        yp, xp = np.indices(self.sh)
+        valid = (self.seg == id) & (thumb != 0)
+        valid &= (yp < 2*self.x0[0]) & (xp < 2*self.x0[1])
+        
+        xpix, ypix = np.nonzero(valid.T)
+        flux = np.cast[np.double](thumb[ypix, xpix])/1.e-17
+        
+        jpix = np.cast[np.int64](ypix - self.x0[0])
+        ipix = np.cast[np.int64](xpix - self.x0[1])
+        
+        self.pixel_list = {'id':id, 'thumb':thumb, 'seg':self.seg, 
+                           'jpix':jpix, 'ipix':ipix, 'flux':flux}
+        
+        return jpix, ipix, flux
+    
+    def clear_pixel_list(self):
+        """Reset the cached pixel list, see `get_pixel_list`
+        """
+        self.pixel_list = None
+    
+    def copy(self):
+        """Copy that shares the arrays computed by `process_config`
+        
+        The new object has its own `model` and `modelf` arrays, but shares
+        the direct and segmentation thumbnails, the trace, wavelength and 
+        sensitivity arrays, and the cached pixel list and sparse operator 
+        with `self`.  These are replaced rather than modified in place by 
+        the methods of `GrismDisperser` (e.g., `add_ytrace_offset`), so the
+        copy is much cheaper than creating a new object, which has to 
+        recompute the trace and sensitivity.
+        
+        Returns
+        -------
+        beam : `GrismDisperser`
+            New object.
+        """
+        new = GrismDisperser.__new__(GrismDisperser)
+        new.__dict__.update(self.__dict__)
+        
+        new.modelf = self.modelf.copy()
+        new.model = new.modelf.reshape(self.sh_beam)
+        
+        return new
+    
+    def __getstate__(self):
+        """Don't pickle the pixel list cache, which is cheap to rebuild
+        """
+        state = self.__dict__.copy()
+        state['pixel_list'] = None
+        return state
+        
     def compute_model(self, id=None, thumb=None, spectrum_1d=None,
-                      in_place=True, outdata=None, scale=None):
+                      in_place=True, outdata=None, scale=None,
+                      spectra_1d=None, num_threads=1):
         """Compute a model 2D grism spectrum
 
         Parameters
@@ -399,18 +588,40 @@ class GrismDisperser(object):
         
         scale : float or None
            Multiplicative factor to apply to the modeled spectrum.
+        
+        spectra_1d : list of [`~numpy.array`, `~numpy.array`] or None
+            Optional list of 1D templates to model together in a single pass
+            over the thumbnail with `disperse.disperse_grism_object_multi`.
+            If specified, `spectrum_1d`, `in_place` and `outdata` are ignored
+            and the function returns an array of flattened models with shape
+            `(len(spectra_1d), self.modelf.size)`.
+        
+        num_threads : int
+            Number of OpenMP threads used by `disperse.disperse_pixel_list`.
+            The result is identical to the original serial calculation for
+            `num_threads=1`.
                        
         Returns
         -------
         model : `~numpy.ndarray`
             If `in_place` is False, returns the 2D model spectrum.  Otherwise
             the result is stored in `self.model` and `self.modelf`.
+        
+        If `init_sparse_operator` has been run for the same `id` and 
+        thumbnails and `thumb` is `None` (see `use_sparse_operator`), the 
+        model is computed with the precomputed sparse operator rather than 
+        with the loop over the direct image pixels.
         """
         
         if id is None:
             id = self.id
         else:
             self.id = id
+        
+        if spectra_1d is not None:
+            return self.compute_model_multi(id=id, thumb=thumb, 
+                                            spectra_1d=spectra_1d,
+                                            scale=scale)
             
         ### Template (1D) spectrum interpolated onto the wavelength grid
         if in_place:
@@ -440,27 +651,98 @@ class GrismDisperser(object):
                 outdata = self.modelf*0
                 
         ### Optionally use a different direct image
-        if thumb is None:
-            thumb = self.direct
-        else:
+        if thumb is not None:
             if thumb.shape != self.sh:
                 print("""
 Error: `thumb` must have the same dimensions as the direct image! ({0:d},{1:d})      
                 """.format(self.sh[0], self.sh[1]))
                 return False
 
-        ### Now compute the dispersed spectrum using the C helper
-        status = disperse.disperse_grism_object(thumb, self.seg, id,
+        ### Precomputed response: interpolated spectrum x sparse operator
+        if self.use_sparse_operator(id=id, thumb=thumb):
+            spec = self.sensitivity_beam*scale_spec
+            outdata += self.sparse_operator.dot(spec)
+            if not in_place:
+                return outdata
+            else:
+                return True
+                
+        ### Now compute the dispersed spectrum using the C helper and the
+        ### cached list of segment pixels
+        jpix, ipix, flux = self.get_pixel_list(id=id, thumb=thumb)
+        
+        status = disperse.disperse_pixel_list(jpix, ipix, flux,
                                  self.flat_index, self.yfrac_beam,
                                  self.sensitivity_beam*scale_spec,
-                                 outdata, self.x0, np.array(self.sh),
-                                 self.x0, np.array(self.sh_beam))
+                                 outdata, np.array(self.sh_beam),
+                                 num_threads=num_threads)
 
         if not in_place:
             return outdata
         else:
             return True
     
+    def compute_model_multi(self, id=None, thumb=None, spectra_1d=[], 
+                            scale=None):
+        """Compute 2D models for a list of 1D templates at once
+        
+        Parameters
+        ----------
+        id, thumb, scale : 
+            See `compute_model`.
+        
+        spectra_1d : list of [`~numpy.array`, `~numpy.array`]
+            List of 1D templates [wave, flux].  An entry of `None` 
+            corresponds to the trivial spectrum flat in f_lambda.
+        
+        Returns
+        -------
+        models : `~numpy.ndarray`
+            Flattened 2D models with shape `(len(spectra_1d), 
+            self.modelf.size)`.
+        """
+        if id is None:
+            id = self.id
+        
+        if scale is None:
+            scale = self.scale
+        
+        ### Templates interpolated onto the wavelength grid
+        NS = len(spectra_1d)
+        scale_spec = np.zeros((NS, len(self.lam_beam)))
+        int_func = interp.interp_conserve_c
+        for i, spectrum_1d in enumerate(spectra_1d):
+            if spectrum_1d is None:
+                scale_spec[i,:] = scale
+            else:
+                xspec, yspec = spectrum_1d
+                scale_spec[i, self.lam_sort] = int_func(
+                                           self.lam_beam[self.lam_sort],
+                                           xspec, yspec)*scale
+        
+        ysens = self.sensitivity_beam*scale_spec
+        outdata = np.zeros((NS, self.modelf.size), dtype=self.modelf.dtype)
+        
+        if thumb is not None:
+            if thumb.shape != self.sh:
+                print("""
+Error: `thumb` must have the same dimensions as the direct image! ({0:d},{1:d})      
+                """.format(self.sh[0], self.sh[1]))
+                return False
+        
+        ### Precomputed response operator
+        if self.use_sparse_operator(id=id, thumb=thumb):
+            outdata += self.sparse_operator.dot(ysens.T).T
+            return outdata
+        
+        jpix, ipix, flux = self.get_pixel_list(id=id, thumb=thumb)
+        
+        status = disperse.disperse_pixel_list_multi(jpix, ipix, flux,
+                                 self.flat_index, self.yfrac_beam, ysens,
+                                 outdata, np.array(self.sh_beam))
+        
+        return outdata
+        
     def optimal_extract(self, data, bin=0, ivar=1., weight=1.):        
         """`Horne (1986) <http://adsabs.harvard.edu/abs/1986PASP...98..609H>`_ optimally-weighted 1D extraction
         
@@ -1322,7 +1604,7 @@ class ImageData(object):
         return blotted
     
     def get_slice(self, slx=slice(480,520), sly=slice(480,520), 
-                 get_slice_header=True):
+                  get_slice_header=True, lazy=False):
         """Return cutout version of the `ImageData` object
         
         Parameters
@@ -1334,6 +1616,11 @@ class ImageData(object):
             Compute the full header of the slice.  This takes a bit of time
             and isn't necessary in all cases so can be omitted if only the 
             sliced data are of interest and the header isn't needed.
+        
+        lazy : bool
+            Return an `ImageDataSlice` object, where the data arrays are 
+            read-only views of the arrays of `self` and the WCS and header 
+            are only computed when they are first accessed.
             
         Returns
         -------
@@ -1353,31 +1640,22 @@ class ImageData(object):
         if (origin[1] < 0) | (origin[1]+NX > self.sh[1]):
             raise ValueError ('Out of range in x')
         
+        if lazy:
+            return ImageDataSlice(self, slx=slx, sly=sly, 
+                                  get_slice_header=get_slice_header)
+            
         ### Sliced subimage
         # sly = slice(origin[0], origin[0]+N)
         # slx = slice(origin[1], origin[1]+N)
         
         slice_origin = [self.origin[i] + origin[i] for i in range(2)]
         
-        slice_wcs = self.wcs.slice((sly, slx))
-        slice_wcs.naxis1 = slice_wcs._naxis1 = NX
-        slice_wcs.naxis2 = slice_wcs._naxis2 = NY
+        slice_wcs = self.get_slice_wcs(slx, sly)
         
         ### Getting the full header can be slow as there appears to 
         ### be substantial overhead with header.copy() and wcs.to_header()
         if get_slice_header:
-            slice_header = self.header.copy()
-            slice_header['NAXIS1'] = NX
-            slice_header['NAXIS2'] = NY
-        
-            ### Sliced WCS keywords
-            hwcs = slice_wcs.to_header(relax=True)
-            for k in hwcs:
-                if not k.startswith('PC'):
-                    slice_header[k] = hwcs[k]
-                else:
-                    cd = k.replace('PC','CD')
-                    slice_header[cd] = hwcs[k]
+            slice_header = self.get_slice_header(slice_wcs, NX, NY)
         else:
             slice_header = pyfits.Header()
             
@@ -1409,24 +1687,86 @@ class ImageData(object):
         slice_obj.sci_extn = self.sci_extn
         slice_obj.is_slice = True
         
-        if hasattr(slice_obj.wcs, 'sip'):
-            if slice_obj.wcs.sip is not None:
+        return slice_obj#, slx, sly
+    
+    def get_slice_wcs(self, slx, sly, wcs=None):
+        """WCS of a cutout, see `get_slice`
+        
+        Parameters
+        ----------
+        slx, sly : slice
+            Slices in x and y dimensions.
+        
+        wcs : None or `~astropy.wcs.WCS`
+            WCS to slice.  If None, use `self.wcs`.
+            
+        Returns
+        -------
+        slice_wcs : `~astropy.wcs.WCS`
+            Sliced WCS, including the SIP and lookup table offsets.
+        """
+        if wcs is None:
+            wcs = self.wcs
+            
+        slice_wcs = wcs.slice((sly, slx))
+        slice_wcs.naxis1 = slice_wcs._naxis1 = slx.stop - slx.start
+        slice_wcs.naxis2 = slice_wcs._naxis2 = sly.stop - sly.start
+        
+        if hasattr(slice_wcs, 'sip'):
+            if slice_wcs.sip is not None:
                 for c in [0,1]:
-                    slice_obj.wcs.sip.crpix[c] = slice_obj.wcs.wcs.crpix[c]
+                    slice_wcs.sip.crpix[c] = slice_wcs.wcs.crpix[c]
         
         ACS_CRPIX = [4096/2,2048/2] # ACS
-        dx_crpix = slice_obj.wcs.wcs.crpix[0] - ACS_CRPIX[0]
-        dy_crpix = slice_obj.wcs.wcs.crpix[1] - ACS_CRPIX[1]
+        dx_crpix = slice_wcs.wcs.crpix[0] - ACS_CRPIX[0]
+        dy_crpix = slice_wcs.wcs.crpix[1] - ACS_CRPIX[1]
         for ext in ['cpdis1','cpdis2','det2im1','det2im2']:
-            if hasattr(slice_obj.wcs, ext):
-                wcs_ext = slice_obj.wcs.__getattribute__(ext)
+            if hasattr(slice_wcs, ext):
+                wcs_ext = slice_wcs.__getattribute__(ext)
                 if wcs_ext is not None:
                     wcs_ext.crval[0] += dx_crpix
                     wcs_ext.crval[1] += dy_crpix
-                    slice_obj.wcs.__setattr__(ext, wcs_ext)
-                           
-        return slice_obj#, slx, sly
+                    slice_wcs.__setattr__(ext, wcs_ext)
+        
+        return slice_wcs
+    
+    def get_slice_header(self, slice_wcs, NX, NY, header=None):
+        """Header of a cutout, see `get_slice`
+        
+        Parameters
+        ----------
+        slice_wcs : `~astropy.wcs.WCS`
+            WCS of the cutout from `get_slice_wcs`.
+        
+        NX, NY : int
+            Cutout dimensions.
+        
+        header : None or `~astropy.io.fits.Header`
+            Header to update.  If None, use `self.header`.
+            
+        Returns
+        -------
+        slice_header : `~astropy.io.fits.Header`
+            Copy of the header with the updated dimensions and WCS.
+        """
+        if header is None:
+            header = self.header
+            
+        slice_header = header.copy()
+        slice_header['NAXIS1'] = NX
+        slice_header['NAXIS2'] = NY
     
+        ### Sliced WCS keywords
+        hwcs = slice_wcs.to_header(relax=True)
+        for k in hwcs:
+            if not k.startswith('PC'):
+                slice_header[k] = hwcs[k]
+            else:
+                cd = k.replace('PC','CD')
+                slice_header[cd] = hwcs[k]
+        
+        return slice_header
+        
     def get_HDUList(self, extver=1):
         """Convert attributes and data arrays to a `~astropy.io.fits.HDUList`
         
@@ -1491,87 +1831,758 @@ class ImageData(object):
         else:
             return self.data[ext]/self.photflam
             
-class GrismFLT(object):
-    """Scripts for modeling of individual grism FLT images"""
-    def __init__(self, grism_file='', sci_extn=1, direct_file='',
-                 pad=200, ref_file=None, ref_ext=0, seg_file=None,
-                 shrink_segimage=True, force_grism='G141', verbose=True):
-        """Read FLT files and, optionally, reference/segmentation images.
+class ImageDataSlice(ImageData):
+    def __init__(self, parent, slx=slice(480,520), sly=slice(480,520), 
+                 get_slice_header=True):
+        """Lightweight cutout of an `ImageData` object
+        
+        Made by `ImageData.get_slice` with ``lazy=True``.  The data arrays
+        are read-only views of the arrays of `parent`, so making the cutout
+        doesn't copy or rescale the pixels, and the sliced WCS and header
+        are only computed when the `wcs` and `header` attributes are first
+        accessed.  Use `ImageData.get_slice` with ``lazy=False`` for 
+        cutouts whose arrays have to be modified in place.
         
         Parameters
         ----------
-        grism_file : str
-            Grism image (optional).
-            Empty string or filename of a FITS file that must contain
-            extensions ('SCI', `sci_extn`), ('ERR', `sci_extn`), and
-            ('DQ', `sci_extn`).  For example, a WFC3/IR "FLT" FITS file.
-            
-        sci_extn : int
-            EXTNAME of the file to consider.  For WFC3/IR this can only be 
-            1.  For ACS and WFC3/UVIS, this can be 1 or 2 to specify the two
-            chips.
-            
-        direct_file : str
-            Direct image (optional).
-            Empty string or filename of a FITS file that must contain
-            extensions ('SCI', `sci_extn`), ('ERR', `sci_extn`), and
-            ('DQ', `sci_extn`).  For example, a WFC3/IR "FLT" FITS file.
+        parent : `ImageData`
+            Full image.
         
-        pad : int
-            Padding to add around the periphery of the images to allow 
-            modeling of dispersed spectra for objects that could otherwise 
-            fall off of the direct image itself.  Modeling them requires an 
-            external reference image (`ref_file`) that covers an area larger
-            than the individual direct image itself (e.g., a mosaic of a 
-            survey field).
+        slx, sly : slice
+            Slices in x and y dimensions to extract
         
-            For WFC3/IR spectra, the first order spectra reach 248 and 195 
-            pixels for G102 and G141, respectively, and `pad` could be set
-            accordingly if the reference image is large enough.
+        get_slice_header : bool
+            See `ImageData.get_slice`.  If False, the `header` attribute is
+            an empty `~astropy.io.fits.Header`.
+        """
+        self.is_slice = True
         
-        ref_file : str or `~astropy.io.fits.ImageHDU`/`~astropy.io.fits.PrimaryHDU`
-            Image mosaic to use as the reference image in place of the direct
-            image itself.  For example, this could be the deeper image
-            drizzled from all direct images taken within a single visit or it
-            could be a much deeper/wider image taken separately in perhaps 
-            even a different filter.
-            
-            .. note::
-                Assumes that the WCS are aligned between `grism_file`, 
-                `direct_file` and `ref_file`!
-            
-        ref_ext : int
-            FITS extension to use if `ref_file` is a filename string.
+        self.origin = [parent.origin[0] + sly.start, 
+                       parent.origin[1] + slx.start]
         
-        seg_file : str or `~astropy.io.fits.ImageHDU`/`~astropy.io.fits.PrimaryHDU`
-            Segmentation image mosaic to associate pixels with discrete 
-            objects.  This would typically be generated from a rectified 
-            image like `ref_file`, though here it is not required that 
-            `ref_file` and `seg_file` have the same image dimensions but 
-            rather just that the WCS are aligned between them.
+        self.data = OrderedDict()
+        for key in parent.data:
+            if parent.data[key] is None:
+                self.data[key] = None
+            else:
+                view = parent.data[key][sly, slx]
+                view.flags.writeable = False
+                self.data[key] = view
         
-        shrink_segimage : bool
-            Try to make a smaller cutout of the reference images to speed 
-            up blotting and array copying.  This is most helpful for very 
-            large input mosaics.
+        self.sh = np.array(self.data['SCI'].shape)
         
-        force_grism : str
-            Use this grism in "simulation mode" where only `direct_file` is
-            specified.
-            
-        verbose : bool
-            Print status messages to the terminal.
+        for attr in ['pad', 'fwcpos', 'filter', 'pupil', 'instrument',
+                     'photflam', 'photplam', 'ABZP', 'thumb_extension',
+                     'ref_photflam', 'ref_photplam', 'ref_filter', 'grow',
+                     'parent_file', 'ref_file', 'sci_extn']:
+            setattr(self, attr, getattr(parent, attr, None))
+        
+        ### Parameters for the lazy WCS and header
+        self._parent_wcs = parent.wcs
+        self._parent_header = parent.header
+        self._slx = slx
+        self._sly = sly
+        self._get_slice_header = get_slice_header
+        self._wcs = None
+        self._header = None
+    
+    @property
+    def wcs(self):
+        """Sliced WCS, computed on first access"""
+        if self._wcs is None:
+            self._wcs = self.get_slice_wcs(self._slx, self._sly, 
+                                           wcs=self._parent_wcs)
+            
+        return self._wcs
+    
+    @wcs.setter
+    def wcs(self, value):
+        self._wcs = value
+    
+    @property
+    def header(self):
+        """Sliced header, computed on first access"""
+        if self._header is None:
+            if self._get_slice_header:
+                NY, NX = self.sh
+                self._header = self.get_slice_header(self.wcs, NX, NY,
+                                                header=self._parent_header)
+            else:
+                self._header = pyfits.Header()
+                
+        return self._header
+    
+    @header.setter
+    def header(self, value):
+        self._header = value
+        
+class SparseModelStore(object):
+    def __init__(self, shape, dtype=np.float32):
+        """Sparse storage of the dispersed models of individual objects
+        
+        The model of each spectral order ("beam") of each object is stored
+        as the smallest rectangle of the full detector array that contains
+        all of its non-zero pixels.  An object's contribution can then be 
+        subtracted from or added to a full-frame model in a time that 
+        scales with the size of its footprint rather than with the cost 
+        of recomputing the dispersed spectrum.
+        
+        Parameters
+        ----------
+        shape : tuple
+            Shape of the full detector array, e.g., `GrismFLT.model.shape`.
+        
+        dtype : type
+            Data type of the stored values.
         
         Attributes
         ----------
-        grism, direct : `ImageData`
-            Grism and direct image data and parameters
+        objects : `~collections.OrderedDict`
+            Keys are object ids and values are `~collections.OrderedDict` 
+            objects with keys of the beam names and values of 
+            ``(sly, slx, values)`` tuples, where ``sly, slx`` are slices of
+            the full array.
+            
+        """
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.objects = OrderedDict()
+    
+    def __contains__(self, id):
+        return id in self.objects
+    
+    def __len__(self):
+        return len(self.objects)
+    
+    @property 
+    def nbytes(self):
+        """Total size of the stored arrays"""
+        nbytes = 0
+        for id in self.objects:
+            for beam in self.objects[id]:
+                nbytes += self.objects[id][beam][2].nbytes
         
-        conf : `~grizli.grismconf.aXeConf`
-            Grism configuration object.
-                
-        seg : array-like
-            Segmentation image array.
+        return nbytes
+        
+    @staticmethod
+    def get_beam_slices(beam, shape):
+        """Overlap of a `GrismDisperser` cutout and a full array
+        
+        Parameters
+        ----------
+        beam : `GrismDisperser`
+            Dispersed beam.
+        
+        shape : tuple
+            Shape of the full array.
+        
+        Returns
+        -------
+        full_slices, beam_slices : (slice, slice) or None
+            Slices of the full array and of the beam arrays (e.g., 
+            `beam.model`) of the overlapping region, or None if they 
+            don't overlap.
+        """
+        y0 = beam.origin[0]
+        x0 = beam.origin[1] + beam.dxfull[0] + beam.x0[1]
+        ny, nx = beam.sh_beam
+        
+        ylo, yhi = np.maximum(y0, 0), np.minimum(y0+ny, shape[0])
+        xlo, xhi = np.maximum(x0, 0), np.minimum(x0+nx, shape[1])
+        if (yhi <= ylo) | (xhi <= xlo):
+            return None, None
+        
+        full_slices = (slice(ylo, yhi), slice(xlo, xhi))
+        beam_slices = (slice(ylo-y0, yhi-y0), slice(xlo-x0, xhi-x0))
+        return full_slices, beam_slices
+        
+    def compress(self, beam, data=None):
+        """Crop a beam model to the non-zero pixels within the full array
+        
+        Parameters
+        ----------
+        beam : `GrismDisperser`
+            Dispersed beam.
+        
+        data : None or `~numpy.ndarray`
+            Array with the shape of the beam cutout.  If None, use 
+            `beam.model`.
+        
+        Returns
+        -------
+        sly, slx : slice
+            Slices of the full array.
+        
+        values : `~numpy.ndarray`
+            Cropped values, or None if the beam doesn't overlap the full 
+            array or has no non-zero pixels.
+        """
+        if data is None:
+            data = beam.model
+        
+        full_slices, beam_slices = self.get_beam_slices(beam, self.shape)
+        if full_slices is None:
+            return None, None, None
+        
+        sub = data[beam_slices]
+        nonzero = sub != 0
+        
+        rows = np.where(nonzero.any(axis=1))[0]
+        if len(rows) == 0:
+            return None, None, None
+            
+        cols = np.where(nonzero.any(axis=0))[0]
+        
+        sly = slice(full_slices[0].start+rows[0],
+                    full_slices[0].start+rows[-1]+1)
+        slx = slice(full_slices[1].start+cols[0],
+                    full_slices[1].start+cols[-1]+1)
+        
+        values = np.asarray(sub[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1],
+                            dtype=self.dtype).copy()
+        
+        return sly, slx, values
+        
+    def set_beam(self, id, beam_name, beam, data=None, full_array=None):
+        """Store the model of a single beam of an object
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        beam_name : str
+            Beam name, e.g., 'A'.
+        
+        beam : `GrismDisperser`
+            Dispersed beam.
+        
+        data : None or `~numpy.ndarray`
+            Model to store.  If None, use `beam.model`.
+        
+        full_array : None or `~numpy.ndarray`
+            If specified, subtract the previously stored model of this beam
+            from `full_array` and add the new one, in place.
+            
+        """
+        if id not in self.objects:
+            self.objects[id] = OrderedDict()
+        
+        if (full_array is not None) & (beam_name in self.objects[id]):
+            sly, slx, values = self.objects[id][beam_name]
+            full_array[sly, slx] -= values
+            
+        sly, slx, values = self.compress(beam, data=data)
+        if values is None:
+            self.objects[id].pop(beam_name, None)
+            return False
+        
+        self.objects[id][beam_name] = (sly, slx, values)
+        if full_array is not None:
+            full_array[sly, slx] += values
+        
+        return True
+    
+    def remove(self, id, full_array=None):
+        """Remove an object from the store
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        full_array : None or `~numpy.ndarray`
+            If specified, subtract the stored model of the object from 
+            `full_array` in place.
+        
+        Returns
+        -------
+        status : bool
+            False if `id` wasn't in the store.
+        """
+        if id not in self.objects:
+            return False
+        
+        if full_array is not None:
+            self.add_object(id, full_array, scale=-1)
+        
+        self.objects.pop(id)
+        return True
+        
+    def add_object(self, id, full_array, scale=1):
+        """Add the stored model of an object to a full array in place
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        full_array : `~numpy.ndarray`
+            Array with shape `self.shape`.
+        
+        scale : float
+            Scale factor, e.g., -1 to subtract.
+        
+        """
+        for beam_name in self.objects.get(id, {}):
+            sly, slx, values = self.objects[id][beam_name]
+            if scale == 1:
+                full_array[sly, slx] += values
+            elif scale == -1:
+                full_array[sly, slx] -= values
+            else:
+                full_array[sly, slx] += scale*values
+                
+    def get_bounding_box(self, id):
+        """Bounding box of all of the stored beams of an object
+        
+        Returns
+        -------
+        sly, slx : slice
+            Slices of the full array, or (None, None) if the object isn't 
+            stored.
+        """
+        beams = self.objects.get(id, {})
+        if len(beams) == 0:
+            return None, None
+            
+        ylo = np.min([beams[b][0].start for b in beams])
+        yhi = np.max([beams[b][0].stop for b in beams])
+        xlo = np.min([beams[b][1].start for b in beams])
+        xhi = np.max([beams[b][1].stop for b in beams])
+        
+        return slice(ylo, yhi), slice(xlo, xhi)
+    
+    def get_overlapping_ids(self, sly, slx, exclude=[]):
+        """Objects with stored beams overlapping a region of the full array
+        
+        Parameters
+        ----------
+        sly, slx : slice
+            Region of the full array.
+        
+        exclude : list
+            Ids to skip.
+        
+        Returns
+        -------
+        ids : list
+            Overlapping object ids.
+        """
+        ids = []
+        for id in self.objects:
+            if id in exclude:
+                continue
+            
+            for beam_name in self.objects[id]:
+                bsly, bslx, values = self.objects[id][beam_name]
+                if ((bsly.start < sly.stop) & (bsly.stop > sly.start) &
+                    (bslx.start < slx.stop) & (bslx.stop > slx.start)):
+                    ids.append(id)
+                    break
+        
+        return ids
+        
+    def get_contamination(self, id, sly=None, slx=None):
+        """Model of the other objects in the footprint of an object
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        sly, slx : None or slice
+            Region of the full array.  If None, use the bounding box of 
+            the stored beams of `id`.
+        
+        Returns
+        -------
+        sly, slx : slice
+            Region of the full array.
+        
+        contam : `~numpy.ndarray`
+            Sum of the stored models of all objects other than `id` in the
+            region.
+        """
+        if (sly is None) | (slx is None):
+            sly, slx = self.get_bounding_box(id)
+            if sly is None:
+                return None, None, None
+        
+        contam = np.zeros((sly.stop-sly.start, slx.stop-slx.start),
+                          dtype=self.dtype)
+        
+        for oid in self.get_overlapping_ids(sly, slx, exclude=[id]):
+            for beam_name in self.objects[oid]:
+                bsly, bslx, values = self.objects[oid][beam_name]
+                ylo = np.maximum(bsly.start, sly.start)
+                yhi = np.minimum(bsly.stop, sly.stop)
+                xlo = np.maximum(bslx.start, slx.start)
+                xhi = np.minimum(bslx.stop, slx.stop)
+                if (yhi <= ylo) | (xhi <= xlo):
+                    continue
+                    
+                contam[ylo-sly.start:yhi-sly.start,
+                       xlo-slx.start:xhi-slx.start] += \
+                           values[ylo-bsly.start:yhi-bsly.start,
+                                  xlo-bslx.start:xhi-bslx.start]
+        
+        return sly, slx, contam
+        
+    def get_object_model(self, id, sly, slx, beams=None):
+        """Stored model of a single object in a region of the full array
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        sly, slx : slice
+            Region of the full array.
+        
+        beams : None or list
+            Beams to include.  If None, include all stored beams.
+        
+        Returns
+        -------
+        model : `~numpy.ndarray`
+            Model of the object in the region.
+        """
+        model = np.zeros((sly.stop-sly.start, slx.stop-slx.start),
+                         dtype=self.dtype)
+        
+        for beam_name in self.objects.get(id, {}):
+            if (beams is not None) and (beam_name not in beams):
+                continue
+            
+            bsly, bslx, values = self.objects[id][beam_name]
+            ylo = np.maximum(bsly.start, sly.start)
+            yhi = np.minimum(bsly.stop, sly.stop)
+            xlo = np.maximum(bslx.start, slx.start)
+            xhi = np.minimum(bslx.stop, slx.stop)
+            if (yhi <= ylo) | (xhi <= xlo):
+                continue
+            
+            model[ylo-sly.start:yhi-sly.start,
+                  xlo-slx.start:xhi-slx.start] += \
+                      values[ylo-bsly.start:yhi-bsly.start,
+                             xlo-bslx.start:xhi-bslx.start]
+        
+        return model
+        
+    def get_dense_model(self, ids=None, exclude=[], dtype=None):
+        """Reconstruct a full-frame model from the stored objects
+        
+        Parameters
+        ----------
+        ids : None or list
+            Objects to include.  If None, include all stored objects.
+            
+        exclude : list
+            Objects to leave out.
+        
+        dtype : None or type
+            Data type of the output array.  If None, use `self.dtype`.
+            
+        Returns
+        -------
+        model : `~numpy.ndarray`
+            Full array with shape `self.shape`.
+        """
+        if dtype is None:
+            dtype = self.dtype
+            
+        model = np.zeros(self.shape, dtype=dtype)
+        if ids is None:
+            ids = self.objects.keys()
+            
+        for id in ids:
+            if id in exclude:
+                continue
+            
+            self.add_object(id, model)
+        
+        return model
+        
+class FootprintIndex(object):
+    def __init__(self, shape, cell_size=64):
+        """Uniform-grid spatial index of rectangular footprints
+        
+        Used for the bounding boxes of the dispersed spectral orders of the
+        objects in a grism exposure, see 
+        `GrismFLT.build_footprint_index`.
+        
+        Parameters
+        ----------
+        shape : tuple
+            Shape of the full detector array.
+        
+        cell_size : int
+            Size of the grid cells, in pixels.
+        
+        Attributes
+        ----------
+        ids, beams : `~numpy.ndarray`
+            Object id and beam name of each footprint.
+        
+        boxes : `~numpy.ndarray`, shape (N, 4)
+            Footprint bounding boxes ``[ylo, yhi, xlo, xhi]``, with upper 
+            limits excluded (i.e., ``full[ylo:yhi, xlo:xhi]``).
+        
+        cells : dict
+            Indices of the footprints overlapping each grid cell, with keys
+            ``(iy, ix)`` of the cell indices.
+        """
+        self.shape = tuple(shape)
+        self.cell_size = int(cell_size)
+        self.ids = np.zeros(0, dtype=int)
+        self.beams = np.zeros(0, dtype=str)
+        self.boxes = np.zeros((0, 4), dtype=int)
+        self.cells = {}
+        self.id_index = {}
+        
+    def __len__(self):
+        return len(self.ids)
+        
+    def build(self, ids, beams, boxes):
+        """Build the index
+        
+        Parameters
+        ----------
+        ids : list or `~numpy.ndarray`
+            Object id of each footprint.
+        
+        beams : list or `~numpy.ndarray`
+            Beam name of each footprint.
+        
+        boxes : array-like, shape (N, 4)
+            Bounding boxes ``[ylo, yhi, xlo, xhi]``.  Boxes are clipped to
+            the full array and boxes that fall outside of it are dropped.
+        
+        """
+        boxes = np.cast[int](np.atleast_2d(boxes)).reshape((-1, 4))
+        ids = np.atleast_1d(ids)
+        beams = np.atleast_1d(beams)
+        
+        boxes[:,0:2] = np.clip(boxes[:,0:2], 0, self.shape[0])
+        boxes[:,2:4] = np.clip(boxes[:,2:4], 0, self.shape[1])
+        keep = (boxes[:,1] > boxes[:,0]) & (boxes[:,3] > boxes[:,2])
+        
+        self.ids = ids[keep]
+        self.beams = beams[keep]
+        self.boxes = boxes[keep,:]
+        
+        self.cells = {}
+        self.id_index = {}
+        
+        cs = self.cell_size
+        for i in range(len(self.ids)):
+            ylo, yhi, xlo, xhi = self.boxes[i,:]
+            for iy in range(ylo // cs, (yhi-1) // cs + 1):
+                for ix in range(xlo // cs, (xhi-1) // cs + 1):
+                    key = (iy, ix)
+                    if key in self.cells:
+                        self.cells[key].append(i)
+                    else:
+                        self.cells[key] = [i]
+            
+            id_i = self.ids[i]
+            if id_i in self.id_index:
+                self.id_index[id_i].append(i)
+            else:
+                self.id_index[id_i] = [i]
+                    
+    def query(self, box, exclude=[]):
+        """Footprints that overlap a bounding box
+        
+        Parameters
+        ----------
+        box : array-like
+            ``[ylo, yhi, xlo, xhi]`` bounding box.
+        
+        exclude : list
+            Object ids to skip.
+        
+        Returns
+        -------
+        ix : `~numpy.ndarray`
+            Indices of the overlapping footprints in `ids`, `beams` and 
+            `boxes`.
+        """
+        ylo, yhi, xlo, xhi = [int(b) for b in box]
+        ylo, yhi = max(ylo, 0), min(yhi, self.shape[0])
+        xlo, xhi = max(xlo, 0), min(xhi, self.shape[1])
+        if (yhi <= ylo) | (xhi <= xlo):
+            return np.zeros(0, dtype=int)
+            
+        cs = self.cell_size
+        candidates = []
+        for iy in range(ylo // cs, (yhi-1) // cs + 1):
+            for ix in range(xlo // cs, (xhi-1) // cs + 1):
+                candidates.extend(self.cells.get((iy, ix), []))
+        
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=int)
+            
+        candidates = np.unique(candidates)
+        b = self.boxes[candidates,:]
+        overlap = ((b[:,0] < yhi) & (b[:,1] > ylo) & 
+                   (b[:,2] < xhi) & (b[:,3] > xlo))
+        
+        if len(exclude) > 0:
+            overlap &= ~utils.column_values_in_list(self.ids[candidates],
+                                                    exclude)
+        
+        return candidates[overlap]
+    
+    def get_footprints(self, id):
+        """Bounding boxes of the footprints of an object
+        
+        Returns
+        -------
+        beams : `~numpy.ndarray`
+            Beam names.
+            
+        boxes : `~numpy.ndarray`, shape (N, 4)
+            Bounding boxes ``[ylo, yhi, xlo, xhi]``.
+        """
+        ix = self.id_index.get(id, [])
+        return self.beams[ix], self.boxes[ix,:]
+        
+    def get_overlapping_ids(self, id, beams=None):
+        """Objects with footprints that overlap those of an object
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        beams : None or list
+            Only consider these beams of object `id`, e.g., ['A'] for the 
+            contamination of the first order.  If None, use all beams.
+        
+        Returns
+        -------
+        ids : `~numpy.ndarray`
+            Sorted unique ids of the overlapping objects, excluding `id`.
+        """
+        overlaps = []
+        for beam, box in zip(*self.get_footprints(id)):
+            if (beams is not None) and (beam not in beams):
+                continue
+                
+            overlaps.extend(self.ids[self.query(box, exclude=[id])])
+        
+        return np.unique(np.array(overlaps, dtype=self.ids.dtype))
+        
+    def get_isolated_ids(self, beams=None):
+        """Objects whose footprints don't overlap any others
+        
+        Parameters
+        ----------
+        beams : None or list
+            See `get_overlapping_ids`.
+        
+        Returns
+        -------
+        ids : `~numpy.ndarray`
+            Sorted object ids.
+        """
+        isolated = [id for id in self.id_index 
+                    if len(self.get_overlapping_ids(id, beams=beams)) == 0]
+        
+        return np.sort(np.array(isolated, dtype=self.ids.dtype))
+        
+class GrismFLT(object):
+    """Scripts for modeling of individual grism FLT images"""
+    def __init__(self, grism_file='', sci_extn=1, direct_file='',
+                 pad=200, ref_file=None, ref_ext=0, seg_file=None,
+                 shrink_segimage=True, force_grism='G141', verbose=True,
+                 model_dtype=None):
+        """Read FLT files and, optionally, reference/segmentation images.
+        
+        Parameters
+        ----------
+        grism_file : str
+            Grism image (optional).
+            Empty string or filename of a FITS file that must contain
+            extensions ('SCI', `sci_extn`), ('ERR', `sci_extn`), and
+            ('DQ', `sci_extn`).  For example, a WFC3/IR "FLT" FITS file.
+            
+        sci_extn : int
+            EXTNAME of the file to consider.  For WFC3/IR this can only be 
+            1.  For ACS and WFC3/UVIS, this can be 1 or 2 to specify the two
+            chips.
+            
+        direct_file : str
+            Direct image (optional).
+            Empty string or filename of a FITS file that must contain
+            extensions ('SCI', `sci_extn`), ('ERR', `sci_extn`), and
+            ('DQ', `sci_extn`).  For example, a WFC3/IR "FLT" FITS file.
+        
+        pad : int
+            Padding to add around the periphery of the images to allow 
+            modeling of dispersed spectra for objects that could otherwise 
+            fall off of the direct image itself.  Modeling them requires an 
+            external reference image (`ref_file`) that covers an area larger
+            than the individual direct image itself (e.g., a mosaic of a 
+            survey field).
+        
+            For WFC3/IR spectra, the first order spectra reach 248 and 195 
+            pixels for G102 and G141, respectively, and `pad` could be set
+            accordingly if the reference image is large enough.
+        
+        ref_file : str or `~astropy.io.fits.ImageHDU`/`~astropy.io.fits.PrimaryHDU`
+            Image mosaic to use as the reference image in place of the direct
+            image itself.  For example, this could be the deeper image
+            drizzled from all direct images taken within a single visit or it
+            could be a much deeper/wider image taken separately in perhaps 
+            even a different filter.
+            
+            .. note::
+                Assumes that the WCS are aligned between `grism_file`, 
+                `direct_file` and `ref_file`!
+            
+        ref_ext : int
+            FITS extension to use if `ref_file` is a filename string.
+        
+        seg_file : str or `~astropy.io.fits.ImageHDU`/`~astropy.io.fits.PrimaryHDU`
+            Segmentation image mosaic to associate pixels with discrete 
+            objects.  This would typically be generated from a rectified 
+            image like `ref_file`, though here it is not required that 
+            `ref_file` and `seg_file` have the same image dimensions but 
+            rather just that the WCS are aligned between them.
+        
+        shrink_segimage : bool
+            Try to make a smaller cutout of the reference images to speed 
+            up blotting and array copying.  This is most helpful for very 
+            large input mosaics.
+        
+        force_grism : str
+            Use this grism in "simulation mode" where only `direct_file` is
+            specified.
+            
+        verbose : bool
+            Print status messages to the terminal.
+        
+        model_dtype : None or type
+            Data type of the full `model` array and of the models of the 
+            `GrismDisperser` objects in `object_dispersers`.  If None, the 
+            full model has the same type as the science array and the 
+            object models are double precision.  Use `numpy.float32` to 
+            halve the memory (and pickling traffic) of the models, which
+            are then also accumulated in single precision.
+            
+        Attributes
+        ----------
+        grism, direct : `ImageData`
+            Grism and direct image data and parameters
+        
+        conf : `~grizli.grismconf.aXeConf`
+            Grism configuration object.
+                
+        seg : array-like
+            Segmentation image array.
         
         model : array-like
             Model of the grism exposure with the same dimensions as the 
@@ -1663,7 +2674,8 @@ class GrismFLT(object):
         #     pass
             
         ### Holder for the full grism model array
-        self.model = np.zeros_like(self.direct.data['SCI'])
+        self.model_dtype = model_dtype
+        self.model = np.zeros_like(self.direct.data['SCI'], dtype=model_dtype)
         
         ### Grism configuration
         if 'DFILTER' in self.grism.header:
@@ -1696,6 +2708,26 @@ class GrismFLT(object):
         
         self.catalog = None
         self.catalog_file = None
+        self.catalog_index = None
+        
+        ### Cached statistics of the segmentation regions
+        self.seg_table = None
+        
+        ### Handles of arrays shared through memory-mapped files
+        self.shared_arrays = None
+        self.shared_path = None
+        self.shared_finalizer = None
+        
+        ### Sparse models of the individual objects
+        self.model_store = None
+        
+        ### Spatial index of the dispersed footprints
+        self.footprint_index = None
+        
+        ### Log of the regions of `model` changed by `compute_model_orders`
+        self.model_version = 0
+        self.model_changes = []
+        self.max_model_changes = 4096
                            
         self.is_rotated = False
         self.has_edge_mask = False
@@ -1891,18 +2923,519 @@ class GrismFLT(object):
         dy_trace, lam_trace = self.conf.get_beam_trace(x=507, y=507, dx=x0,
                                                        beam='A')
         
-        extra = np.arctan2(dy_trace[1]-dy_trace[0], x0[1]-x0[0])/np.pi*180
-                
-        ### Distorted WCS
-        crpix = self.direct.wcs.wcs.crpix
-        xref = [crpix[0], crpix[0]+1]
-        yref = [crpix[1], crpix[1]]
-        r, d = self.direct.wcs.all_pix2world(xref, yref, 1)
-        pa = Angle((extra + 
-                    np.arctan2(np.diff(r)*np.cos(d[0]/180*np.pi),
-                               np.diff(d))[0]/np.pi*180)*u.deg)
-                        
-        self.dispersion_PA = pa.wrap_at(360*u.deg).value
+        extra = np.arctan2(dy_trace[1]-dy_trace[0], x0[1]-x0[0])/np.pi*180
+                
+        ### Distorted WCS
+        crpix = self.direct.wcs.wcs.crpix
+        xref = [crpix[0], crpix[0]+1]
+        yref = [crpix[1], crpix[1]]
+        r, d = self.direct.wcs.all_pix2world(xref, yref, 1)
+        pa = Angle((extra + 
+                    np.arctan2(np.diff(r)*np.cos(d[0]/180*np.pi),
+                               np.diff(d))[0]/np.pi*180)*u.deg)
+                        
+        self.dispersion_PA = pa.wrap_at(360*u.deg).value
+        
+    def get_catalog_index(self):
+        """Index of the rows of `self.catalog` by object ID
+        
+        Returns
+        -------
+        index : dict or None
+            Dictionary with keys 'row', a `dict` of `{id: row}` with the 
+            first row of each ID, and 'sorted_id' and 'sorted_row', arrays of
+            the IDs and rows sorted by ID for batch lookups with 
+            `get_catalog_rows`.  None if `self.catalog` is None.
+        
+        The index is stored in `self.catalog_index` and rebuilt when 
+        `self.catalog` is replaced or changes length, e.g., after 
+        
+            >>> self.catalog = self.blot_catalog(input_catalog)
+            
+        """
+        if self.catalog is None:
+            self.catalog_index = None
+            return None
+        
+        index = getattr(self, 'catalog_index', None)
+        if index is not None:
+            if ((index['catalog'] is self.catalog) & 
+                (index['N'] == len(self.catalog))):
+                return index
+        
+        ids = np.array(self.catalog['id'])
+        
+        row = {}
+        for i, id in enumerate(ids.tolist()):
+            if id not in row:
+                row[id] = i
+        
+        so = np.argsort(ids, kind='mergesort')
+        
+        index = {'catalog':self.catalog, 'N':len(self.catalog), 'row':row,
+                 'sorted_id':ids[so], 'sorted_row':so}
+        
+        self.catalog_index = index
+        return index
+    
+    def get_catalog_rows(self, ids):
+        """Rows of `self.catalog` for a list of IDs
+        
+        Parameters
+        ----------
+        ids : int or array-like
+            Object IDs
+        
+        Returns
+        -------
+        rows : int, `~numpy.ndarray` or None
+            Index of the first row of `self.catalog` matching each ID and -1
+            (None for scalar `ids`) for IDs not in the catalog.
+        """
+        index = self.get_catalog_index()
+        
+        if np.isscalar(ids):
+            if index is None:
+                return None
+            
+            return index['row'].get(ids, None)
+        
+        ids = np.atleast_1d(ids)
+        if index is None:
+            return np.zeros(len(ids), dtype=int)-1
+            
+        sorted_id = index['sorted_id']
+        if len(sorted_id) == 0:
+            return np.zeros(len(ids), dtype=int)-1
+            
+        ix = np.clip(np.searchsorted(sorted_id, ids), 0, len(sorted_id)-1)
+        rows = index['sorted_row'][ix]
+        rows[sorted_id[ix] != ids] = -1
+        return rows
+        
+    def get_segmentation_table(self, ext=None):
+        """Statistics of all segmentation regions computed in one pass
+        
+        Parameters
+        ----------
+        ext : str or None
+            Extension of `self.direct.data` to use for the flux-weighted 
+            centroids and total fluxes.  If None, use 
+            `self.direct.thumb_extension`.
+        
+        Returns
+        -------
+        table : dict
+            Arrays of the quantities computed by 
+            `utils_c.disperse.compute_segmentation_limits` for all unique
+            values of `self.seg`, with keys 'id', 'ymin', 'ymax', 'y', 
+            'xmin', 'xmax', 'x', 'area', 'flux'.  
+            
+        The tables are cached by `ext` in the `seg_table` attribute and 
+        recomputed if `self.seg` or the flux array are replaced.  Set 
+        `self.seg_table = None` after modifying them in place.
+        """
+        if ext is None:
+            ext = self.direct.thumb_extension
+        
+        flam = self.direct.data[ext]
+        
+        if getattr(self, 'seg_table', None) is None:
+            self.seg_table = OrderedDict()
+            
+        if ext in self.seg_table:
+            table = self.seg_table[ext]
+            if (table['seg'] is self.seg) & (table['flam'] is flam):
+                return table
+        
+        ids = np.unique(self.seg)
+        out = disperse.compute_segmentation_table(self.seg, flam, ids)
+        ilim, jlim, numer, area, denom = out
+        
+        ### No matched pixels
+        denom[denom == 0] = -99
+        
+        table = OrderedDict()
+        table['id'] = ids
+        table['ymin'], table['ymax'] = ilim[:,0], ilim[:,1]
+        table['y'] = numer[:,0]/denom
+        table['xmin'], table['xmax'] = jlim[:,0], jlim[:,1]
+        table['x'] = numer[:,1]/denom
+        table['area'] = area
+        table['flux'] = denom
+        table['seg'] = self.seg
+        table['flam'] = flam
+        
+        self.seg_table[ext] = table
+        return table
+    
+    def get_segment_stats(self, id, ext=None):
+        """Pixel limits of a segmentation region from the cached table
+        
+        Parameters
+        ----------
+        id : int
+            Segmentation ID
+        
+        ext : str or None
+            See `get_segmentation_table`.
+        
+        Returns
+        -------
+        ymin, ymax, y, xmin, xmax, x, area, segm_flux : 
+            Same as `utils_c.disperse.compute_segmentation_limits`.
+        """
+        table = self.get_segmentation_table(ext=ext)
+        
+        ix = np.searchsorted(table['id'], id)
+        if ix < len(table['id']):
+            found = table['id'][ix] == id
+        else:
+            found = False
+        
+        if not found:
+            return (self.seg.shape[0], 0, -0., self.seg.shape[1], 0, -0., 
+                    0, -99.)
+        
+        out = [table[key][ix] for key in ['ymin', 'ymax', 'y', 'xmin', 
+                                          'xmax', 'x', 'area', 'flux']]
+        
+        return (int(out[0]), int(out[1]), float(out[2]), int(out[3]), 
+                int(out[4]), float(out[5]), int(out[6]), float(out[7]))
+            
+    def compute_object_traces(self, ids=None, beams=None, ext=None):
+        """Traces and wavelengths of many objects in vectorized calls
+        
+        Parameters
+        ----------
+        ids : None, list, or `~numpy.array`
+            Object IDs.  If None, use all IDs of the segmentation image.
+        
+        beams : None or list
+            Beams to compute.  If None, use `self.conf.beams`.
+        
+        ext : str or None
+            Flux extension for the segmentation centroids, see 
+            `get_segmentation_table`.
+        
+        Returns
+        -------
+        traces : `~collections.OrderedDict`
+            Dictionary with keys 'id', 'x', 'y' (centroids in the 
+            `self.seg` frame) and, for each beam, a tuple of `(dx, dy, lam)`
+            arrays, where `dx` are the pixel offsets `self.conf.dxlam[beam]`
+            and `dy` and `lam` have shape `(len(ids), len(dx))`.  IDs that
+            aren't found in the segmentation image are left out of 'id' 
+            and the trace arrays.
+            
+        The traces are evaluated at the same positions as in 
+        `compute_model_orders` for objects without catalog positions.  
+        """
+        table = self.get_segmentation_table(ext=ext)
+        if ids is None:
+            ids = table['id'][table['id'] > 0]
+        
+        ids = np.atleast_1d(ids)
+        ix = np.clip(np.searchsorted(table['id'], ids), 0, 
+                     len(table['id'])-1)
+        
+        ### Skip IDs that aren't in the segmentation image
+        ok = table['id'][ix] == ids
+        ids, ix = ids[ok], ix[ok]
+        
+        x = table['x'][ix]
+        y = table['y'][ix]
+        
+        ### Same thumbnail centering as `compute_model_orders` and 
+        ### `GrismDisperser.process_config`
+        xc = np.cast[int](np.round(x))+1
+        yc = np.cast[int](np.round(y))+1
+        xcenter = -(x-(xc-1))
+        ycenter = -(y-(yc-1))
+        
+        grow = self.grism.grow
+        xpos = (xc+self.direct.origin[1]+xcenter-self.pad)/grow
+        ypos = (yc+self.direct.origin[0]+ycenter-self.pad)/grow
+        
+        if beams is None:
+            beams = self.conf.beams
+            
+        traces = OrderedDict()
+        traces['id'] = ids
+        traces['x'] = x
+        traces['y'] = y
+        
+        for beam in beams:
+            dx = self.conf.dxlam[beam]
+            if grow > 1:
+                dx = np.arange(dx[0]*grow, dx[-1]*grow)
+            
+            xoff = 0.
+            if ('G14' in self.conf.conf_file) & (beam == 'A'):
+                 xoff = -0.5 
+            
+            dy, lam = self.conf.get_beam_traces(x=xpos, y=ypos, 
+                                                dx=(dx+xoff)/grow, 
+                                                beam=beam, 
+                                                fwcpos=self.grism.fwcpos)
+            
+            traces[beam] = (dx, dy*grow, lam)
+        
+        return traces
+        
+    def get_footprint_boxes(self, ids=None, mags=None, beams=None, 
+                            ext=None, margin=2, size=None):
+        """Bounding boxes of the dispersed spectral orders of the objects
+        
+        The bounding boxes are computed from the limits of the 
+        segmentation regions (`get_segmentation_table`) and the traces at 
+        the pixel offsets `self.conf.dxlam` (`compute_object_traces`), 
+        i.e., without computing the dispersed models themselves.  The 
+        y range of the boxes covers the full range of the trace offsets 
+        `dy`, including the extra row of the sub-pixel interpolation.
+        
+        Parameters
+        ----------
+        ids : None, list, or `~numpy.array`
+            Object ids.  If None, use all ids of the segmentation image.
+        
+        mags : None or array-like
+            Magnitudes of the objects.  If specified, beams of objects 
+            fainter than the "MMAG_EXTRACT_[BEAM]" parameters of 
+            `self.conf` are skipped, as in `compute_model_orders`.
+        
+        beams : None or list
+            Beams to include.  If None, use `self.conf.beams`.
+            
+        ext : str or None
+            See `get_segmentation_table`.
+            
+        margin : int
+            Extra pixels added to each side of the bounding boxes.
+        
+        size : None or int
+            If specified, extend the boxes to include the cutouts of the 
+            spectral orders of `compute_model_orders` (and 
+            `~grizli.model.BeamCutout`) with this `size`.  These span the 
+            `2*size` rows of the direct image thumbnail, which aren't 
+            offset by the trace, and the thumbnail columns offset by the
+            range of `dx`.
+            
+        Returns
+        -------
+        box_ids, box_beams : `~numpy.ndarray`
+            Object id and beam name of each box.
+        
+        boxes : `~numpy.ndarray`, shape (N, 4)
+            Bounding boxes ``[ylo, yhi, xlo, xhi]`` in the frame of 
+            `self.seg` and `self.model`, with upper limits excluded.
+        """
+        if ext is None:
+            if self.direct.data['REF'] is None:
+                ext = 'SCI'
+            else:
+                ext = 'REF'
+        
+        table = self.get_segmentation_table(ext=ext)
+        if ids is None:
+            ids = table['id'][table['id'] > 0]
+        
+        ids = np.atleast_1d(ids)
+        ix = np.clip(np.searchsorted(table['id'], ids), 0, 
+                     len(table['id'])-1)
+        
+        ok = (table['id'][ix] == ids) & (table['area'][ix] > 0)
+        ids, ix = ids[ok], ix[ok]
+        if mags is not None:
+            mags = np.atleast_1d(mags)[ok]
+            
+        traces = self.compute_object_traces(ids=ids, beams=beams, ext=ext)
+        
+        if beams is None:
+            beams = self.conf.beams
+        
+        ### Limits of the source regions
+        ylo, yhi = table['ymin'][ix], table['ymax'][ix]+1
+        xlo, xhi = table['xmin'][ix], table['xmax'][ix]+1
+        if size is not None:
+            ### Thumbnail centers as in `compute_model_orders`
+            xcen, ycen = table['x'][ix]*1, table['y'][ix]*1
+            if self.catalog is not None:
+                rows = self.get_catalog_rows(ids)
+                has_row = rows >= 0
+                xcen[has_row] = self.catalog['x_flt'][rows[has_row]]-1
+                ycen[has_row] = self.catalog['y_flt'][rows[has_row]]-1
+                
+            yc = np.cast[int](np.round(ycen))+1
+            xc = np.cast[int](np.round(xcen))+1
+            
+        all_ids, all_beams, all_boxes = [], [], []
+        for beam in beams:
+            dx, dy, lam = traces[beam]
+            
+            bright = np.ones(len(ids), dtype=bool)
+            if mags is not None:
+                mmag = self.conf.conf['MMAG_EXTRACT_{0}'.format(beam)]
+                bright = mags <= mmag
+            
+            ### Dispersed segmentation regions.  The kernels add the flux 
+            ### of each pixel to the rows floor(dy) and floor(dy)+1
+            boxes = np.zeros((len(ids), 4), dtype=int)
+            boxes[:,0] = ylo + np.floor(dy.min(axis=1))
+            boxes[:,1] = yhi + np.floor(dy.max(axis=1)) + 1
+            boxes[:,2] = xlo + dx.min()
+            boxes[:,3] = xhi + dx.max()
+            
+            ### Cutouts with `size`
+            if size is not None:
+                boxes[:,0] = np.minimum(boxes[:,0], yc-size)
+                boxes[:,1] = np.maximum(boxes[:,1], yc+size)
+                boxes[:,2] = np.minimum(boxes[:,2], xc-size+dx.min())
+                boxes[:,3] = np.maximum(boxes[:,3], xc+size+dx.max()+1)
+                
+            boxes += np.array([-margin, margin, -margin, margin])
+            
+            all_ids.append(ids[bright])
+            all_beams.append(np.array([beam]*bright.sum()))
+            all_boxes.append(boxes[bright,:])
+        
+        if len(all_ids) == 0:
+            return ids[:0], np.array([], dtype=str), np.zeros((0,4), int)
+            
+        return np.hstack(all_ids), np.hstack(all_beams), np.vstack(all_boxes)
+        
+    def build_footprint_index(self, ids=None, mags=None, beams=None, 
+                              ext=None, margin=2, cell_size=64):
+        """Spatial index of the dispersed footprints of the objects
+        
+        Parameters
+        ----------
+        ids, mags, beams, ext, margin : 
+            See `get_footprint_boxes`.
+        
+        cell_size : int
+            Cell size of the `FootprintIndex` grid.
+            
+        Returns
+        -------
+        index : `FootprintIndex`
+            The index, also set to the `footprint_index` attribute.
+        """
+        out = self.get_footprint_boxes(ids=ids, mags=mags, beams=beams, 
+                                       ext=ext, margin=margin)
+        
+        self.footprint_index = FootprintIndex(self.seg.shape, 
+                                              cell_size=cell_size)
+        self.footprint_index.build(*out)
+        return self.footprint_index
+        
+    def record_model_change(self, sly, slx):
+        """Log a region of `self.model` that has been modified
+        
+        Each call increments the `model_version` attribute.  
+        `compute_model_orders` calls this for every spectral order that it
+        adds to or subtracts from the model, so that objects derived from 
+        the model, such as the `contam` arrays of `BeamCutout` objects, can
+        be updated only where it changed (see 
+        `BeamCutout.refresh_contamination`).
+        
+        The log keeps at most the last `max_model_changes` entries (4096 by
+        default).  When it's full, the oldest half is dropped and objects 
+        derived from older versions of the model are updated completely, 
+        see `get_model_changes`.  The log isn't pickled.
+        
+        Parameters
+        ----------
+        sly, slx : slice
+            Modified region of the full array.
+        """
+        if getattr(self, 'model_changes', None) is None:
+            self.model_changes = []
+        
+        version = getattr(self, 'model_version', 0) + 1
+        self.model_changes.append((version, sly.start, sly.stop, 
+                                   slx.start, slx.stop))
+        self.model_version = version
+        
+        ### Trim the oldest entries
+        max_changes = getattr(self, 'max_model_changes', 4096)
+        if len(self.model_changes) > max_changes:
+            del self.model_changes[:-max(max_changes//2, 1)]
+    
+    def get_model_changes(self, since=0):
+        """Regions of `self.model` that changed after a given version
+        
+        Parameters
+        ----------
+        since : int
+            Value of `model_version` at the time of the last update of an 
+            object derived from the model.
+        
+        Returns
+        -------
+        changes : list or None
+            List of (`sly`, `slx`) slices of the modified regions.  Returns 
+            None if the log doesn't extend back to `since` (e.g., after 
+            `clear_model_changes`), in which case the whole derived object 
+            must be updated.
+        """
+        version = getattr(self, 'model_version', 0)
+        if since >= version:
+            return []
+        
+        changes = getattr(self, 'model_changes', [])
+        if (len(changes) == 0) or (changes[0][0] > since+1):
+            return None
+        
+        ### Versions in the log are consecutive
+        i0 = since+1 - changes[0][0]
+        return [(slice(c[1], c[2]), slice(c[3], c[4])) for c in changes[i0:]]
+    
+    def clear_model_changes(self):
+        """Empty the log of `record_model_change`
+        """
+        self.model_changes = []
+        
+    def init_model_store(self, dtype=None):
+        """Initialize a `SparseModelStore` for the object models
+        
+        Once initialized, `compute_model_orders` saves the model of every 
+        object added to `self.model` in the store.  Objects that are 
+        already in the model are then updated by subtracting their stored
+        models rather than by recomputing the dispersed spectra of the 
+        previous models, and the store can be queried for the 
+        contamination of individual objects (see 
+        `SparseModelStore.get_contamination`).
+        
+        Objects in `self.object_dispersers` with stored beams are added to 
+        the new store.  Objects for which only the spectrum was stored 
+        (``store=False`` in `compute_model_orders`) are added the next 
+        time they are computed.
+        
+        Parameters
+        ----------
+        dtype : None or type
+            Data type of the stored models.  If None, use the type of 
+            `self.model`.
+        
+        Returns
+        -------
+        model_store : `SparseModelStore`
+            The store, also set to the `model_store` attribute.
+        """
+        if dtype is None:
+            dtype = self.model.dtype
+            
+        self.model_store = SparseModelStore(self.model.shape, dtype=dtype)
+        for id in self.object_dispersers:
+            beams = self.object_dispersers[id]
+            if not isinstance(beams, OrderedDict):
+                continue
+            
+            for key in beams:
+                self.model_store.set_beam(id, key, beams[key])
+        
+        return self.model_store
         
     def compute_model_orders(self, id=0, x=None, y=None, size=10, mag=-1,
                       spectrum_1d=None, compute_size=False, store=True, 
@@ -1938,8 +3471,8 @@ class GrismFLT(object):
         
         compute_size : bool
             Ignore `x`, `y`, and `size` and compute the extent of the 
-            segmentation polygon directly using 
-            `utils_c.disperse.compute_segmentation_limits`.
+            segmentation polygon directly from the cached table of 
+            `get_segment_stats`.
         
         store : bool
             If True, then store the computed beams in the OrderedDict
@@ -1978,6 +3511,13 @@ class GrismFLT(object):
             object_in_model = False
             beams = None
         
+        ### Subtract previous model from the sparse store if available
+        model_store = getattr(self, 'model_store', None)
+        if (model_store is not None) & in_place & (not get_beams):
+            in_store = object_in_model & (id in model_store)
+        else:
+            in_store = False
+            
         if self.direct.data['REF'] is None:
             ext = 'SCI'
         else:
@@ -1988,21 +3528,19 @@ class GrismFLT(object):
             ### Use catalog
             xcat = ycat = None
             if self.catalog is not None:
-                ix = self.catalog['id'] == id
-                if ix.sum() == 0:
+                row = self.get_catalog_rows(id)
+                if row is None:
                     if verbose:
                         print('ID {0:d} not found in segmentation image'.format(id))
                     return False
                 
-                xcat = self.catalog['x_flt'][ix][0]-1
-                ycat = self.catalog['y_flt'][ix][0]-1
+                xcat = self.catalog['x_flt'][row]-1
+                ycat = self.catalog['y_flt'][row]-1
                 #print '!!! X, Y: ', xcat, ycat, self.direct.origin, size
                 
             if (compute_size) | (x is None) | (y is None) | (size is None):
                 ### Get the array indices of the segmentation region
-                out = disperse.compute_segmentation_limits(self.seg, id,
-                                         self.direct.data[ext],
-                                         self.direct.sh)
+                out = self.get_segment_stats(id, ext=ext)
                 
                 ymin, ymax, y, xmin, xmax, x, area, segm_flux = out
                 if (area == 0) | ~np.isfinite(x) | ~np.isfinite(y):
@@ -2073,13 +3611,17 @@ class GrismFLT(object):
                 if mag > self.conf.conf['MMAG_EXTRACT_{0}'.format(beam)]:
                     continue
                     
+                model_dtype = getattr(self, 'model_dtype', None)
+                if model_dtype is None:
+                    model_dtype = np.float64
+                    
                 try:
-                    b = GrismDisperser(id=id, direct=thumb, segmentation=seg_thumb, xcenter=xcenter, ycenter=ycenter, origin=origin, pad=self.pad, grow=self.grism.grow,beam=beam, conf=self.conf, fwcpos=self.grism.fwcpos)
+                    b = GrismDisperser(id=id, direct=thumb, segmentation=seg_thumb, xcenter=xcenter, ycenter=ycenter, origin=origin, pad=self.pad, grow=self.grism.grow,beam=beam, conf=self.conf, fwcpos=self.grism.fwcpos, model_dtype=model_dtype)
                 except:
                     continue
                 
                 beams[beam] = b
-                if object_in_model:
+                if object_in_model & (not in_store):
                     #old_spectrum_1d = beams
                     old_spectrum_1d = self.object_dispersers[id]
                     b.compute_model(id=id, spectrum_1d=old_spectrum_1d)
@@ -2102,18 +3644,34 @@ class GrismFLT(object):
             ### Create a fresh array
             output = np.zeros_like(self.model)
                 
+        if in_store:
+            for beam_name in model_store.objects[id]:
+                sly, slx, values = model_store.objects[id][beam_name]
+                self.record_model_change(sly, slx)
+                
+            model_store.remove(id, full_array=output)
+            
         ### Loop through orders and add to the full model array, in-place or
         ### a separate image 
         for b in beams.keys():
             beam = beams[b]
             
             ### Subtract previously-added model
-            if object_in_model & in_place:
+            if object_in_model & in_place & (not in_store):
                 beam.add_to_full_image(-beam.model, output)
             
             ### Add in new model
             beam.compute_model(id=id, spectrum_1d=spectrum_1d)
             beam.add_to_full_image(beam.model, output)
+            
+            if in_place & (model_store is not None):
+                model_store.set_beam(id, b, beam)
+            
+            if in_place:
+                full_slices, beam_slices = SparseModelStore.get_beam_slices(
+                                                        beam, output.shape)
+                if full_slices is not None:
+                    self.record_model_change(*full_slices)
         
         if in_place:
             return True
@@ -2121,7 +3679,7 @@ class GrismFLT(object):
             return beams, output
     
     def compute_full_model(self, ids=None, mags=None, mag_limit=22,
-                           store=True, verbose=False):
+                           store=True, verbose=False, threads=1):
         """Compute flat-spectrum model for multiple objects.
         
         Parameters
@@ -2135,6 +3693,13 @@ class GrismFLT(object):
             magnitudes based on the flux in segmentation regions and 
             zeropoints determined from PHOTFLAM and PHOTPLAM.
         
+        threads : int
+            If > 1, compute the dispersed beams of the individual objects 
+            in a pool of threads that share `self`.  The dispersion kernels 
+            release the GIL, and the beams are added to `self.model` in 
+            the order of `ids`, so the result is the same as the serial 
+            calculation.
+            
         Returns
         -------
         Updated model stored in `self.model` attribute.
@@ -2148,14 +3713,14 @@ class GrismFLT(object):
             if verbose:
                 print('Compute IDs/mags')
             
-            mags = np.zeros(len(ids))
-            for i, id in enumerate(ids):
-                out = disperse.compute_segmentation_limits(self.seg, id,
-                                self.direct.data[self.direct.thumb_extension],
-                                     self.direct.sh)
+            table = self.get_segmentation_table()
+            ix = np.clip(np.searchsorted(table['id'], ids), 0, 
+                         len(table['id'])-1)
             
-                ymin, ymax, y, xmin, xmax, x, area, segm_flux = out
-                mags[i] = self.direct.ABZP - 2.5*np.log10(segm_flux)
+            segm_flux = table['flux'][ix]
+            segm_flux[table['id'][ix] != ids] = -99
+            
+            mags = self.direct.ABZP - 2.5*np.log10(segm_flux)
             
             ix = mags < mag_limit
             ids = ids[ix]
@@ -2169,6 +3734,11 @@ class GrismFLT(object):
                     raise ValueError ('`ids` and `mags` lists different sizes')
         
         ### Now compute the full model
+        if threads > 1:
+            self._compute_full_model_threads(ids, mags, store=store, 
+                                        verbose=verbose, threads=threads)
+            return True
+            
         for id_i, mag_i in zip(ids, mags):
             if verbose:
                 print(utils.no_newline + 'compute model id={0:d}'.format(id_i))
@@ -2176,6 +3746,79 @@ class GrismFLT(object):
             self.compute_model_orders(id=id_i, compute_size=True, mag=mag_i, 
                                       in_place=True, store=store)
     
+    def _compute_full_model_beams(self, args):
+        """Thread worker for `compute_full_model`
+        
+        Compute the flat-spectrum beams of a single object that is not 
+        already in `self.object_dispersers`, without touching `self.model`.
+        """
+        id, mag = args
+        if id in self.object_dispersers:
+            return id, mag, None
+            
+        beams = self.compute_model_orders(id=id, compute_size=True, mag=mag,
+                                          get_beams=list(self.conf.beams),
+                                          in_place=True, verbose=False)
+        
+        if isinstance(beams, OrderedDict):
+            for key in beams:
+                beams[key].compute_model(id=id, spectrum_1d=None)
+        
+        return id, mag, beams
+        
+    def _compute_full_model_threads(self, ids, mags, store=True,
+                                    verbose=False, threads=2):
+        """Compute the full model with a pool of threads
+        
+        The beams are computed in the threads and then added to 
+        `self.model` in the input order in the main thread.  Objects that 
+        are already in the model are recomputed serially in place.
+        """
+        from multiprocessing.pool import ThreadPool
+        
+        ### Compute the segmentation table before starting the threads
+        if self.direct.data['REF'] is None:
+            self.get_segmentation_table(ext='SCI')
+        else:
+            self.get_segmentation_table(ext='REF')
+            
+        pool = ThreadPool(processes=threads)
+        jobs = pool.imap(self._compute_full_model_beams, zip(ids, mags))
+        
+        for id_i, mag_i, beams in jobs:
+            if verbose:
+                print(utils.no_newline + 'compute model id={0:d}'.format(id_i))
+            
+            if (beams is None) | (id_i in self.object_dispersers):
+                ### Already in the model
+                self.compute_model_orders(id=id_i, compute_size=True, 
+                                          mag=mag_i, in_place=True, 
+                                          store=store)
+                continue
+            
+            if not isinstance(beams, OrderedDict):
+                ### Not found or off of the image
+                continue
+            
+            if store:
+                self.object_dispersers[id_i] = beams
+            else:
+                self.object_dispersers[id_i] = None
+            
+            for key in beams:
+                beams[key].add_to_full_image(beams[key].model, self.model)
+                if getattr(self, 'model_store', None) is not None:
+                    self.model_store.set_beam(id_i, key, beams[key])
+                
+                full_slices, beam_slices = SparseModelStore.get_beam_slices(
+                                                beams[key], self.model.shape)
+                if full_slices is not None:
+                    self.record_model_change(*full_slices)
+        
+        pool.close()
+        pool.join()
+        
+    
     def smooth_mask(self, gaussian_width=4, threshold=2.5):
         """Compute a mask where smoothed residuals greater than some value
         
@@ -2484,6 +4127,7 @@ class GrismFLT(object):
         
         ## zero out large data objects
         self.direct.data = self.grism.data = self.seg = self.model = None
+        self.seg_table = None
                                             
         fp = open('{0}.{1:02d}.GrismFLT.pkl'.format(root, self.grism.sci_extn), 'wb')
         pickle.dump(self, fp)
@@ -2504,6 +4148,8 @@ class GrismFLT(object):
         fits = pyfits.open(save_file)
         self.seg = fits['SEG'].data*1
         self.model = fits['MODEL'].data*1
+        if self.model.dtype == np.float32:
+            self.model_dtype = np.float32
         self.direct.data = OrderedDict()
         self.grism.data = OrderedDict()
         
@@ -2525,6 +4171,357 @@ class GrismFLT(object):
                 
         return True
     
+    def save_full_cache(self, verbose=True):
+        """Save entire `GrismFLT` object to a directory of `.npy` files
+        
+        The large arrays (`direct` and `grism` data, `seg` and `model`) are 
+        saved as uncompressed `.npy` files that can be memory-mapped by 
+        `load_from_cache`, and the rest of the object is saved to a small 
+        pickle file ``GrismFLT.pkl`` in the same directory.  The output 
+        directory is
+        
+            >>> cache_path = '{root}.{sci_extn:02d}.GrismFLT.cache'
+        
+        with `root` derived from `grism_file` as in `save_full_pickle`.
+        
+        Returns
+        -------
+        cache_path : str
+            Output directory.
+        """
+        import shutil
+        
+        try:
+            import cPickle as pickle
+        except:
+            # Python 3
+            import pickle
+            
+        root = self.grism_file.split('_flt.fits')[0].split('_cmb.fits')[0]
+        root = root.split('_flc.fits')[0].split('_rate.fits')[0]
+        
+        cache_path = '{0}.{1:02d}.GrismFLT.cache'.format(root,
+                                                         self.grism.sci_extn)
+        
+        ### Write to a temporary directory and then move it into place
+        tmp_path = cache_path+'.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        
+        os.makedirs(tmp_path)
+        
+        for container, key, name in self._shared_array_slots(self.__dict__):
+            data = container[key]
+            if not isinstance(data, np.ndarray):
+                continue
+            
+            np.save(os.path.join(tmp_path, '{0}.npy'.format(name)),
+                    np.ascontiguousarray(data))
+        
+        ### Metadata object without the large arrays
+        meta = GrismFLT.__new__(GrismFLT)
+        meta.__dict__.update(self.__dict__)
+        for attr in ['direct', 'grism']:
+            im = getattr(self, attr)
+            if (im is None) or (im.data is None):
+                continue
+                
+            setattr(meta, attr, copy.copy(im))
+            getattr(meta, attr).data = OrderedDict([(key, None) 
+                                                    for key in im.data])
+        
+        meta.seg = meta.model = meta.seg_table = None
+        meta.shared_arrays = meta.shared_path = None
+        meta.shared_finalizer = None
+        
+        fp = open(os.path.join(tmp_path, 'GrismFLT.pkl'), 'wb')
+        pickle.dump(meta, fp)
+        fp.close()
+        
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+        
+        os.rename(tmp_path, cache_path)
+        
+        if verbose:
+            print('Saved {0}'.format(cache_path))
+        
+        return cache_path
+        
+    def load_from_cache(self, cache_path, mmap_mode='c'):
+        """Load data arrays saved with `save_full_cache`
+        
+        Parameters
+        ----------
+        cache_path : str
+            Directory written by `save_full_cache`.
+        
+        mmap_mode : str or None
+            `mmap_mode` passed to `numpy.load`.  The default 'c' 
+            (copy-on-write) maps the files without reading them, so only 
+            the pixels that are actually used are read from disk, and 
+            changes to the arrays, e.g., to `model`, are kept in memory and
+            not written back to the files.  Use None to read the full 
+            arrays into memory.
+            
+        Returns
+        -------
+        True if completed successfully
+        
+        Raises
+        ------
+        IOError
+            If the `seg` or `model` arrays are missing from `cache_path`, 
+            e.g., if the cache wasn't written completely.  Other missing 
+            arrays are set to None, as for data extensions that are None 
+            when the cache is saved.
+        """
+        for name in ['seg', 'model']:
+            file = os.path.join(cache_path, '{0}.npy'.format(name))
+            if not os.path.exists(file):
+                msg = 'Incomplete GrismFLT cache, {0} not found'.format(file)
+                raise IOError(msg)
+                
+        for container, key, name in self._shared_array_slots(self.__dict__):
+            file = os.path.join(cache_path, '{0}.npy'.format(name))
+            if os.path.exists(file):
+                container[key] = np.load(file, mmap_mode=mmap_mode)
+            else:
+                container[key] = None
+        
+        if self.model.dtype == np.float32:
+            self.model_dtype = np.float32
+        
+        self.seg_table = None
+        
+        return True
+        
+    @staticmethod
+    def _shared_array_slots(state):
+        """Containers of the large arrays that can be shared
+        
+        Parameters
+        ----------
+        state : dict
+            `__dict__` of a `GrismFLT` object or a copy of it.
+        
+        Returns
+        -------
+        slots : list
+            List of (container, key, name) tuples, where `container[key]` 
+            is the array and `name` is a unique label.
+        """
+        slots = [(state, 'seg', 'seg'), (state, 'model', 'model')]
+        for attr in ['direct', 'grism']:
+            im = state.get(attr, None)
+            if im is None:
+                continue
+            
+            if im.data is None:
+                continue
+                
+            for key in im.data:
+                slots.append((im.data, key, '{0}_{1}'.format(attr, key)))
+        
+        return slots
+        
+    def share_arrays(self, scratch_dir=None, cleanup=True, verbose=False):
+        """Move the large data arrays to memory-mapped scratch files
+        
+        The `direct` and `grism` data arrays, `seg` and `model` are 
+        replaced by `~numpy.memmap` arrays stored in a new directory in 
+        `scratch_dir`.  When the object is pickled, e.g., for sending to 
+        `multiprocessing` workers, only lightweight 
+        `~grizli.utils.SharedArrayHandle` objects are sent for these 
+        arrays and the receiving process maps the same files.  Changes 
+        to the arrays made in place, such as adding spectra to `model` 
+        with `compute_model_orders`, are then seen by all processes.
+        
+        The scratch directory is removed by `release_shared_arrays`, or 
+        otherwise when the object is garbage collected or the interpreter 
+        exits in the process that owns the files (see `own_shared_arrays`).  
+        Copies unpickled in other processes never remove it.
+        
+        Parameters
+        ----------
+        scratch_dir : str or None
+            Directory for the scratch files.  If None, use `/dev/shm` if 
+            available or the default temporary directory if not.  See
+            `~grizli.utils.get_scratch_dir`.
+        
+        cleanup : bool
+            Make the current process the owner of the files with 
+            `own_shared_arrays`.  Use False in `multiprocessing` workers 
+            that send the object back to their parent, which then calls 
+            `own_shared_arrays` on the copy that it receives.  Otherwise 
+            the files would be removed when the worker drops its copy.
+        
+        verbose : bool
+            Print the scratch directory.
+            
+        Returns
+        -------
+        shared_arrays : `~collections.OrderedDict`
+            Handles of the shared arrays, also stored in the 
+            `shared_arrays` attribute.
+        """
+        import tempfile
+        
+        if getattr(self, 'shared_arrays', None):
+            return self.shared_arrays
+            
+        scratch_dir = utils.get_scratch_dir(scratch_dir)
+        self.shared_path = tempfile.mkdtemp(prefix='grizli_GrismFLT_', 
+                                            dir=scratch_dir)
+        
+        self.shared_finalizer = None
+        if cleanup:
+            self.own_shared_arrays()
+        
+        shared = OrderedDict()
+        for container, key, name in self._shared_array_slots(self.__dict__):
+            data = container[key]
+            if not isinstance(data, np.ndarray):
+                continue
+            
+            file = os.path.join(self.shared_path, '{0}.npy'.format(name))
+            container[key], shared[name] = utils.share_array(data, file)
+        
+        self.shared_arrays = shared
+        
+        ### Cached table refers to the old `seg` array
+        self.seg_table = None
+        
+        if verbose:
+            print('{0}: shared arrays in {1}'.format(self.grism_file,
+                                                     self.shared_path))
+        
+        return shared
+        
+    def own_shared_arrays(self):
+        """Remove the scratch files of `share_arrays` with this object
+        
+        Registers a finalizer that removes the scratch directory when this
+        object is garbage collected or when the current process exits, 
+        whichever comes first.  Only one copy of the object, in one 
+        process, should own the files.
+        
+        Returns
+        -------
+        finalizer : `weakref.finalize` or None
+            Finalizer, also stored in the `shared_finalizer` attribute.  
+            None if the arrays aren't shared.
+        """
+        import weakref
+        
+        if getattr(self, 'shared_path', None) is None:
+            return None
+        
+        finalizer = getattr(self, 'shared_finalizer', None)
+        if (finalizer is not None) and finalizer.alive:
+            return finalizer
+            
+        ### Don't leak (RAM-backed) files if `release_shared_arrays` is 
+        ### never called, e.g., after an exception
+        self.shared_finalizer = weakref.finalize(self, 
+                                                 utils.remove_scratch_dir,
+                                                 self.shared_path, 
+                                                 os.getpid())
+        
+        return self.shared_finalizer
+        
+    def release_shared_arrays(self, remove_files=True, copy_data=True):
+        """Copy shared arrays back to memory and remove the scratch files
+        
+        Parameters
+        ----------
+        remove_files : bool
+            Delete the scratch directory created by `share_arrays`.  Other
+            processes must not use the handles afterwards.
+        
+        copy_data : bool
+            Copy the arrays to memory.  If False, the arrays stay mapped to
+            the (possibly deleted) scratch files, e.g., when they are about
+            to be replaced with `load_from_cache`.
+        """
+        import shutil
+        
+        shared = getattr(self, 'shared_arrays', None)
+        if not shared:
+            return True
+            
+        for container, key, name in self._shared_array_slots(self.__dict__):
+            if name not in shared:
+                continue
+            
+            if copy_data & isinstance(container[key], np.memmap):
+                container[key] = np.array(container[key])
+        
+        self.shared_arrays = None
+        self.seg_table = None
+        
+        finalizer = getattr(self, 'shared_finalizer', None)
+        self.shared_finalizer = None
+        
+        if remove_files & (self.shared_path is not None):
+            if finalizer is not None:
+                finalizer()
+            else:
+                shutil.rmtree(self.shared_path, ignore_errors=True)
+            
+            self.shared_path = None
+        elif finalizer is not None:
+            finalizer.detach()
+            
+        return True
+        
+    def __getstate__(self):
+        """Replace shared arrays with their handles for pickling
+        
+        The log of `record_model_change` isn't pickled, so unpickled copies
+        have the same `model_version` but an empty log.
+        """
+        state = self.__dict__.copy()
+        state['model_changes'] = []
+        
+        shared = getattr(self, 'shared_arrays', None)
+        if not shared:
+            return state
+        
+        state['seg_table'] = None
+        
+        ### Only the process that made the files removes them
+        state['shared_finalizer'] = None
+        
+        ### Copies of the `ImageData` objects with their own `data` dicts
+        for attr in ['direct', 'grism']:
+            im = state.get(attr, None)
+            if (im is None) or (im.data is None):
+                continue
+            
+            state[attr] = copy.copy(im)
+            state[attr].data = OrderedDict(im.data)
+            
+        for container, key, name in self._shared_array_slots(state):
+            if name not in shared:
+                continue
+            
+            if utils.is_shared_array(container[key], shared[name]):
+                container[key] = shared[name]
+        
+        return state
+    
+    def __setstate__(self, state):
+        """Map shared arrays from their handles after unpickling
+        """
+        self.__dict__.update(state)
+        if not getattr(self, 'shared_arrays', None):
+            return None
+        
+        for container, key, name in self._shared_array_slots(self.__dict__):
+            if isinstance(container[key], utils.SharedArrayHandle):
+                container[key] = container[key].attach(mode='r+')
+                
     def transform_NIRISS(self, verbose=True):
         """
         Rotate data & wcs so that spectra are increasing to +x
@@ -2629,7 +4626,7 @@ class GrismFLT(object):
 class BeamCutout(object):
     def __init__(self, flt=None, beam=None, conf=None, 
                  get_slice_header=True, fits_file=None, scale=1., 
-                 contam_sn_mask=[10,3]):
+                 contam_sn_mask=[10,3], copy_beam=True, lazy_slices=False):
         """Cutout spectral object from the full frame.
         
         Parameters
@@ -2655,6 +4652,17 @@ class BeamCutout(object):
             
         contam_sn_mask : TBD
         
+        copy_beam : bool
+            Make the `beam` attribute with `GrismDisperser.copy` from the 
+            input `beam` rather than creating a new `GrismDisperser` from 
+            scratch, if it was computed with the same `conf`.  See 
+            `init_from_input`.
+        
+        lazy_slices : bool
+            Extract the `direct` and `grism` cutouts as `ImageDataSlice` 
+            objects with read-only views of the arrays of `flt` and a WCS and
+            header computed only when needed.
+        
         Attributes
         ----------
         grism, direct : `ImageData` (sliced)
@@ -2691,7 +4699,8 @@ class BeamCutout(object):
         if fits_file is not None:
             self.load_fits(fits_file, conf)
         else:
-            self.init_from_input(flt, beam, conf, get_slice_header)
+            self.init_from_input(flt, beam, conf, get_slice_header,
+                                 copy_beam=copy_beam, lazy_slices=lazy_slices)
                     
         ### bad pixels or problems with uncertainties
         self.mask = ((self.grism.data['DQ'] > 0) | 
@@ -2726,6 +4735,7 @@ class BeamCutout(object):
         self.fit_mask *= ~bad_resid
         
         ### Mask very contaminated
+        self.contam_sn_mask = contam_sn_mask
         contam_mask = ((self.contam*np.sqrt(self.ivar) > contam_sn_mask[0]) & 
                       (self.model*np.sqrt(self.ivar) < contam_sn_mask[1]))
         #self.fit_mask *= ~contam_mask.flatten()
@@ -2733,7 +4743,8 @@ class BeamCutout(object):
         self.poly_order = None
         #self.init_poly_coeffs(poly_order=1)
         
-    def init_from_input(self, flt, beam, conf=None, get_slice_header=True):
+    def init_from_input(self, flt, beam, conf=None, get_slice_header=True,
+                        copy_beam=True, lazy_slices=False):
         """Initialize from data objects
         
         Parameters
@@ -2753,19 +4764,38 @@ class BeamCutout(object):
             Get full header of the sliced data.  Costs some overhead so can
             be skipped if full header information isn't required.
         
+        copy_beam : bool
+            If `conf` is None or is the same object as `beam.conf`, make
+            the `beam` attribute with `beam.copy()`, which shares the 
+            thumbnails and the trace and sensitivity arrays of `beam`, 
+            rather than computing them again for a new `GrismDisperser`.
+        
+        lazy_slices : bool
+            Use `ImageData.get_slice` with ``lazy=True`` for the `direct` 
+            and `grism` cutouts.
+            
         Returns
         -------
         Loads attributes to `self`.
         """
         self.id = beam.id
-        if conf is None:
-            conf = grismconf.load_grism_config(flt.conf_file)
-                    
-        self.beam = GrismDisperser(id=beam.id, direct=beam.direct*1,
+        
+        copy_beam &= (conf is None) | (conf is beam.conf)
+        copy_beam &= (beam.fwcpos == flt.grism.fwcpos)
+        
+        if copy_beam:
+            self.beam = beam.copy()
+        else:
+            if conf is None:
+                conf = grismconf.load_grism_config(flt.conf_file)
+            
+            self.beam = GrismDisperser(id=beam.id, direct=beam.direct*1,
                            segmentation=beam.seg*1, origin=beam.origin,
                            pad=beam.pad, grow=beam.grow,
                            beam=beam.beam, conf=conf, xcenter=beam.xcenter,
-                           ycenter=beam.ycenter, fwcpos=flt.grism.fwcpos)
+                           ycenter=beam.ycenter, fwcpos=flt.grism.fwcpos,
+                           model_dtype=getattr(beam, 'model_dtype',
+                                               np.float64))
         
         self.beam.compute_model(spectrum_1d = beam.spectrum_1d)
         
@@ -2776,15 +4806,140 @@ class BeamCutout(object):
                           self.beam.origin[0]+self.beam.sh[0])
 
         self.direct = flt.direct.get_slice(slx_thumb, sly_thumb, 
-                                           get_slice_header=get_slice_header)
+                                           get_slice_header=get_slice_header,
+                                           lazy=lazy_slices)
         self.grism = flt.grism.get_slice(self.beam.slx_parent,
                                          self.beam.sly_parent,
-                                         get_slice_header=get_slice_header)
+                                         get_slice_header=get_slice_header,
+                                         lazy=lazy_slices)
         
         self.contam = flt.model[self.beam.sly_parent, self.beam.slx_parent]*1
         if self.beam.id in flt.object_dispersers:
             self.contam -= self.beam.model
         
+        ### Version of `flt.model` used for `contam`
+        self.model_version = getattr(flt, 'model_version', 0)
+    
+    def refresh_contamination(self, flt):
+        """Update `contam` where the model of the parent exposure changed
+        
+        The regions of `flt.model` modified since `contam` was computed are 
+        taken from `flt.get_model_changes`, and `contam`, `scif`, 
+        `fit_mask` and `contam_mask` are updated in place only within the 
+        bounding box of the changes that overlap the cutout.  If the change log doesn't
+        cover the cutout's version of the model, the full cutout is 
+        updated.
+        
+        Parameters
+        ----------
+        flt : `GrismFLT`
+            Parent exposure from which the cutout was extracted.
+        
+        Returns
+        -------
+        box : None or (slice, slice)
+            Slices of the cutout arrays that were updated, or None if the 
+            model didn't change within the cutout.
+        """
+        sly_parent, slx_parent = self.beam.sly_parent, self.beam.slx_parent
+        y0, x0 = sly_parent.start, slx_parent.start
+        sh = self.contam.shape
+        
+        since = getattr(self, 'model_version', None)
+        if since is None:
+            changes = None
+        else:
+            changes = flt.get_model_changes(since=since)
+            
+        if changes is None:
+            changes = [(sly_parent, slx_parent)]
+        
+        ### Bounding box of the changes within the cutout
+        fsh = flt.model.shape
+        ylo, yhi, xlo, xhi = sh[0], 0, sh[1], 0
+        for sly, slx in changes:
+            cy0 = np.maximum(np.maximum(sly.start, y0), 0) - y0
+            cy1 = np.minimum(np.minimum(sly.stop, y0+sh[0]), fsh[0]) - y0
+            cx0 = np.maximum(np.maximum(slx.start, x0), 0) - x0
+            cx1 = np.minimum(np.minimum(slx.stop, x0+sh[1]), fsh[1]) - x0
+            if (cy1 <= cy0) | (cx1 <= cx0):
+                continue
+            
+            ylo, yhi = min(ylo, cy0), max(yhi, cy1)
+            xlo, xhi = min(xlo, cx0), max(xhi, cx1)
+        
+        self.model_version = getattr(flt, 'model_version', 0)
+        if (yhi <= ylo) | (xhi <= xlo):
+            return None
+        
+        sly, slx = slice(ylo, yhi), slice(xlo, xhi)
+        psly, pslx = slice(ylo+y0, yhi+y0), slice(xlo+x0, xhi+x0)
+        
+        ### Model of the object itself in the parent exposure
+        own = None
+        model_store = getattr(flt, 'model_store', None)
+        if (model_store is not None) and (self.id in model_store):
+            own = model_store.get_object_model(self.id, psly, pslx, 
+                                               beams=[self.beam.beam])
+        elif self.id in flt.object_dispersers:
+            obj = flt.object_dispersers[self.id]
+            if isinstance(obj, OrderedDict):
+                if self.beam.beam in obj:
+                    spectrum_1d = getattr(obj[self.beam.beam], 
+                                          'spectrum_1d', None)
+                    obj = [spectrum_1d]
+                else:
+                    obj = []
+            else:
+                obj = [obj]
+            
+            if len(obj) > 0:
+                own = GrismDisperser.compute_model(self.beam, id=self.id, 
+                                                   spectrum_1d=obj[0],
+                                                   in_place=False)
+                own = own.reshape(self.beam.sh_beam)[sly, slx]
+        
+        contam = flt.model[psly, pslx]*1
+        if own is not None:
+            contam -= own
+        
+        self.contam[sly, slx] = contam
+        
+        scif = self.scif.reshape(sh)
+        scif[sly, slx] = self.grism.data['SCI'][sly, slx] - contam
+        
+        ### Residual mask of `fit_mask` depends on `scif`
+        flat_flam = self.flat_flam.reshape(sh)[sly, slx]
+        fmax = self.flat_flam.max()
+        ivar = self.ivar[sly, slx]
+        
+        fit_mask = (~self.mask[sly, slx]) & (ivar != 0)
+        fit_mask &= flat_flam > 0.01*fmax
+        
+        resid = np.abs(scif[sly, slx] - flat_flam)*np.sqrt(ivar)
+        fit_mask &= ~((flat_flam < 0.05*fmax) & (resid > 5))
+        self.fit_mask.reshape(sh)[sly, slx] = fit_mask
+        
+        ### `contam_mask` is grown by 2 pixels with the maximum filter, so 
+        ### compute it in a larger region
+        gsly = slice(max(ylo-4, 0), min(yhi+4, sh[0]))
+        gslx = slice(max(xlo-4, 0), min(xhi+4, sh[1]))
+        
+        contam_sn_mask = getattr(self, 'contam_sn_mask', [10,3])
+        sivar = np.sqrt(self.ivar[gsly, gslx])
+        contam_mask = ((self.contam[gsly, gslx]*sivar > contam_sn_mask[0]) & 
+                       (self.model[gsly, gslx]*sivar < contam_sn_mask[1]))
+        contam_mask = ~nd.maximum_filter(contam_mask, size=5)
+        
+        msly = slice(max(ylo-2, 0), min(yhi+2, sh[0]))
+        mslx = slice(max(xlo-2, 0), min(xhi+2, sh[1]))
+        
+        self.contam_mask.reshape(sh)[msly, mslx] = \
+                contam_mask[msly.start-gsly.start:msly.stop-gsly.start,
+                            mslx.start-gslx.start:mslx.stop-gslx.start]
+        
+        return msly, mslx
+        
     def load_fits(self, file, conf=None):
         """Initialize from FITS file
         
@@ -2840,6 +4995,12 @@ class BeamCutout(object):
         if (self.grism.fwcpos == 0) | (self.grism.fwcpos == ''):
             self.grism.fwcpos = None
             
+        ### Single-precision models saved from `model_dtype=np.float32`
+        if self.model.dtype.itemsize == 4:
+            model_dtype = np.float32
+        else:
+            model_dtype = np.float64
+            
         self.beam = GrismDisperser(id=h0['ID'], direct=direct, 
                                    segmentation=hdu['SEG'].data*1,
                                    origin=self.direct.origin,
@@ -2847,7 +5008,8 @@ class BeamCutout(object):
                                    grow=grow, beam=h0['BEAM'], 
                                    xcenter=h0['XCENTER'],
                                    ycenter=h0['YCENTER'],
-                                   conf=conf, fwcpos=self.grism.fwcpos)
+                                   conf=conf, fwcpos=self.grism.fwcpos,
+                                   model_dtype=model_dtype)
         
         self.grism.parent_file = h0['GPARENT']
         self.direct.parent_file = h0['DPARENT']
@@ -2868,6 +5030,35 @@ class BeamCutout(object):
         clobber : bool
             Overwrite existing file.
         """
+        hdu = self.get_HDUList()
+        outfile = self.get_fits_filename(root)
+        hdu.writeto(outfile, clobber=clobber)
+        
+        return outfile
+    
+    def get_fits_filename(self, root='beam_'):
+        """Filename of the output of `write_fits`
+        """
+        outfile = '{0}_{1:05d}.{2}.{3}.fits'.format(root, self.beam.id,
+                                         self.grism.filter.lower(),
+                                         self.beam.beam)
+        return outfile
+        
+    def get_HDUList(self, copy=False):
+        """Attributes and data arrays written by `write_fits`
+        
+        Parameters
+        ----------
+        copy : bool
+            Copy the `contam` and `model` arrays, which change when the 
+            object is refit, e.g., to write the `HDUList` in another 
+            thread.
+        
+        Returns
+        -------
+        hdu : `~astropy.io.fits.HDUList`
+            HDU list.
+        """
         h0 = pyfits.Header()
         h0['ID'] = self.beam.id, 'Object ID'
         h0['PAD'] = self.beam.pad, 'Padding of input image'
@@ -2892,19 +5083,18 @@ class BeamCutout(object):
                                    header=hdu[-1].header, name='SEG'))
         
         hdu.extend(self.grism.get_HDUList(extver=2))
-        hdu.append(pyfits.ImageHDU(data=self.contam, header=hdu[-1].header,
+        
+        contam_data, model_data = self.contam, self.model
+        if copy:
+            contam_data, model_data = contam_data*1, model_data*1
+            
+        hdu.append(pyfits.ImageHDU(data=contam_data, header=hdu[-1].header,
                                    name='CONTAM'))
                                    
-        hdu.append(pyfits.ImageHDU(data=self.model, header=hdu[-1].header,
+        hdu.append(pyfits.ImageHDU(data=model_data, header=hdu[-1].header,
                                    name='MODEL'))
         
-        outfile = '{0}_{1:05d}.{2}.{3}.fits'.format(root, self.beam.id,
-                                         self.grism.filter.lower(),
-                                         self.beam.beam)
-                                         
-        hdu.writeto(outfile, clobber=clobber)
-        
-        return outfile
+        return hdu
         
     def compute_model(self, *args, **kwargs):
         """Link to `self.beam.compute_model`
@@ -3179,7 +5369,19 @@ class BeamCutout(object):
         self.A_psf = scipy.sparse.csr_matrix(np.array(A_psf).T)
         self.lam_psf = np.array(lam_psf)
                 
-    def compute_model_psf(self, id=None, spectrum_1d=None, in_place=True):
+    def compute_model_psf(self, id=None, spectrum_1d=None, in_place=True,
+                          spectra_1d=None):
+        if spectra_1d is not None:
+            ### All templates with a single matrix product
+            coeffs = np.ones((len(spectra_1d), len(self.lam_psf)))
+            so = np.argsort(self.lam_psf)
+            for i, sp in enumerate(spectra_1d):
+                if sp is not None:
+                    coeffs[i,so] = interp.interp_conserve_c(self.lam_psf[so],
+                                                            sp[0], sp[1])
+            
+            return np.array(self.A_psf.dot(coeffs.T).T)
+            
         if spectrum_1d is None:
             model = np.array(self.A_psf.sum(axis=1))
             model = model.reshape(self.beam.sh_beam)
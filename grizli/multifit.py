@@ -161,10 +161,56 @@ def test():
     A, out_coeffs, chi2, modelf = mb.fit_at_z(poly_order=1)
     m2d = mb.reshape_flat(modelf)
     
+def _get_flt_save_files(grism_file, sci_extn):
+    """Files of a `.model.GrismFLT` object saved by `GroupFLT.save_full_data`
+    
+    Returns
+    -------
+    save_file : str
+        FITS file written by `~grizli.model.GrismFLT.save_full_pickle`.
+    
+    cache_path : str
+        Directory written by `~grizli.model.GrismFLT.save_full_cache`.
+    
+    use_cache : bool
+        The cache exists and is newer than `save_file`.
+    """
+    new_root = '.{0:02d}.GrismFLT.fits'.format(sci_extn)
+    save_file = grism_file.replace('_flt.fits', new_root)
+    save_file = save_file.replace('_flc.fits', new_root)
+    save_file = save_file.replace('_cmb.fits', new_root)
+    save_file = save_file.replace('_rate.fits', new_root)
+    
+    if (grism_file.find('_') < 0) & ('GrismFLT' not in grism_file):
+        save_file = 'xxxxxxxxxxxxxxxxxxx'
+    
+    ### Memory-mapped cache written by `GrismFLT.save_full_cache`, unless 
+    ### the FITS file was saved after it
+    cache_path = save_file.replace('GrismFLT.fits', 'GrismFLT.cache')
+    cache_pkl = os.path.join(cache_path, 'GrismFLT.pkl')
+    
+    use_cache = os.path.exists(cache_pkl)
+    if use_cache & os.path.exists(save_file):
+        use_cache = os.path.getmtime(cache_pkl) >= os.path.getmtime(save_file)
+    
+    return save_file, cache_path, use_cache
+    
 def _loadFLT(grism_file, sci_extn, direct_file, pad, ref_file, 
-               ref_ext, seg_file, verbose, catalog, ix):
+               ref_ext, seg_file, verbose, catalog, ix, scratch_dir=None):
     """Helper function for loading `.model.GrismFLT` objects with `multiprocessing`.
     
+    The arrays of a cache written by `~grizli.model.GrismFLT.save_full_cache` 
+    are memory-mapped, which only saves memory in the process that keeps 
+    the object, since they are copied if the object is pickled.  
+    `GroupFLT` therefore loads the caches in the parent process.
+    
+    If `scratch_dir` is not None, the large arrays of the `GrismFLT` object
+    are moved to memory-mapped files in that directory (see 
+    `~grizli.model.GrismFLT.share_arrays`) so that only their handles are
+    pickled back to the parent process.  The files aren't removed with the
+    object returned here, so the caller has to take them over with 
+    `~grizli.model.GrismFLT.own_shared_arrays`.
+    
     TBD
     """
     import time
@@ -182,16 +228,18 @@ def _loadFLT(grism_file, sci_extn, direct_file, pad, ref_file,
     
     #print grism_file, direct_file
     
-    new_root = '.{0:02d}.GrismFLT.fits'.format(sci_extn)
-    save_file = grism_file.replace('_flt.fits', new_root)
-    save_file = save_file.replace('_flc.fits', new_root)
-    save_file = save_file.replace('_cmb.fits', new_root)
-    save_file = save_file.replace('_rate.fits', new_root)
-    
-    if (grism_file.find('_') < 0) & ('GrismFLT' not in grism_file):
-        save_file = 'xxxxxxxxxxxxxxxxxxx'
+    save_file, cache_path, use_cache = _get_flt_save_files(grism_file, 
+                                                           sci_extn)
+    if use_cache:
+        print('Load {0}!'.format(cache_path))
+        
+        fp = open(os.path.join(cache_path, 'GrismFLT.pkl'), 'rb')
+        flt = pickle.load(fp)
+        fp.close()
         
-    if os.path.exists(save_file):
+        status = flt.load_from_cache(cache_path)
+        
+    elif os.path.exists(save_file):
         print('Load {0}!'.format(save_file))
         
         fp = open(save_file.replace('GrismFLT.fits', 'GrismFLT.pkl'), 'rb')
@@ -211,12 +259,16 @@ def _loadFLT(grism_file, sci_extn, direct_file, pad, ref_file,
         flt.catalog = flt.blot_catalog(catalog, 
                                    sextractor=('X_WORLD' in catalog.colnames))
         flt.catalog_file = catalog
+        flt.get_catalog_index()
                    
     else:
         flt.catalog = None 
 
     if flt.grism.instrument == 'NIRISS':
         flt.transform_NIRISS()
+    
+    if scratch_dir is not None:
+        flt.share_arrays(scratch_dir=scratch_dir, cleanup=False)
         
     return flt #, out_cat
     
@@ -235,6 +287,32 @@ def _fit_at_z(self, zgrid, i, templates, fitter, fit_background, poly_order):
     return data
     #A, coeffs[i,:], chi2[i], model_2d = out
     
+### Fit data of a process in a pool for `MultiBeam.eval_zgrid`
+_fit_worker_data = {}
+
+def _init_fit_worker(mb, templates, fit_kwargs, normal_equations):
+    """Store the `MultiBeam` object and fit parameters in a pool process
+    """
+    _fit_worker_data['mb'] = mb
+    _fit_worker_data['templates'] = templates
+    _fit_worker_data['fit_kwargs'] = fit_kwargs
+    _fit_worker_data['normal_equations'] = normal_equations
+    
+def _fit_worker_at_z(z):
+    """Fit at a single redshift in a pool process set up with 
+    `_init_fit_worker`
+    """
+    mb = _fit_worker_data['mb']
+    if _fit_worker_data['normal_equations']:
+        fit_func = mb.fit_at_z_normal
+    else:
+        fit_func = mb.fit_at_z
+        
+    out = fit_func(z=z, templates=_fit_worker_data['templates'], 
+                   **_fit_worker_data['fit_kwargs'])
+    
+    return out[1], out[2]
+    
 def test_parallel():
     
     zgrid = np.linspace(1.1,1.3,10)
@@ -264,6 +342,9 @@ def test_parallel():
     
 def _compute_model(i, flt, fit_info, store):
     """Helper function for computing model orders.
+    
+    If the `model` array of `flt` is shared through a memory-mapped file, 
+    it is updated in place and None is returned in its place.
     """
     for id in fit_info:
         status = flt.compute_model_orders(id=id, compute_size=True,
@@ -272,15 +353,43 @@ def _compute_model(i, flt, fit_info, store):
                           verbose=False)
     
     print('{0}: _compute_model Done'.format(flt.grism.parent_file))
+    
+    shared = getattr(flt, 'shared_arrays', None)
+    if shared:
+        if utils.is_shared_array(flt.model, shared['model']):
+            flt.model.flush()
+            return i, None, flt.object_dispersers
         
     return i, flt.model, flt.object_dispersers
+
+def _map_threads(func, items, threads=1):
+    """Apply `func` to `items` in a pool of threads
+    
+    The results are returned in the order of `items`, and `func` is simply 
+    applied serially if `threads` <= 1.  The threads are only useful where 
+    the heavy lifting releases the GIL, e.g., the `disperse` and numpy 
+    kernels.
+    """
+    if (threads <= 1) | (len(items) <= 1):
+        return [func(item) for item in items]
+    
+    from multiprocessing.pool import ThreadPool
+    
+    pool = ThreadPool(processes=np.minimum(threads, len(items)))
+    try:
+        results = pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        
+    return results
     
 class GroupFLT():
     def __init__(self, grism_files=[], sci_extn=1, direct_files=[],
                  pad=200, group_name='group', 
                  ref_file=None, ref_ext=0, seg_file=None,
                  shrink_segimage=True, verbose=True, cpu_count=0,
-                 catalog=''):
+                 catalog='', scratch_dir=None):
         """Main container for handling multiple grism exposures together
         
         Parameters
@@ -338,6 +447,14 @@ class GroupFLT():
             Catalog filename assocated with `seg_file`.  These are typically
             generated with "SExtractor", but the source of the files 
             themselves isn't critical.
+        
+        scratch_dir : None, True or str
+            If not None, keep the large arrays of the `GrismFLT` objects in
+            memory-mapped files in this directory, or in `/dev/shm` (or the 
+            temporary directory) for `True`.  The exposures are then passed 
+            to and from the `multiprocessing` workers as lightweight handles
+            and the models are computed in place.  Call 
+            `release_shared_arrays` to remove the files when done.
             
         Attributes
         ----------
@@ -360,6 +477,9 @@ class GroupFLT():
         self.direct_files = direct_files
         self.group_name = group_name
         
+        if scratch_dir is not None:
+            scratch_dir = utils.get_scratch_dir(scratch_dir)
+        
         ### Read catalog
         if catalog:
             if isinstance(catalog, str):
@@ -394,7 +514,8 @@ class GroupFLT():
             self.FLTs = []
             t0_pool = time.time()
             for i in range(self.N):
-                flt = _loadFLT(self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i)
+                flt = _loadFLT(self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i, scratch_dir)
+                flt.own_shared_arrays()
                 self.FLTs.append(flt)
                 
             t1_pool = time.time()
@@ -403,14 +524,29 @@ class GroupFLT():
             self.FLTs = []
             t0_pool = time.time()
         
+            ### Memory-mapped caches are loaded here, since pickling them
+            ### back from the pool would read them into memory
+            in_pool = [not _get_flt_save_files(file, sci_extn)[2] 
+                       for file in self.grism_files]
+            
             pool = mp.Pool(processes=cpu_count)
-            results = [pool.apply_async(_loadFLT, (self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i)) for i in range(self.N)]
-        
+            results = [pool.apply_async(_loadFLT, (self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i, scratch_dir)) for i in range(self.N) if in_pool[i]]
+            
+            cached = [_loadFLT(self.grism_files[i], sci_extn, self.direct_files[i], pad, ref_file, ref_ext, seg_file, verbose, self.catalog, i, scratch_dir) for i in range(self.N) if not in_pool[i]]
+            
             pool.close()
             pool.join()
-    
-            for res in results:
-                flt_i = res.get(timeout=1)
+            
+            results = results[::-1]
+            cached = cached[::-1]
+            for i in range(self.N):
+                if not in_pool[i]:
+                    flt_i = cached.pop()
+                    flt_i.own_shared_arrays()
+                    self.FLTs.append(flt_i)
+                    continue
+                    
+                flt_i = results.pop().get(timeout=1)
                 #flt_i.catalog = cat_i
                 
                 # somehow WCS getting flipped from cd to pc in res.get()???
@@ -418,6 +554,8 @@ class GroupFLT():
                     for obj in [flt_i.grism, flt_i.direct]:
                         obj.get_wcs()
                 
+                ### Scratch files removed with the copy in this process
+                flt_i.own_shared_arrays()
                 self.FLTs.append(flt_i)
                 
                 
@@ -426,7 +564,7 @@ class GroupFLT():
         if verbose:
             print('Files loaded - {0:.2f} sec.'.format(t1_pool - t0_pool))
     
-    def save_full_data(self, warn=True):
+    def save_full_data(self, warn=True, cache=False):
         """Save models and data files for fast regeneration.
         
         The filenames of the outputs are generated from the input grism 
@@ -450,6 +588,13 @@ class GroupFLT():
         warn : bool
             Print a warning and skip if an output file is already found to
             exist.
+        
+        cache : bool
+            Save to the directories of memory-mappable arrays written by 
+            `~grizli.model.GrismFLT.save_full_cache`, e.g., 
+            `ib3701ryq.01.GrismFLT.cache`, rather than to the FITS and 
+            pickle files.  These open much faster and are read by 
+            `_loadFLT` unless the FITS file is newer.
                 
         Notes
         -----
@@ -472,12 +617,28 @@ class GroupFLT():
             save_file = save_file.replace('_flc.fits', new_root)
             save_file = save_file.replace('_cmb.fits', new_root)
             save_file = save_file.replace('_rate.fits', new_root)
+            if cache:
+                ### Shared arrays aren't copied since they're replaced by 
+                ### the cache
+                cache_path = self.FLTs[i].save_full_cache()
+                self.FLTs[i].release_shared_arrays(copy_data=False)
+                self.FLTs[i].load_from_cache(cache_path)
+                continue
+                
             print('Save {0}'.format(save_file))
             self.FLTs[i].save_full_pickle()
             
             ### Reload initialized data
             self.FLTs[i].load_from_fits(save_file)
             
+    def release_shared_arrays(self, remove_files=True):
+        """Copy shared arrays of the `GrismFLT` objects back to memory
+        
+        See `~grizli.model.GrismFLT.release_shared_arrays`.
+        """
+        for flt in self.FLTs:
+            flt.release_shared_arrays(remove_files=remove_files)
+            
     def extend(self, new, verbose=True):
         """Add another `GroupFLT` instance to `self`
         
@@ -504,7 +665,75 @@ class GroupFLT():
         if verbose:
             print('Now we have {0:d} FLTs'.format(self.N))
             
-    def compute_single_model(self, id, mag=-99, size=-1, store=False, spectrum_1d=None, get_beams=None, in_place=True):
+    def get_catalog_positions(self, ids):
+        """Detector positions of many objects in all of the exposures
+        
+        Parameters
+        ----------
+        ids : array-like
+            Object IDs
+        
+        Returns
+        -------
+        x_flt, y_flt : `~numpy.ndarray`
+            Detector coordinates (1-indexed, as in 
+            `~grizli.model.GrismFLT.blot_catalog`) with shape 
+            `(self.N, len(ids))`.  NaN for objects that aren't in the
+            catalogs of the individual exposures.
+        """
+        ids = np.atleast_1d(ids)
+        x_flt = np.zeros((self.N, len(ids)))+np.nan
+        y_flt = np.zeros((self.N, len(ids)))+np.nan
+        
+        for i, flt in enumerate(self.FLTs):
+            if flt.catalog is None:
+                continue
+                
+            rows = flt.get_catalog_rows(ids)
+            found = rows >= 0
+            x_flt[i, found] = np.array(flt.catalog['x_flt'])[rows[found]]
+            y_flt[i, found] = np.array(flt.catalog['y_flt'])[rows[found]]
+        
+        return x_flt, y_flt
+        
+    def build_footprint_indices(self, **kwargs):
+        """Build the footprint index of each exposure
+        
+        Keywords are passed to 
+        `~grizli.model.GrismFLT.build_footprint_index`.
+        """
+        for flt in self.FLTs:
+            flt.build_footprint_index(**kwargs)
+    
+    def get_overlapping_ids(self, id, beams=None):
+        """Objects whose dispersed spectra overlap those of an object
+        
+        Requires `build_footprint_indices`.
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        beams : None or list
+            Only consider these beams of object `id`.
+            
+        Returns
+        -------
+        overlaps : list
+            Arrays of the overlapping ids in each exposure of `self.FLTs`.
+        """
+        overlaps = []
+        for flt in self.FLTs:
+            if getattr(flt, 'footprint_index', None) is None:
+                flt.build_footprint_index()
+            
+            overlaps.append(flt.footprint_index.get_overlapping_ids(id,
+                                                                beams=beams))
+        
+        return overlaps
+        
+    def compute_single_model(self, id, mag=-99, size=-1, store=False, spectrum_1d=None, get_beams=None, in_place=True, threads=1):
         """Compute model spectrum in all exposures
         TBD
         
@@ -524,20 +753,23 @@ class GroupFLT():
         
         in_place : type
         
+        threads : int
+            Number of threads over which to distribute the exposures.  
+            Each exposure is only modified by a single thread and the 
+            results are returned in the order of `self.FLTs`.
         
         Returns
         -------
         TBD
                
         """
-        out_beams = []
-        for flt in self.FLTs:
-            status = flt.compute_model_orders(id=id, verbose=False,
+        def _compute(flt):
+            return flt.compute_model_orders(id=id, verbose=False,
                           size=size, compute_size=(size < 0),
                           mag=mag, in_place=in_place, store=store,
                           spectrum_1d = spectrum_1d, get_beams=get_beams)
-            
-            out_beams.append(status)
+        
+        out_beams = _map_threads(_compute, self.FLTs, threads=threads)
         
         if get_beams:
             return out_beams
@@ -577,39 +809,326 @@ class GroupFLT():
         for res in results:
             i, model, dispersers = res.get(timeout=1)
             self.FLTs[i].object_dispersers = dispersers
-            self.FLTs[i].model = model
+            
+            ### `model` is None if it was updated in a shared file
+            if model is not None:
+                self.FLTs[i].model = model
+            
+            sh = self.FLTs[i].model.shape
+            self.FLTs[i].record_model_change(slice(0, sh[0]), 
+                                             slice(0, sh[1]))
             
         t1_pool = time.time()
         if verbose:
             print('Models computed - {0:.2f} sec.'.format(t1_pool - t0_pool))
         
     def get_beams(self, id, size=10, beam_id='A', min_overlap=0.2, 
-                  get_slice_header=True):
+                  get_slice_header=True, lazy_slices=False, threads=1):
         """TBD
-        """
-        beams = self.compute_single_model(id, size=size, store=False, get_beams=[beam_id])
         
-        out_beams = []
-        for flt, beam in zip(self.FLTs, beams):
+        If `lazy_slices` is True, the cutouts are made with read-only views 
+        of the FLT arrays and the WCS and headers are computed only when 
+        accessed (see `~grizli.model.ImageDataSlice`).
+        
+        With `threads` > 1, the dispersed models and cutouts of the 
+        individual exposures are computed in a pool of threads.  The 
+        beams are returned in the order of `self.FLTs` either way.
+        """
+        def _get_beam(flt):
+            beam = flt.compute_model_orders(id=id, verbose=False,
+                                            size=size, compute_size=(size < 0),
+                                            mag=-99, in_place=True, 
+                                            store=False, get_beams=[beam_id])
+            
             try:
                 out_beam = model.BeamCutout(flt=flt, beam=beam[beam_id],
                                         conf=flt.conf, 
-                                        get_slice_header=get_slice_header)
+                                        get_slice_header=get_slice_header,
+                                        lazy_slices=lazy_slices)
             except:
-                continue
+                return None
             
             hasdata = ((out_beam.grism['SCI'] != 0).sum(axis=0) > 0).sum()
             if hasdata*1./out_beam.model.shape[1] < min_overlap:
-                continue
+                return None
             
-            out_beams.append(out_beam)
+            return out_beam
+        
+        beams = _map_threads(_get_beam, self.FLTs, threads=threads)
+        out_beams = [beam for beam in beams if beam is not None]
             
         return out_beams
     
+    def get_beams_manifest(self, id):
+        """Filename of the list of beam files written by `iter_multibeams`
+        
+        The file is written after all of the beam files of an object, so 
+        its existence means that the object has been completed.
+        """
+        return '{0}_{1:05d}.beams.lis'.format(self.group_name, id)
+        
+    def extract_multibeam(self, id, size=10, beam_id='A', min_overlap=0.2,
+                          get_slice_header=True, fcontam=0., psf=False,
+                          write=True, verbose=True):
+        """Extract the beams of a single object and optionally write them
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        size, beam_id, min_overlap, get_slice_header : 
+            See `get_beams`.
+        
+        fcontam, psf : 
+            See `MultiBeam`.
+        
+        write : bool
+            Write the beams with `MultiBeam.write_beam_fits` and then the 
+            list of files to `get_beams_manifest(id)`.
+            
+        Returns
+        -------
+        mb : `MultiBeam` or None
+            None if no beams were extracted.
+        """
+        beams = self.get_beams(id, size=size, beam_id=beam_id, 
+                               min_overlap=min_overlap,
+                               get_slice_header=get_slice_header)
+        
+        if len(beams) == 0:
+            mb = None
+            outfiles = []
+        else:
+            mb = MultiBeam(beams, group_name=self.group_name, 
+                           fcontam=fcontam, psf=psf)
+            
+            if write:
+                outfiles = mb.write_beam_fits(verbose=False)
+        
+        if write:
+            self.write_beams_manifest(id, outfiles, verbose=verbose)
+                
+        return mb
+    
+    def write_beams_manifest(self, id, outfiles, verbose=True):
+        """Write the list of beam files of an object
+        
+        The list is written to a temporary file that is then moved to
+        `get_beams_manifest(id)`, so it only exists once complete.
+        
+        Parameters
+        ----------
+        id : int
+            Object id.
+        
+        outfiles : list
+            Filenames of the beams of the object.
+        
+        verbose : bool
+            Print a status message.
+        """
+        manifest = self.get_beams_manifest(id)
+        fp = open(manifest+'.tmp', 'w')
+        for file in outfiles:
+            fp.write(file+'\n')
+        
+        fp.close()
+        os.rename(manifest+'.tmp', manifest)
+        
+        if verbose:
+            print('{0}: {1:d} beams'.format(manifest, len(outfiles)))
+    
+    def _extract_multibeam_products(self, id, write=True, **kwargs):
+        """Thread worker for `iter_multibeams`
+        
+        Extract the beams of an object with `extract_multibeam` and, if 
+        `write`, make the `HDUList` objects of the beam files with copies 
+        of the arrays that can change when the object is fit.
+        
+        Returns
+        -------
+        mb : `MultiBeam` or None
+            Extracted beams.
+        
+        products : None or list
+            List of (filename, `~astropy.io.fits.HDUList`) tuples.
+        """
+        mb = self.extract_multibeam(id, write=False, **kwargs)
+        if not write:
+            return mb, None
+            
+        products = []
+        if mb is not None:
+            for beam in mb.beams:
+                root = beam.grism.parent_file.split('.fits')[0]
+                products.append((beam.get_fits_filename(root), 
+                                 beam.get_HDUList(copy=True)))
+        
+        return mb, products
+    
+    def _write_multibeam_products(self, id, products, verbose=True):
+        """Writer worker for `iter_multibeams`
+        
+        Write the beam files made by `_extract_multibeam_products` and then 
+        the list of files.  Errors are printed rather than raised, and the 
+        list isn't written in that case, so the object is redone by the 
+        next run with `skip_existing`.
+        
+        Returns
+        -------
+        status : bool
+            True if all of the files were written.
+        """
+        try:
+            outfiles = []
+            for outfile, hdu in products:
+                hdu.writeto(outfile, clobber=True)
+                outfiles.append(outfile)
+            
+            self.write_beams_manifest(id, outfiles, verbose=verbose)
+        except Exception as err:
+            print('ID {0}: failed to write beams ({1})'.format(id, err))
+            return False
+        
+        return True
+        
+    def iter_multibeams(self, ids, size=10, beam_id='A', min_overlap=0.2,
+                        get_slice_header=True, fcontam=0., psf=False, 
+                        write=True, skip_existing=True, threads=2, 
+                        prefetch=4, verbose=True):
+        """Generator of `MultiBeam` objects for a list of objects
+        
+        The objects are extracted with `extract_multibeam` in a pool of 
+        threads, at most `prefetch` objects ahead of the one being 
+        processed by the caller, so the memory use doesn't grow with the 
+        length of `ids`.  If `write`, the beam files and then the list of 
+        files (`get_beams_manifest`) of each object are written by a 
+        separate writer thread while the caller works on the object.  At 
+        most `prefetch` objects wait to be written; the generator waits 
+        for the writer otherwise.
+        
+            >>> for mb in grp.iter_multibeams(ids):
+            >>>     out = mb.fit_redshift()
+        
+        Objects whose extraction raises an exception are skipped with a 
+        message, as are the files of objects that can't be written, so that
+        a single bad object doesn't stop the run.  The list of files isn't
+        written for these objects.
+        
+        Parameters
+        ----------
+        ids : list or `~numpy.ndarray`
+            Object ids.
+        
+        size, beam_id, min_overlap, get_slice_header, fcontam, psf, write :
+            See `extract_multibeam`.
+        
+        skip_existing : bool
+            If `write`, skip objects for which the list of files from 
+            `get_beams_manifest` already exists, e.g., to resume an 
+            interrupted run.
+        
+        threads : int
+            Number of extraction threads.
+        
+        prefetch : int
+            Maximum number of objects extracted ahead of the caller, and 
+            of objects waiting to be written.
+        
+        verbose : bool
+            Print status messages.
+            
+        Returns
+        -------
+        Generator yielding `MultiBeam` objects in the order of `ids`, 
+        skipping objects without any extracted beams.
+        """
+        from multiprocessing.pool import ThreadPool
+        from collections import deque
+        
+        prefetch = int(np.maximum(prefetch, 1))
+        
+        ids = [id for id in ids]
+        if write & skip_existing:
+            todo = []
+            for id in ids:
+                if os.path.exists(self.get_beams_manifest(id)):
+                    if verbose:
+                        print('{0}: skip'.format(self.get_beams_manifest(id)))
+                else:
+                    todo.append(id)
+                    
+            ids = todo
+        
+        ### Cached lookup tables used by the threads
+        for flt in self.FLTs:
+            flt.get_catalog_index()
+            if flt.direct.data['REF'] is None:
+                flt.get_segmentation_table(ext='SCI')
+            else:
+                flt.get_segmentation_table(ext='REF')
+        
+        kwargs = dict(size=size, beam_id=beam_id, min_overlap=min_overlap,
+                      get_slice_header=get_slice_header, fcontam=fcontam, 
+                      psf=psf, write=write, verbose=verbose)
+        
+        pool = ThreadPool(processes=np.maximum(threads, 1))
+        pending = deque()
+        next_i = 0
+        
+        ### Single writer thread, so the files are written in order
+        if write:
+            writer = ThreadPool(processes=1)
+            writing = deque()
+        
+        try:
+            while (next_i < len(ids)) | (len(pending) > 0):
+                while (next_i < len(ids)) & (len(pending) < prefetch):
+                    task = pool.apply_async(self._extract_multibeam_products,
+                                            (ids[next_i],), kwargs)
+                    pending.append((ids[next_i], task))
+                    next_i += 1
+                
+                id, task = pending.popleft()
+                try:
+                    mb, products = task.get()
+                except Exception as err:
+                    print('ID {0}: extraction failed ({1})'.format(id, err))
+                    continue
+                
+                if write:
+                    ### Wait for the writer if it falls behind
+                    while len(writing) >= prefetch:
+                        writing.popleft().wait()
+                        
+                    task = writer.apply_async(self._write_multibeam_products,
+                                              (id, products), 
+                                              dict(verbose=verbose))
+                    writing.append(task)
+                    
+                if mb is not None:
+                    yield mb
+                
+                mb = products = None
+        finally:
+            pool.close()
+            pool.join()
+            
+            ### Wait for the files to be written
+            if write:
+                writer.close()
+                writer.join()
+            
     def refine_list(self, ids=[], mags=[], poly_order=2, mag_limits=[16,24], 
-                    max_coeff=5, ds9=None, verbose=True):
+                    max_coeff=5, ds9=None, verbose=True, threads=1,
+                    max_batch_size=None):
         """TBD
         
+        If `threads` > 1, refine independent objects in parallel with
+        `refine_batches`.  The models aren't displayed in `ds9` in that 
+        case.
+        
         bright = self.catalog['MAG_AUTO'] < 24
         ids = self.catalog['NUMBER'][bright]*1
         mags = self.catalog['MAG_AUTO'][bright]*1
@@ -629,32 +1148,226 @@ class GroupFLT():
             
             so = np.argsort(mags)
             ids, mags = ids[so], mags[so]
+        
+        if threads > 1:
+            if ds9 is not None:
+                print('refine_list: ds9 display is skipped with threads > 1')
+                
+            self.refine_batches(ids, mags, poly_order=poly_order,
+                                max_coeff=max_coeff, size=30, 
+                                threads=threads, 
+                                max_batch_size=max_batch_size,
+                                verbose=verbose)
+            return True
             
         for id, mag in zip(ids, mags):
             self.refine(id, mag=mag, poly_order=poly_order,
                         max_coeff=max_coeff, size=30, ds9=ds9,
                         verbose=verbose)
             
-    def refine(self, id, mag=-99, poly_order=1, size=30, ds9=None, verbose=True, max_coeff=2.5):
-        """TBD
+    def get_refine_batches(self, ids, mags=None, size=30, margin=2, 
+                           max_batch_size=None):
+        """Split a list of objects into batches that can be refined together
+        
+        The footprint of each object in each exposure is taken to be the 
+        union of the bounding boxes of its spectral orders and of the 
+        cutouts extracted by `refine` with `size` (see 
+        `~grizli.model.GrismFLT.get_footprint_boxes`).  Each object is put 
+        in the batch after the last batch containing an object earlier in
+        the list whose footprint overlaps its own in any exposure.  
+        
+        Objects in the same batch therefore don't overlap, and refining the
+        batches one after the other sees the same models as refining the
+        objects one at a time in the order of `ids`.
+        
+        Parameters
+        ----------
+        ids : list or `~numpy.ndarray`
+            Object ids, in the order they would be refined.
+        
+        mags : None or list or `~numpy.ndarray`
+            Magnitudes used to decide which orders to include, as in 
+            `compute_model_orders`.
+            
+        size : int
+            Cutout size used by `refine`.
+            
+        margin : int
+            Extra padding of the footprints.
+        
+        max_batch_size : None or int
+            Maximum number of objects per batch.
+            
+        Returns
+        -------
+        batches : list
+            List of arrays of indices of `ids`.
+        """
+        ids = np.atleast_1d(ids)
+        
+        indices = []
+        for flt in self.FLTs:
+            out = flt.get_footprint_boxes(ids=ids, mags=mags, size=size, 
+                                          margin=margin)
+            index = model.FootprintIndex(flt.seg.shape)
+            index.build(*out)
+            indices.append(index)
+        
+        position = {}
+        for i, id in enumerate(ids):
+            position[id] = i
+            
+        batch_of = np.zeros(len(ids), dtype=int)
+        batches = []
+        for i, id in enumerate(ids):
+            ib = 0
+            for index in indices:
+                for box in index.get_footprints(id)[1]:
+                    for j in index.query(box, exclude=[id]):
+                        k = position[index.ids[j]]
+                        if k < i:
+                            ib = max(ib, batch_of[k]+1)
+            
+            if max_batch_size is not None:
+                while (ib < len(batches)):
+                    if len(batches[ib]) < max_batch_size:
+                        break
+                    
+                    ib += 1
+            
+            if ib == len(batches):
+                batches.append([])
+            
+            batches[ib].append(i)
+            batch_of[i] = ib
+        
+        return [np.array(batch) for batch in batches]
+        
+    def refine_batches(self, ids, mags, poly_order=1, max_coeff=2.5, 
+                       size=30, threads=2, max_batch_size=None, 
+                       verbose=True):
+        """Refine batches of non-overlapping objects in parallel
+        
+        The objects are split into batches with `get_refine_batches`.  The
+        fits of `refine_spectrum` for the objects of a batch are computed 
+        in a pool of threads, and then the models of the exposures are 
+        updated in the order of `ids`.  The final models are the same as 
+        refining the objects one at a time with `refine`.
+        
+        Parameters
+        ----------
+        ids, mags : list or `~numpy.ndarray`
+            Object ids and magnitudes, in the order they would be refined.
+        
+        poly_order, max_coeff, size : 
+            See `refine`.
+        
+        threads : int
+            Number of threads.
+        
+        max_batch_size : None or int
+            See `get_refine_batches`.
+            
+        verbose : bool
+            Print status messages.
+        
+        Returns
+        -------
+        batches : list
+            Batches from `get_refine_batches`.
+        """
+        from multiprocessing.pool import ThreadPool
+        
+        ids = np.atleast_1d(ids)
+        mags = np.atleast_1d(mags)
+        
+        batches = self.get_refine_batches(ids, mags=mags, size=size,
+                                          max_batch_size=max_batch_size)
+        
+        ### Cached lookup tables used by the threads
+        for flt in self.FLTs:
+            flt.get_catalog_index()
+            if flt.direct.data['REF'] is None:
+                flt.get_segmentation_table(ext='SCI')
+            else:
+                flt.get_segmentation_table(ext='REF')
+        
+        def _fit(i):
+            return self.refine_spectrum(ids[i], poly_order=poly_order,
+                                        size=size, max_coeff=max_coeff)
+            
+        pool = ThreadPool(processes=threads)
+        
+        for ib, batch in enumerate(batches):
+            if verbose:
+                print('Refine batch {0:d}/{1:d}: {2:d} objects'.format(ib+1, 
+                                                  len(batches), len(batch)))
+                
+            results = pool.map(_fit, batch)
+            for i, result in zip(batch, results):
+                status, spectrum_1d, scale_coeffs = result
+                if spectrum_1d is None:
+                    continue
+                
+                self.compute_single_model(ids[i], mag=mags[i], size=-1,
+                                          store=False, 
+                                          spectrum_1d=spectrum_1d, 
+                                          get_beams=None, in_place=True)
+                
+                if verbose:
+                    print('{0} mag={1:6.2f} {2}'.format(ids[i], mags[i], 
+                                                        scale_coeffs))
+        
+        pool.close()
+        pool.join()
+        
+        return batches
+        
+    def refine_spectrum(self, id, poly_order=1, size=30, max_coeff=2.5):
+        """Fit the polynomial spectrum of `refine` without updating models
+        
+        Returns
+        -------
+        status : bool
+            Status returned by `refine`.
+            
+        spectrum_1d : None or [`~numpy.array`, `~numpy.array`]
+            Spectrum to add to the models, or None if the models shouldn't 
+            be updated.
+        
+        scale_coeffs : None or `~numpy.array`
+            Fitted polynomial coefficients.
         """
         beams = self.get_beams(id, size=size, min_overlap=0.5, get_slice_header=False)
         if len(beams) == 0:
-            return True
+            return True, None, None
         
         mb = MultiBeam(beams)
         try:
             A, out_coeffs, chi2, modelf = mb.fit_at_z(poly_order=poly_order, fit_background=True, fitter='lstsq')
         except:
-            return False
+            return False, None, None
             
         xspec = np.arange(0.3, 2.35, 0.05)-1
         scale_coeffs = out_coeffs[mb.N*mb.fit_bg:mb.N*mb.fit_bg+mb.n_poly]
         yspec = [xspec**o*scale_coeffs[o] for o in range(mb.poly_order+1)]
         if np.abs(scale_coeffs).max() > max_coeff:
-            return True
+            return True, None, scale_coeffs
+        
+        spectrum_1d = [(xspec+1)*1.e4, np.sum(yspec, axis=0)]
+        return True, spectrum_1d, scale_coeffs
+        
+    def refine(self, id, mag=-99, poly_order=1, size=30, ds9=None, verbose=True, max_coeff=2.5):
+        """TBD
+        """
+        status, spectrum_1d, scale_coeffs = self.refine_spectrum(id, 
+                                                      poly_order=poly_order,
+                                                      size=size, 
+                                                      max_coeff=max_coeff)
+        if spectrum_1d is None:
+            return status
             
-        self.compute_single_model(id, mag=mag, size=-1, store=False, spectrum_1d=[(xspec+1)*1.e4, np.sum(yspec, axis=0)], get_beams=None, in_place=True)
+        self.compute_single_model(id, mag=mag, size=-1, store=False, spectrum_1d=spectrum_1d, get_beams=None, in_place=True)
         
         if ds9:
             flt = self.FLTs[0]
@@ -932,7 +1645,8 @@ class MultiBeam():
                     
                     # Use REF extension.  scale factors might be wrong
                     beam.direct.data['SCI'] = beam.direct.data['REF'] 
-                    beam.direct.data['ERR'] *= beam.direct.ref_photflam
+                    beam.direct.data['ERR'] = (beam.direct.data['ERR']*
+                                               beam.direct.ref_photflam)
                     beam.direct.filter = beam.direct.ref_filter #'F160W'
                     beam.direct.photflam = beam.direct.ref_photflam
                 
@@ -1043,6 +1757,7 @@ class MultiBeam():
             return None
         
         self.poly_order = poly_order
+        self.normal_cache = None
         if flat is None:
             flat = self.flat_flam
                        
@@ -1061,7 +1776,127 @@ class MultiBeam():
         """
         for beam in self.beams:
             beam.beam.compute_model(id=id, spectrum_1d=spectrum_1d)
+
+    def refresh_contamination(self, flts):
+        """Update the contamination of the beams for changed FLT models
+        
+        Runs `~grizli.model.BeamCutout.refresh_contamination` for each beam
+        with its parent exposure in `flts` and updates the flattened 
+        `scif`, `contamf`, `fit_mask` and `weight` arrays where the beams 
+        changed.
+        
+        Parameters
+        ----------
+        flts : list
+            `~grizli.model.GrismFLT` objects, e.g., `GroupFLT.FLTs`.  The 
+            parent of each beam is matched by the `parent_file` and 
+            `sci_extn` attributes of the grism `ImageData`.
+        
+        Returns
+        -------
+        nchanged : int
+            Number of beams that were updated.
+        """
+        parents = {}
+        for flt in flts:
+            parents[(flt.grism.parent_file, flt.grism.sci_extn)] = flt
+        
+        nchanged = 0
+        i0 = 0
+        for ib, beam in enumerate(self.beams):
+            i1 = i0 + self.Nflat[ib]
+            key = (beam.grism.parent_file, beam.grism.sci_extn)
+            if key not in parents:
+                i0 = i1
+                continue
+            
+            box = beam.refresh_contamination(parents[key])
+            if box is not None:
+                nchanged += 1
+                self.scif[i0:i1] = beam.scif
+                self.contamf[i0:i1] = beam.contam.flatten()
+                self.fit_mask[i0:i1] = (beam.fit_mask*beam.contam_mask & 
+                                        (self.ivarf[i0:i1] >= 0))
+                
+                self.weight[i0:i1] = np.exp(-(self.fcontam*
+                                         np.abs(self.contamf[i0:i1])*
+                                         np.sqrt(self.ivarf[i0:i1])))
+            
+            i0 = i1
+        
+        if nchanged > 0:
+            self.DoF = int((self.weight*self.fit_mask).sum())
+            self.normal_cache = None
+        
+        return nchanged
+        
+    def init_sparse_operators(self):
+        """Precompute sparse dispersion operators for all beams
+
+        See `~grizli.model.GrismDisperser.init_sparse_operator`.  After this
+        is run, the template models computed in `fit_at_z` don't have to
+        loop over the direct image pixels.
+        """
+        for beam in self.beams:
+            beam.beam.init_sparse_operator()
+
+    def compute_template_matrix(self, z=0., templates={}):
+        """Dispersed models of redshifted templates
+        
+        Parameters
+        ----------
+        z : float
+            Redshift.
+        
+        templates : dict
+            `~grizli.utils.SpectrumTemplate` objects.
+        
+        Returns
+        -------
+        A_temp : `~numpy.ndarray`, (len(templates), `Ntot`)
+            Flattened models of the templates in all beams.
+        """
+        NTEMP = len(templates)
+        A_temp = np.zeros((NTEMP, self.Ntot))
+                  
+        #print 'xxx Load templates'
+        spectra = []
+        for i, key in enumerate(templates.keys()):
+            temp = templates[key]#.zscale(z, 1.)
+            spectrum_1d = [temp.wave*(1+z), temp.flux/(1+z)]
+            
+            if z > 4:
+                # Cached IGM transmission, 1 if not available
+                igmz = utils.get_igm_transmission(z, temp.wave)
+                spectrum_1d[1] = spectrum_1d[1]*igmz
+            
+            spectra.append(spectrum_1d)
+        
+        ### All templates for a given beam in a single pass
+        i0 = 0            
+        for ib in range(self.N):
+            beam = self.beams[ib]
+            lam_beam = beam.beam.lam_beam
+            
+            in_range = []
+            for i, key in enumerate(templates.keys()):
+                temp = templates[key]
+                if ((temp.wave.min()*(1+z) > lam_beam.max()) | 
+                    (temp.wave.max()*(1+z) < lam_beam.min())):
+                    continue
+                
+                in_range.append(i)
             
+            if len(in_range) > 0:
+                tmodels = beam.compute_model(in_place=False,
+                               spectra_1d=[spectra[i] for i in in_range])
+                
+                A_temp[in_range, i0:i0+self.Nflat[ib]] = tmodels
+                
+            i0 += self.Nflat[ib]
+        
+        return A_temp
+        
     def fit_at_z(self, z=0., templates={}, fitter='nnls',
                  fit_background=True, poly_order=0):
         """TBD
@@ -1081,40 +1916,9 @@ class MultiBeam():
             self.fit_bg = False
             A = self.A_poly*1
         
+        A_temp = self.compute_template_matrix(z=z, templates=templates)
         NTEMP = len(templates)
-        A_temp = np.zeros((NTEMP, self.Ntot))
-                  
-        #print 'xxx Load templates'
-        for i, key in enumerate(templates.keys()):
-            NTEMP += 1
-            temp = templates[key]#.zscale(z, 1.)
-            spectrum_1d = [temp.wave*(1+z), temp.flux/(1+z)]
-            
-            if z > 4:
-                try:
-                    import eazy.igm
-                    igm = eazy.igm.Inoue14()
-                    igmz = igm.full_IGM(z, spectrum_1d[0])
-                    spectrum_1d[1]*=igmz    
-                    #print('IGM')            
-                except:
-                    # No IGM
-                    pass
-                  
-            i0 = 0            
-            for ib in range(self.N):
-                beam = self.beams[ib]
-                lam_beam = beam.beam.lam_beam
-                if ((temp.wave.min()*(1+z) > lam_beam.max()) | 
-                    (temp.wave.max()*(1+z) < lam_beam.min())):
-                    tmodel = 0.
-                else:
-                    tmodel = beam.compute_model(spectrum_1d=spectrum_1d, 
-                                                in_place=False)
-                
-                A_temp[i, i0:i0+self.Nflat[ib]] = tmodel#.flatten()
-                i0 += self.Nflat[ib]
-                        
+        
         if NTEMP > 0:
             A = np.vstack((A, A_temp))
         
@@ -1155,7 +1959,6 @@ class MultiBeam():
                     y *= np.sqrt(self.ivarf[self.fit_mask])
 
                     coeffs, rnorm = scipy.optimize.nnls(Ax, y+off)
-                    coeffs[:self.N] -= 0.04
                 else:
                     y = self.scif[self.fit_mask]
                     y *= np.sqrt(self.ivarf[self.fit_mask])
@@ -1191,6 +1994,12 @@ class MultiBeam():
             coeffs = clf.coef_
                 
         out_coeffs[ok_temp] = coeffs
+        
+        ### Remove the nnls background offset, after putting the 
+        ### coefficients in place since some backgrounds can be masked
+        if (fitter == 'nnls') & fit_background:
+            out_coeffs[:self.N][ok_temp[:self.N]] -= 0.04
+            
         modelf = np.dot(out_coeffs, A)
         chi2 = np.sum((self.weight*(self.scif - modelf)**2*self.ivarf)[self.fit_mask])
         
@@ -1204,6 +2013,309 @@ class MultiBeam():
         
         return A, out_coeffs, chi2, modelf
     
+    def init_normal_equations(self, fit_background=True, poly_order=0):
+        """Cache the redshift-independent parts of the normal equations
+        
+        The background and polynomial rows of the design matrix don't 
+        depend on the redshift, so their blocks of 
+        :math:`A^T W A` and :math:`A^T W y` are computed here once and 
+        reused by `fit_at_z_normal`.  The cache is reset by 
+        `init_poly_coeffs` and `refresh_contamination` and is recomputed if
+        `fit_mask` changes.  Reset it explicitly with 
+        `self.normal_cache = None` after changing, e.g., `ivarf` or 
+        `weight` by hand.
+        
+        Parameters
+        ----------
+        fit_background, poly_order : bool, int
+            See `fit_at_z`.
+            
+        Returns
+        -------
+        cache : dict
+            Also stored in the `normal_cache` attribute.
+        """
+        self.init_poly_coeffs(poly_order=poly_order)
+        
+        cache = getattr(self, 'normal_cache', None)
+        if cache is not None:
+            if ((cache['fit_background'] == fit_background) & 
+                (cache['poly_order'] == poly_order) &
+                np.array_equal(cache['mask'], self.fit_mask)):
+                return cache
+        
+        if fit_background:
+            A_base = np.vstack((self.A_bg, self.A_poly))
+        else:
+            A_base = self.A_poly*1
+            
+        mask = self.fit_mask
+        ivar = self.ivarf[mask]
+        sivar = np.sqrt(ivar)
+        scif = self.scif[mask]
+        
+        ### Weights for the fit and for the chi-squared
+        wchi = self.weight[mask]*ivar
+        weighted = (self.weight[mask] != 1).sum() > 0
+        
+        ### Right-hand sides for the different fitters, in the form 
+        ### sqrt(ivar)*y, where y is what the fitter sees 
+        off = 0.04
+        rhs = {'lstsq':ivar*scif, 'nnls':ivar*scif}
+        if fit_background:
+            rhs['nnls'] = ivar*(scif+off) + off*sivar
+        
+        Am = A_base[:, mask]
+        AW = Am*ivar
+        
+        cache = {'fit_background':fit_background, 'poly_order':poly_order,
+                 'n_base':A_base.shape[0], 'off':off, 
+                 'ok_base':np.sum(A_base, axis=1) > 0,
+                 'mask':mask.copy(), 'ivar':ivar, 'wchi':wchi, 
+                 'weighted':weighted, 'rhs':rhs, 'Am':Am, 
+                 'AWA':np.dot(AW, Am.T), 
+                 'AWy':OrderedDict([(k, np.dot(Am, rhs[k])) for k in rhs])}
+        
+        if weighted:
+            AW2 = Am*wchi
+            cache['AW2A'] = np.dot(AW2, Am.T)
+            cache['AW2y'] = np.dot(AW2, scif)
+        else:
+            cache['AW2A'] = cache['AWA']
+            cache['AW2y'] = np.dot(AW, scif)
+            
+        cache['yW2y'] = np.sum(wchi*scif**2)
+        
+        self.normal_cache = cache
+        return cache
+    
+    def fit_at_z_normal(self, z=0., templates={}, fitter='nnls',
+                        fit_background=True, poly_order=0, init_coeffs=None):
+        """Fit at a given redshift with the normal equations
+        
+        Same inputs and coefficients as `fit_at_z`, but only the template 
+        rows of :math:`A^T W A` and :math:`A^T W y` are computed for each 
+        redshift and the background and polynomial blocks are taken from 
+        `init_normal_equations`.  The chi-squared is also computed from 
+        the normal equations and the full model isn't computed, so use 
+        `fit_at_z` to get the design matrix and model, e.g., at the best 
+        redshift.
+        
+        The `nnls` fit is solved with `~grizli.utils.nnls_normal`, which 
+        has the same solution as the `nnls` fit to the weighted design 
+        matrix.  It is started from the positive coefficients of 
+        `init_coeffs`, e.g., the output of the previous step of a redshift 
+        grid, if specified.  For fitters other than `lstsq` and `nnls`, the 
+        fit is done with `fit_at_z`.
+        
+        Returns
+        -------
+        A : None
+            Placeholder for the design matrix returned by `fit_at_z`.
+            
+        out_coeffs : `~numpy.ndarray`
+            Fit coefficients.
+        
+        chi2 : float
+            Chi-squared of the fit.
+        
+        modelf : None
+            Placeholder for the model returned by `fit_at_z`.
+        """
+        if fitter not in ['lstsq', 'nnls']:
+            out = self.fit_at_z(z=z, templates=templates, fitter=fitter,
+                                fit_background=fit_background, 
+                                poly_order=poly_order)
+            return None, out[1], out[2], None
+        
+        cache = self.init_normal_equations(fit_background=fit_background, 
+                                           poly_order=poly_order)
+        self.fit_bg = fit_background
+        
+        nb = cache['n_base']
+        NTEMP = len(templates)
+        n = nb + NTEMP
+        
+        ### Template blocks
+        AWA = np.zeros((n, n))
+        AW2A = np.zeros((n, n))
+        AWy = np.zeros(n)
+        AW2y = np.zeros(n)
+        ok_temp = np.zeros(n, dtype=bool)
+        
+        AWA[:nb,:nb] = cache['AWA']
+        AW2A[:nb,:nb] = cache['AW2A']
+        AWy[:nb] = cache['AWy'][fitter]
+        AW2y[:nb] = cache['AW2y']
+        ok_temp[:nb] = cache['ok_base']
+        
+        if NTEMP > 0:
+            A_temp = self.compute_template_matrix(z=z, templates=templates)
+            ok_temp[nb:] = np.sum(A_temp, axis=1) > 0
+            
+            Tm = A_temp[:, cache['mask']]
+            TW = Tm*cache['ivar']
+            AWA[nb:,:nb] = np.dot(TW, cache['Am'].T)
+            AWA[nb:,nb:] = np.dot(TW, Tm.T)
+            AWy[nb:] = np.dot(Tm, cache['rhs'][fitter])
+            
+            if cache['weighted']:
+                TW2 = Tm*cache['wchi']
+                AW2A[nb:,:nb] = np.dot(TW2, cache['Am'].T)
+                AW2A[nb:,nb:] = np.dot(TW2, Tm.T)
+                AW2y[nb:] = np.dot(TW2, self.scif[cache['mask']])
+            else:
+                AW2A[nb:,:nb] = AWA[nb:,:nb]
+                AW2A[nb:,nb:] = AWA[nb:,nb:]
+                AW2y[nb:] = np.dot(TW, self.scif[cache['mask']])
+            
+            AWA[:nb,nb:] = AWA[nb:,:nb].T
+            AW2A[:nb,nb:] = AW2A[nb:,:nb].T
+        
+        ### Rows without any unmasked pixels have zero coefficients, as do
+        ### rows that are negligible at machine precision, e.g., templates 
+        ### that only contribute far in their wings
+        cnorm = np.sqrt(np.diag(AWA))
+        ok_temp &= cnorm > np.finfo(float).eps*cnorm.max()
+        
+        ### Normalize the diagonal for better conditioning.  The scale 
+        ### factors are positive, so the nnls constraints don't change.
+        dscl = cnorm[ok_temp]
+        G = AWA[ok_temp,:][:,ok_temp]/dscl/dscl[:,None]
+        b = AWy[ok_temp]/dscl
+        
+        if fitter == 'lstsq':
+            coeffs = np.linalg.lstsq(G, b, rcond=-1)[0]/dscl
+        else:
+            if init_coeffs is not None:
+                ### Coefficients of the nnls fit, with the background offset
+                passive = np.array(init_coeffs, dtype=float)
+                if len(passive) != n:
+                    msg = 'init_coeffs has {0:d} elements, expected {1:d}'
+                    raise ValueError(msg.format(len(passive), n))
+                    
+                if fit_background:
+                    passive[:self.N][ok_temp[:self.N]] += cache['off']
+                    
+                passive = passive[ok_temp] > 0
+            else:
+                passive = None
+                
+            coeffs, passive = utils.nnls_normal(G, b, passive=passive)
+            coeffs /= dscl
+            
+        out_coeffs = np.zeros(n)
+        out_coeffs[ok_temp] = coeffs
+        
+        ### Remove the nnls background offset of the unmasked backgrounds
+        if (fitter == 'nnls') & fit_background:
+            out_coeffs[:self.N][ok_temp[:self.N]] -= cache['off']
+        
+        chi2 = (cache['yW2y'] - 2*np.dot(out_coeffs, AW2y) + 
+                np.dot(out_coeffs, np.dot(AW2A, out_coeffs)))
+        
+        if fit_background:
+            poly_coeffs = out_coeffs[self.N:self.N+self.n_poly]
+        else:
+            poly_coeffs = out_coeffs[:self.n_poly]
+            
+        self.y_poly = np.dot(poly_coeffs, self.x_poly)
+        
+        return None, out_coeffs, chi2, None
+    
+    def eval_zgrid(self, zgrid, templates={}, fitter='nnls', 
+                   fit_background=True, poly_order=0, normal_equations=False,
+                   cpu_count=0, pool_type='thread'):
+        """Fit on a grid of redshifts in a pool of threads or processes
+        
+        Parameters
+        ----------
+        zgrid : array-like
+            Redshifts.
+        
+        templates, fitter, fit_background, poly_order : 
+            See `fit_at_z`.
+        
+        normal_equations : bool
+            Use `fit_at_z_normal` rather than `fit_at_z`.
+        
+        cpu_count : int
+            Number of threads or processes.  If 0, use 
+            `multiprocessing.cpu_count()`.
+        
+        pool_type : 'thread' or 'process'
+            The threads share the `MultiBeam` object.  The polynomial 
+            arrays and normal equations are initialized before the fits, 
+            which then only read them.  The fits also set the `y_poly` and 
+            `fit_bg` attributes, which nothing reads during the grid, and 
+            these are reset from the fit with the lowest chi-squared when 
+            the grid is done, whatever order the threads finished in.  With
+            'process', the `MultiBeam` object and templates are copied 
+            once to each process.
+            
+        Returns
+        -------
+        chi2 : `~numpy.ndarray`
+            Chi-squared at each redshift.
+        
+        coeffs : `~numpy.ndarray`
+            Fit coefficients at each redshift, shape (len(zgrid), Ncoeffs).
+        
+        The results are returned in the order of `zgrid` and are identical 
+        to fitting the redshifts serially.
+        """
+        from multiprocessing.pool import ThreadPool
+        
+        if cpu_count == 0:
+            cpu_count = mp.cpu_count()
+        
+        fit_kwargs = dict(fitter=fitter, fit_background=fit_background,
+                          poly_order=poly_order)
+        
+        ### Initialize state shared by the workers
+        self.init_poly_coeffs(poly_order=poly_order)
+        if normal_equations:
+            self.init_normal_equations(fit_background=fit_background, 
+                                       poly_order=poly_order)
+        
+        chunksize = int(np.maximum(np.ceil(len(zgrid)/(4.*cpu_count)), 1))
+        
+        if pool_type == 'process':
+            pool = mp.Pool(processes=cpu_count, initializer=_init_fit_worker,
+                           initargs=(self, templates, fit_kwargs,
+                                     normal_equations))
+            
+            func = _fit_worker_at_z
+        else:
+            pool = ThreadPool(processes=cpu_count)
+            
+            if normal_equations:
+                fit_func = self.fit_at_z_normal
+            else:
+                fit_func = self.fit_at_z
+            
+            def func(z):
+                out = fit_func(z=z, templates=templates, **fit_kwargs)
+                return out[1], out[2]
+        
+        try:
+            results = pool.map(func, list(zgrid), chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+        
+        coeffs = np.array([res[0] for res in results])
+        chi2 = np.array([res[1] for res in results])
+        
+        ### Attributes set by the fits, from the best fit of the grid
+        self.fit_bg = fit_background
+        if len(chi2) > 0:
+            i0 = self.N*fit_background
+            poly_coeffs = coeffs[np.argmin(chi2), i0:i0+self.n_poly]
+            self.y_poly = np.dot(poly_coeffs, self.x_poly)
+        
+        return chi2, coeffs
+        
     def parse_fit_outputs(self, z, templates, coeffs_full, A):
         """Parse output from `fit_at_z`.
 
@@ -1442,10 +2554,18 @@ class MultiBeam():
                   verbose=True, make_figure=True, zoom=None,
                   delta_chi2_threshold=0.004, zr=0, dz=0, fwhm=0, 
                   prior=None, templates={}, figsize=[8,5],
-                  fsps_templates=False):
+                  fsps_templates=False, normal_equations=False):
         """TBD
-        """
         
+        If `normal_equations` is True, the individual templates are fit 
+        with `fit_at_z_normal`, each started from the coefficients of the 
+        previous one.
+        """
+        if normal_equations:
+            fit_func = self.fit_at_z_normal
+        else:
+            fit_func = self.fit_at_z
+            
         ## Polynomial fit
         out = self.fit_at_z(z=0., templates={}, fitter='lstsq',
                             poly_order=3,
@@ -1471,13 +2591,17 @@ class MultiBeam():
         chi2min = 1e30
         iz = 0
         best = key
+        warm = {}
         for i, key in enumerate(list(templates)):
             temp_i = {key:templates[key]}
-            out = self.fit_at_z(z=0., templates=temp_i,
+            out = fit_func(z=0., templates=temp_i,
                                 fitter=fitter, poly_order=poly_order,
-                                fit_background=fit_background)
+                                fit_background=fit_background, **warm)
             
             A, coeffs[i,:], chi2[i], model_2d = out
+            if normal_equations:
+                warm['init_coeffs'] = coeffs[i,:]
+                
             if chi2[i] < chi2min:
                 iz = i
                 chi2min = chi2[i]
@@ -1559,11 +2683,34 @@ class MultiBeam():
                      fit_background=True, fitter='nnls', 
                      delta_chi2_threshold=0.004, zoom=True, 
                      line_complexes=True, templates={}, figsize=[8,5],
-                     fsps_templates=False):
+                     fsps_templates=False, normal_equations=False,
+                     cpu_count=1, pool_type='thread', adaptive=False,
+                     max_evals=None):
         """TBD
+        
+        If `normal_equations` is True, the redshift grids are fit with 
+        `fit_at_z_normal` and the full model is only computed at the best 
+        redshift.  In the serial loops, the `nnls` fit at each redshift is 
+        started from the solution at the previous one.
+        
+        If `cpu_count` is not 1, the redshift grids are fit in parallel with
+        `eval_zgrid` with `cpu_count` threads or processes (`pool_type`).
+        
+        If `adaptive` is True, the coarse grid and the zoom around its peaks
+        are replaced by `~grizli.utils.adaptive_zsearch` from step `dz[0]` 
+        down to `dz[1]`, with at most `max_evals` fits.  The statistics of 
+        the search are put in `fit_data['zsearch']`, where 'nbaseline' is 
+        the number of fits of the coarse grid and the zoom around a single 
+        peak, the least that the grid search would need, and 'nsaved' its 
+        difference to the number of fits of the search.
         """
         from scipy import polyfit, polyval
         
+        if normal_equations:
+            fit_func = self.fit_at_z_normal
+        else:
+            fit_func = self.fit_at_z
+        
         if zr is None:
             zr = [0.65, 1.6]
         
@@ -1612,37 +2759,77 @@ class MultiBeam():
         
         chi2min = 1e30
         iz = 0
-        for i in range(NZ):
-            out = self.fit_at_z(z=zgrid[i], templates=templates,
+        adaptive &= (not stars)
+        if adaptive:
+            warm = {}
+            def _fit_z(z):
+                out = fit_func(z=z, templates=templates, fitter=fitter,
+                               poly_order=poly_order, 
+                               fit_background=fit_background, **warm)
+                
+                if normal_equations:
+                    warm['init_coeffs'] = out[1]
+                    
+                return out[2], out[1]
+            
+            out = utils.adaptive_zsearch(_fit_z, zr=zr, dz0=dz[0], 
+                                         dz_min=dz[1], max_evals=max_evals,
+                                         prior=prior, verbose=verbose)
+            
+            zgrid, chi2, results, zsearch = out
+            coeffs = np.array([res[1] for res in results])
+            iz = np.argmin(chi2)
+            
+            zi = zgrid[iz]
+            nzoom = len(np.arange(zi-2*dz[0], zi+2*dz[0]+dz[1]/10., dz[1]))
+            zsearch['nbaseline'] = NZ + nzoom
+            zsearch['nsaved'] = zsearch['nbaseline'] - zsearch['nevals']
+        elif cpu_count != 1:
+            chi2, coeffs = self.eval_zgrid(zgrid, templates=templates,
                                 fitter=fitter, poly_order=poly_order,
-                                fit_background=fit_background)
+                                fit_background=fit_background, 
+                                normal_equations=normal_equations,
+                                cpu_count=cpu_count, pool_type=pool_type)
+            iz = np.argmin(chi2)
+        else:
+            warm = {}
+            for i in range(NZ):
+                out = fit_func(z=zgrid[i], templates=templates,
+                                    fitter=fitter, poly_order=poly_order,
+                                    fit_background=fit_background, **warm)
             
-            A, coeffs[i,:], chi2[i], model_2d = out
-            if chi2[i] < chi2min:
-                iz = i
-                chi2min = chi2[i]
+                A, coeffs[i,:], chi2[i], model_2d = out
+                if normal_equations:
+                    warm['init_coeffs'] = coeffs[i,:]
+                    
+                if chi2[i] < chi2min:
+                    iz = i
+                    chi2min = chi2[i]
 
-            if verbose:                    
-                print(utils.no_newline + '  {0:.4f} {1:9.1f} ({2:.4f})'.format(zgrid[i], chi2[i], zgrid[iz]))
+                if verbose:                    
+                    print(utils.no_newline + '  {0:.4f} {1:9.1f} ({2:.4f})'.format(zgrid[i], chi2[i], zgrid[iz]))
         
         print('First iteration: z_best={0:.4f}\n'.format(zgrid[iz]))
             
-        # peaks
-        import peakutils
-        # chi2nu = (chi2.min()-chi2)/self.DoF
-        # indexes = peakutils.indexes((chi2nu+delta_chi2_threshold)*(chi2nu > -delta_chi2_threshold), thres=0.3, min_dist=20)
+        # peaks, not needed after the adaptive search
+        if adaptive:
+            num_peaks = 0
+        else:
+            import peakutils
+            # chi2nu = (chi2.min()-chi2)/self.DoF
+            # indexes = peakutils.indexes((chi2nu+delta_chi2_threshold)*(chi2nu > -delta_chi2_threshold), thres=0.3, min_dist=20)
         
-        chi2_rev = (chi2_poly - chi2)/self.DoF
-        if chi2_poly < (chi2.min() + 9):
-            chi2_rev = (chi2.min() + 16 - chi2)/self.DoF
+            chi2_rev = (chi2_poly - chi2)/self.DoF
+            if chi2_poly < (chi2.min() + 9):
+                chi2_rev = (chi2.min() + 16 - chi2)/self.DoF
 
-        chi2_rev[chi2_rev < 0] = 0
-        indexes = peakutils.indexes(chi2_rev, thres=0.4, min_dist=8)
-        num_peaks = len(indexes)
+            chi2_rev[chi2_rev < 0] = 0
+            indexes = peakutils.indexes(chi2_rev, thres=0.4, min_dist=8)
+            num_peaks = len(indexes)
         
-        if False:
-            plt.plot(zgrid, (chi2-chi2.min())/ self.DoF)
-            plt.scatter(zgrid[indexes], (chi2-chi2.min())[indexes]/ self.DoF, color='r')
+            if False:
+                plt.plot(zgrid, (chi2-chi2.min())/ self.DoF)
+                plt.scatter(zgrid[indexes], (chi2-chi2.min())[indexes]/ self.DoF, color='r')
         
         # delta_chi2 = (chi2.max()-chi2.min())/self.DoF
         # if delta_chi2 > delta_chi2_threshold:      
@@ -1666,18 +2853,32 @@ class MultiBeam():
 
             iz = 0
             chi2min = 1.e30
-            for i in range(NZOOM):
-                out = self.fit_at_z(z=zgrid_zoom[i], templates=templates,
-                                    fitter=fitter, poly_order=poly_order,
-                                    fit_background=fit_background)
+            if (cpu_count != 1) & (NZOOM > 0):
+                out = self.eval_zgrid(zgrid_zoom, templates=templates,
+                                fitter=fitter, poly_order=poly_order,
+                                fit_background=fit_background, 
+                                normal_equations=normal_equations,
+                                cpu_count=cpu_count, pool_type=pool_type)
+                
+                chi2_zoom, coeffs_zoom = out
+            else:
+                warm = {}
+                for i in range(NZOOM):
+                    out = fit_func(z=zgrid_zoom[i], templates=templates,
+                                        fitter=fitter, poly_order=poly_order,
+                                        fit_background=fit_background, 
+                                        **warm)
 
-                A, coeffs_zoom[i,:], chi2_zoom[i], model_2d = out
-                if chi2_zoom[i] < chi2min:
-                    chi2min = chi2_zoom[i]
-                    iz = i
+                    A, coeffs_zoom[i,:], chi2_zoom[i], model_2d = out
+                    if normal_equations:
+                        warm['init_coeffs'] = coeffs_zoom[i,:]
+                        
+                    if chi2_zoom[i] < chi2min:
+                        chi2min = chi2_zoom[i]
+                        iz = i
                 
-                if verbose:
-                    print(utils.no_newline+'- {0:.4f} {1:9.1f} ({2:.4f}) {3:d}/{4:d}'.format(zgrid_zoom[i], chi2_zoom[i], zgrid_zoom[iz], i+1, NZOOM))
+                    if verbose:
+                        print(utils.no_newline+'- {0:.4f} {1:9.1f} ({2:.4f}) {3:d}/{4:d}'.format(zgrid_zoom[i], chi2_zoom[i], zgrid_zoom[iz], i+1, NZOOM))
         
             zgrid = np.append(zgrid, zgrid_zoom)
             chi2 = np.append(chi2, chi2_zoom)
@@ -1743,6 +2944,9 @@ class MultiBeam():
         fit_data['cont1d'] = cont1d
         fit_data['line1d'] = line1d
         
+        if adaptive:
+            fit_data['zsearch'] = zsearch
+            
         #return fit_data
         
         fig = None   
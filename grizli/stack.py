@@ -420,7 +420,7 @@ class StackFitter(object):
         # print(method, out.nfev, out.x)
         # out = scipy.optimize.minimize(objective_scale, [10.], args=(Ax, dataf*sivarf, fit_mask, sivarf, Nphot, 0), method='COBYLA', jac=None, hess=None, hessp=None, bounds=None, constraints=(), tol=None, callback=None, options=None)
         
-    def fit_at_z(self, z=0, templates=[], fitter='nnls', get_uncertainties=False):
+    def fit_at_z(self, z=0, templates=[], fitter='nnls', get_uncertainties=False, init_coeffs=None):
         """Fit the 2D spectra with a set of templates at a specified redshift.
         
         Parameters
@@ -439,6 +439,11 @@ class StackFitter(object):
         get_uncertainties : bool
             Compute coefficient uncertainties from the covariance matrix
         
+        init_coeffs : None or `~np.ndarray`
+            Template coefficients, e.g., `coeffs` from a previous fit.  If 
+            specified, the 'nnls' fit is computed from the normal equations
+            with `~grizli.utils.nnls_normal`, starting from the positive
+            coefficients of `init_coeffs` and of the background.
         
         Returns
         -------
@@ -456,6 +461,7 @@ class StackFitter(object):
         
         """
         import scipy.optimize
+        import grizli
         
         NTEMP = len(templates)
         A = np.zeros((self.Next+NTEMP, self.Ndata))
@@ -464,15 +470,9 @@ class StackFitter(object):
                 
         for i, t in enumerate(templates):
             ti = templates[t]
-            try:
-                import eazy.igm
-                if z > 7:
-                    igm = eazy.igm.Inoue14()
-                    igmz = igm.full_IGM(z, ti.wave*(1+z))         
-                else:
-                    igmz = 1.
-                    
-            except:
+            if z > 7:
+                igmz = grizli.utils.get_igm_transmission(z, ti.wave)
+            else:
                 igmz = 1.
 
             
@@ -495,7 +495,14 @@ class StackFitter(object):
         AxT = Ax[:,self.fit_mask].T
         data = ((self.scif+pedestal)*self.sivarf)[self.fit_mask]
         
-        if fitter == 'nnls':
+        if (fitter == 'nnls') & (init_coeffs is not None):
+            passive = np.hstack([np.ones(self.Next, dtype=bool), 
+                                 np.array(init_coeffs) > 0])
+            
+            coeffs, passive = grizli.utils.nnls_normal(np.dot(AxT.T, AxT),
+                                                       np.dot(AxT.T, data),
+                                                       passive=passive[oktemp])
+        elif fitter == 'nnls':
             coeffs, rnorm = scipy.optimize.nnls(AxT, data)            
         else:
             coeffs, residuals, rank, s = np.linalg.lstsq(AxT, data)
@@ -525,7 +532,7 @@ class StackFitter(object):
         
         return chi2, background, full, full_coeffs, full_coeffs_err
     
-    def fit_zgrid(self, dz0=0.005, zr=[0.4, 3.4], fitter='nnls', make_plot=True, save_data=True, prior=None, templates_file='templates.npy', verbose=True, outlier_threshold=1e30, eazyp=None, ix=0, order=0, scale_fit=None):
+    def fit_zgrid(self, dz0=0.005, zr=[0.4, 3.4], fitter='nnls', make_plot=True, save_data=True, prior=None, templates_file='templates.npy', verbose=True, outlier_threshold=1e30, eazyp=None, ix=0, order=0, scale_fit=None, warm_start=True, adaptive=False, max_evals=None):
         """Fit templates on a redshift grid.
         
         Parameters
@@ -558,6 +565,21 @@ class StackFitter(object):
         verbose : bool
             Print the redshift grid steps.
         
+        warm_start : bool
+            Start the 'nnls' template fits at each redshift step from the 
+            coefficients of the previous step (see `fit_at_z`).
+        
+        adaptive : bool
+            Replace the coarse grid and the zoom iterations with 
+            `~grizli.utils.adaptive_zsearch`, with the same final precision
+            and at most `max_evals` fits.  The search starts from a grid 
+            with step `2*dz0`, which it refines where needed, so that it 
+            usually needs fewer fits than the coarse grid and zoom.  The 
+            number of fits is stored in the 'NEVALS' keyword of the output 
+            table and the difference to the number of fits of the coarse 
+            grid and zoom around the same redshift in 'NSAVED', which can 
+            be negative.
+            
         Returns
         -------
         hdu : `~astropy.io.fits.HDUList`
@@ -572,53 +594,97 @@ class StackFitter(object):
         
         t_complex, t_i = np.load(templates_file)
         
-        z = grizli.utils.log_zgrid(zr=zr, dz=dz0)
-        chi2 = z*0.
-        for i in range(len(z)):
-            if eazyp:
-                out = self.fit_combined_at_z(z=z[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
-                chi2[i], bg, full, coeffs, err, scale_fit = out            
-            else:
-                out = self.fit_at_z(z=z[i], templates=t_complex)
-                chi2[i], bg, full, coeffs, err = out
-            
-            if verbose:
-                print('{0:.4f} - {1:10.1f}'.format(z[i], chi2[i]))
+        if warm_start:
+            coeffs = np.zeros(len(t_complex))
+        else:
+            coeffs = None
         
-        # Zoom in on the chi-sq minimum.
-        ci = chi2
-        zi = z
-        for iter in range(1,7):
-            if prior is not None:
-                pz = np.interp(zi, prior[0], prior[1])
-                cp = ci+pz
-            else:
-                cp = ci
+        if adaptive:
+            state = {'coeffs':coeffs, 'scale_fit':scale_fit}
+            def _fit_z(zi):
+                if eazyp:
+                    out = self.fit_combined_at_z(z=zi, eazyp=eazyp, ix=ix, order=order, scale_fit=state['scale_fit'])
+                    state['scale_fit'] = out[-1]
+                else:
+                    out = self.fit_at_z(z=zi, templates=t_complex, fitter=fitter, init_coeffs=state['coeffs'])
+                    if warm_start:
+                        state['coeffs'] = out[3]
                 
-            iz = np.argmin(cp)
-            z0 = zi[iz]
-            dz = dz0/2.02**iter
-            zi = grizli.utils.log_zgrid(zr=[z0-dz*4, z0+dz*4], dz=dz)
-            ci = zi*0.
-            for i in range(len(zi)):
+                if verbose:
+                    print('{0:.4f} - {1:10.1f}'.format(zi, out[0]))
                 
+                return out
+                
+            out = grizli.utils.adaptive_zsearch(_fit_z, zr=zr, dz0=2*dz0, dz_min=dz0/2.02**6, max_evals=max_evals, prior=prior, verbose=verbose)
+            z, chi2, results, zsearch = out
+            
+            ### Fits of the coarse grid and zoom below, at the same minimum
+            if prior is not None:
+                z0 = z[np.argmin(chi2+np.interp(z, prior[0], prior[1]))]
+            else:
+                z0 = z[np.argmin(chi2)]
+            
+            nbaseline = len(grizli.utils.log_zgrid(zr=zr, dz=dz0))
+            for iter in range(1,7):
+                dz = dz0/2.02**iter
+                zi = grizli.utils.log_zgrid(zr=[z0-dz*4, z0+dz*4], dz=dz)
+                nbaseline += len(zi)
+            
+            zsearch['nbaseline'] = nbaseline
+            zsearch['nsaved'] = nbaseline - zsearch['nevals']
+        else:
+            z = grizli.utils.log_zgrid(zr=zr, dz=dz0)
+            chi2 = z*0.
+            
+            for i in range(len(z)):
                 if eazyp:
-                    out = self.fit_combined_at_z(z=zi[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
-                    ci[i], bg, full, coeffs, err, scale_fit = out            
+                    out = self.fit_combined_at_z(z=z[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
+                    chi2[i], bg, full, coeffs, err, scale_fit = out            
                 else:
-                    out = self.fit_at_z(z=zi[i], templates=t_complex, fitter=fitter)
-                    ci[i], bg, full, coeffs, err = out
+                    out = self.fit_at_z(z=z[i], templates=t_complex, init_coeffs=coeffs)
+                    chi2[i], bg, full, coeffs, err = out
+                    if not warm_start:
+                        coeffs = None
+            
+                if verbose:
+                    print('{0:.4f} - {1:10.1f}'.format(z[i], chi2[i]))
+        
+            # Zoom in on the chi-sq minimum.
+            ci = chi2
+            zi = z
+            for iter in range(1,7):
+                if prior is not None:
+                    pz = np.interp(zi, prior[0], prior[1])
+                    cp = ci+pz
+                else:
+                    cp = ci
                 
-                # out = self.fit_at_z(z=zi[i], templates=t_complex,
-                #                     fitter=fitter)
-                # 
-                # ci[i], bg, full, coeffs, err = out
+                iz = np.argmin(cp)
+                z0 = zi[iz]
+                dz = dz0/2.02**iter
+                zi = grizli.utils.log_zgrid(zr=[z0-dz*4, z0+dz*4], dz=dz)
+                ci = zi*0.
+                for i in range(len(zi)):
                 
-                if verbose:
-                    print('{0:.4f} - {1:10.1f}'.format(zi[i], ci[i]))
+                    if eazyp:
+                        out = self.fit_combined_at_z(z=zi[i], eazyp=eazyp, ix=ix, order=order, scale_fit=scale_fit)
+                        ci[i], bg, full, coeffs, err, scale_fit = out            
+                    else:
+                        out = self.fit_at_z(z=zi[i], templates=t_complex, fitter=fitter, init_coeffs=coeffs)
+                        ci[i], bg, full, coeffs, err = out
+                        if not warm_start:
+                            coeffs = None
+                
+                    # out = self.fit_at_z(z=zi[i], templates=t_complex,
+                    #                     fitter=fitter)
+                    # 
+                    # ci[i], bg, full, coeffs, err = out
+                
+                    if verbose:
+                        print('{0:.4f} - {1:10.1f}'.format(zi[i], ci[i]))
             
-            z = np.append(z, zi)
-            chi2 = np.append(chi2, ci)
+                z = np.append(z, zi)
+                chi2 = np.append(chi2, ci)
         
         so = np.argsort(z)
         z = z[so]
@@ -674,6 +740,11 @@ class StackFitter(object):
         t.meta['FITTER'] = (fitter, 'Minimization algorithm')
         t.meta['HASPRIOR'] = (prior is not None, 'Was prior specified?')
         
+        if adaptive:
+            t.meta['NEVALS'] = (zsearch['nevals'], 'Number of redshift fits')
+            t.meta['NSAVED'] = (zsearch['nsaved'], 
+                                'Fits saved wrt. coarse grid and zoom')
+        
         # Best-fit templates
         tc, tl = self.generate_1D_templates(coeffs,
                                             templates_file=templates_file)
@@ -1002,8 +1073,7 @@ class StackedSpectrum(object):
         # Configuration file
         self.is_flambda = self.header['ISFLAM']
         self.conf_file = self.header['CONF']
-        self.conf = grizli.grismconf.aXeConf(self.conf_file)
-        self.conf.get_beams()
+        self.conf = grizli.grismconf.load_grism_config(self.conf_file)
         
         self.sci = self.hdulist['SCI',extver].data*1.
         self.ivar0 = self.hdulist['WHT',extver].data*1
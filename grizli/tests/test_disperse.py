@@ -0,0 +1,181 @@
+"""
+Tests of the compiled dispersion kernels in `grizli.utils_c.disperse`
+"""
+import numpy as np
+
+from grizli.utils_c import disperse
+
+def _fake_object(seed=1):
+    """
+    Direct image, segmentation and trace arrays for a single object
+    """
+    rnd = np.random.RandomState(seed)
+    
+    shd = np.array([64, 64], dtype=np.int64)
+    flam = np.zeros(shd, dtype=np.float32)
+    segm = np.zeros(shd, dtype=np.float32)
+    
+    yp, xp = np.indices(shd)
+    R = np.sqrt((xp-30)**2+(yp-32)**2)
+    segm[R < 6] = 12
+    segm[(R >= 6) & (R < 8)] = 3
+    flam[R < 8] = (rnd.rand((R < 8).sum())*1.e-17).astype(np.float32)
+    
+    shg = np.array([40, 120], dtype=np.int64)
+    sh_thumb = np.array([10, 10], dtype=np.int64)
+    x0 = np.array([32, 30], dtype=np.int64)
+    
+    ### Trace: one pixel per column, with a slight tilt
+    nk = 80
+    xarr = np.arange(nk)+20
+    ytrace = 0.05*np.arange(nk)
+    yint = np.floor(ytrace).astype(np.int64)
+    yfrac = ytrace-yint
+    idxl = (shg[0]//2+yint)*shg[1]+xarr
+    
+    ysens = rnd.rand(3, nk)
+    
+    return dict(flam=flam, segm=segm, seg_id=12, idxl=idxl, yfrac=yfrac,
+                ysens=ysens, x0=x0, shd=shd, sh_thumb=sh_thumb, shg=shg)
+
+def test_disperse_multi():
+    """
+    Batched kernel is the same as looping over the single-template kernel
+    """
+    obj = _fake_object()
+    npix = obj['shg'].prod()
+    nt = obj['ysens'].shape[0]
+    
+    for dtype in [np.float64, np.float32]:
+        single = np.zeros((nt, npix), dtype=dtype)
+        for i in range(nt):
+            disperse.disperse_grism_object(obj['flam'], obj['segm'], 
+                               obj['seg_id'], obj['idxl'], obj['yfrac'],
+                               obj['ysens'][i,:], single[i,:], obj['x0'],
+                               obj['shd'], obj['sh_thumb'], obj['shg'])
+        
+        multi = np.zeros((nt, npix), dtype=dtype)
+        disperse.disperse_grism_object_multi(obj['flam'], obj['segm'], 
+                               obj['seg_id'], obj['idxl'], obj['yfrac'],
+                               obj['ysens'], multi, obj['x0'],
+                               obj['shd'], obj['sh_thumb'], obj['shg'])
+        
+        assert single.sum() > 0
+        assert np.allclose(single, multi, rtol=1.e-6, atol=0)
+
+def test_disperse_threads():
+    """
+    OpenMP threads give the same model as the single-threaded loop
+    """
+    obj = _fake_object()
+    npix = obj['shg'].prod()
+    
+    models = {}
+    for num_threads in [1, 4]:
+        full = np.zeros(npix)
+        disperse.disperse_grism_object(obj['flam'], obj['segm'], 
+                               obj['seg_id'], obj['idxl'], obj['yfrac'],
+                               obj['ysens'][0,:], full, obj['x0'],
+                               obj['shd'], obj['sh_thumb'], obj['shg'],
+                               num_threads=num_threads)
+        models[num_threads] = full
+    
+    assert models[1].sum() > 0
+    assert np.allclose(models[1], models[4], rtol=1.e-12, atol=0)
+    
+def test_segmentation_limits_threads():
+    """
+    Segmentation limits with and without OpenMP threads
+    """
+    obj = _fake_object()
+    res1 = disperse.compute_segmentation_limits(obj['segm'], obj['seg_id'],
+                                        obj['flam'], obj['shd'], 
+                                        num_threads=1)
+    
+    res4 = disperse.compute_segmentation_limits(obj['segm'], obj['seg_id'],
+                                        obj['flam'], obj['shd'], 
+                                        num_threads=4)
+    
+    assert res1[6] == (obj['segm'] == obj['seg_id']).sum()
+    assert np.allclose(res1, res4, rtol=1.e-12)
+
+def _pixel_list(obj):
+    """
+    Pixel list of the thumbnail, as in `GrismDisperser.get_pixel_list`
+    """
+    x0, sh_thumb = obj['x0'], obj['sh_thumb']
+    thumb = obj['flam'][x0[0]-sh_thumb[0]:x0[0]+sh_thumb[0], 
+                        x0[1]-sh_thumb[1]:x0[1]+sh_thumb[1]]
+    seg = obj['segm'][x0[0]-sh_thumb[0]:x0[0]+sh_thumb[0], 
+                      x0[1]-sh_thumb[1]:x0[1]+sh_thumb[1]]
+    
+    valid = (seg == obj['seg_id']) & (thumb != 0)
+    xpix, ypix = np.nonzero(valid.T)
+    flux = thumb[ypix, xpix].astype(np.double)/1.e-17
+    jpix = (ypix - sh_thumb[0]).astype(np.int64)
+    ipix = (xpix - sh_thumb[1]).astype(np.int64)
+    return jpix, ipix, flux
+    
+def test_disperse_pixel_list():
+    """
+    Pixel-list kernels give the same models as the thumbnail loops
+    """
+    obj = _fake_object()
+    npix = obj['shg'].prod()
+    nt = obj['ysens'].shape[0]
+    jpix, ipix, flux = _pixel_list(obj)
+    
+    full = np.zeros((nt, npix))
+    for i in range(nt):
+        disperse.disperse_grism_object(obj['flam'], obj['segm'], 
+                               obj['seg_id'], obj['idxl'], obj['yfrac'],
+                               obj['ysens'][i,:], full[i,:], obj['x0'],
+                               obj['shd'], obj['sh_thumb'], obj['shg'])
+    
+    ### Same pixel order, so identical with one thread
+    plist = np.zeros(npix)
+    disperse.disperse_pixel_list(jpix, ipix, flux, obj['idxl'], 
+                                 obj['yfrac'], obj['ysens'][0,:], plist, 
+                                 obj['shg'])
+    
+    assert full[0,:].sum() > 0
+    assert np.all(plist == full[0,:])
+    
+    plist = np.zeros(npix)
+    disperse.disperse_pixel_list(jpix, ipix, flux, obj['idxl'], 
+                                 obj['yfrac'], obj['ysens'][0,:], plist, 
+                                 obj['shg'], num_threads=3)
+    
+    assert np.allclose(plist, full[0,:], rtol=1.e-12, atol=0)
+    
+    multi = np.zeros((nt, npix))
+    disperse.disperse_pixel_list_multi(jpix, ipix, flux, obj['idxl'], 
+                                       obj['yfrac'], obj['ysens'], multi, 
+                                       obj['shg'])
+    
+    assert np.allclose(multi, full, rtol=1.e-12, atol=0)
+
+def test_segmentation_table():
+    """
+    One-pass segmentation table matches `compute_segmentation_limits`
+    """
+    obj = _fake_object()
+    ids = np.unique(obj['segm'])
+    
+    ilim, jlim, numer, area, denom = \
+         disperse.compute_segmentation_table(obj['segm'], obj['flam'], ids)
+    
+    assert area.sum() == obj['segm'].size
+    
+    for ix, seg_id in enumerate(ids):
+        if seg_id == 0:
+            continue
+            
+        res = disperse.compute_segmentation_limits(obj['segm'], int(seg_id),
+                                                   obj['flam'], obj['shd'])
+        
+        tab = (ilim[ix,0], ilim[ix,1], numer[ix,0]/denom[ix], 
+               jlim[ix,0], jlim[ix,1], numer[ix,1]/denom[ix], 
+               area[ix], denom[ix])
+        
+        assert np.allclose(tab, res, rtol=1.e-12)
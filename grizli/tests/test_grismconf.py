@@ -0,0 +1,237 @@
+"""
+Tests of `grizli.grismconf`
+"""
+import os
+import pickle
+
+import numpy as np
+
+from grizli import grismconf
+from grizli.tests.test_model import make_conf
+
+def test_trace_cache(tmpdir):
+    """
+    `get_beam_trace_sensitivity` caches traces with LRU eviction and byte
+    accounting, and returns copies of the cached arrays
+    """
+    conf = make_conf(tmpdir)
+    dx = np.arange(-10, 150)
+
+    dy, lam, sens = conf.get_beam_trace_sensitivity(x=100, y=100, dx=dx)
+    dy0, lam0 = conf.get_beam_trace(x=100, y=100, dx=dx)
+    assert np.allclose(dy, dy0)
+    assert np.allclose(lam, lam0)
+    assert (sens > 0).all()
+
+    info = conf.trace_cache_info()
+    assert (info['hits'], info['misses'], info['entries']) == (0, 1, 1)
+    nbytes = dy.nbytes + lam.nbytes + sens.nbytes + dx.nbytes
+    assert info['nbytes'] == nbytes
+
+    ### Hit, also for positions within the quantum
+    out = conf.get_beam_trace_sensitivity(x=100+1.e-8, y=100, dx=dx*1)
+    assert conf.trace_cache_info()['hits'] == 1
+    for a, b in zip(out, (dy, lam, sens)):
+        assert np.all(a == b)
+
+    ### Returned arrays are copies
+    out[0] += 10
+    out[2][:] = 0
+    out = conf.get_beam_trace_sensitivity(x=100, y=100, dx=dx)
+    assert np.all(out[0] == dy)
+    assert np.all(out[2] == sens)
+
+    ### Different positions and dx grids miss
+    conf.get_beam_trace_sensitivity(x=101, y=100, dx=dx)
+    conf.get_beam_trace_sensitivity(x=100, y=100, dx=dx[:-1])
+    conf.get_beam_trace_sensitivity(x=100, y=100, dx=dx.astype(float))
+    info = conf.trace_cache_info()
+    assert (info['hits'], info['misses'], info['entries']) == (2, 4, 4)
+    assert info['evictions'] == 0
+
+    ### Eviction of the least-recently used entries
+    conf.init_trace_cache(max_bytes=int(2.5*nbytes))
+    for x in [100, 101, 100, 102]:
+        conf.get_beam_trace_sensitivity(x=x, y=100, dx=dx)
+
+    info = conf.trace_cache_info()
+    assert (info['hits'], info['misses'], info['evictions']) == (1, 3, 1)
+    assert info['entries'] == 2
+    assert info['nbytes'] == 2*nbytes <= info['max_bytes']
+    assert [key[0] for key in conf.trace_cache] == [100*10**6, 102*10**6]
+
+    ### Larger than the limit, not cached
+    out = conf.get_beam_trace_sensitivity(x=100, y=100,
+                                          dx=np.arange(-10, 1000))
+    assert len(out[0]) == 1010
+    info = conf.trace_cache_info()
+    assert (info['misses'], info['entries']) == (4, 2)
+
+    ### Pickled without the cache, but with its settings
+    conf.init_trace_cache(max_bytes=1000, quantum=1.e-3)
+    conf.get_beam_trace_sensitivity(x=100, y=100, dx=dx[:10])
+    conf2 = pickle.loads(pickle.dumps(conf))
+    info = conf2.trace_cache_info()
+    assert (info['misses'], info['entries'], info['nbytes']) == (0, 0, 0)
+    assert info['max_bytes'] == 1000
+    assert conf2.trace_cache_quantum == 1.e-3
+
+    out = conf2.get_beam_trace_sensitivity(x=100, y=100, dx=dx[:10])
+    assert np.all(out[1] == lam[:10])
+    assert conf2.trace_cache_info()['entries'] == 1
+    assert conf.trace_cache_info()['entries'] == 1
+
+CONF_ORDERS = """
+BEAMA -10 150
+MMAG_EXTRACT_A 30
+XOFF_A 0.0
+YOFF_A 0.0
+DYDX_A_0 0.5 1.e-3 -2.e-3
+DYDX_A_1 0.01 1.e-5 2.e-5
+DLDP_A_0 10000. 0.1 0.2
+DLDP_A_1 46.5 1.e-3 -1.e-3
+SENSITIVITY_A test_sens_A.fits
+BEAMB -20 60
+MMAG_EXTRACT_B 30
+XOFF_B 0.5 1.e-3 0.
+YOFF_B -1.0
+DYDX_B_0 1.5 -1.e-3 2.e-3
+DYDX_B_1 0.02 1.e-5 2.e-5
+DYDX_B_2 1.e-4 1.e-7 -1.e-7
+DLDP_B_0 -2000.
+DLDP_B_1 90. 1.e-3 1.e-3
+DLDP_B_2 0.01
+SENSITIVITY_B test_sens_A.fits
+BEAMC 10 80
+MMAG_EXTRACT_C 30
+XOFF_C 0.0
+YOFF_C 0.0
+DYDX_C_0 -0.5
+DYDX_C_1 0.03 1.e-5 2.e-5
+DYDX_C_2 -2.e-4
+DYDX_C_3 1.e-6
+DLDP_C_0 8000.
+DLDP_C_1 23.
+SENSITIVITY_C test_sens_A.fits
+"""
+
+def test_beam_traces(tmpdir):
+    """
+    Vectorized `get_beam_traces` is the same as `get_beam_trace` for each 
+    source, for linear, quadratic and cubic traces
+    """
+    make_conf(tmpdir)
+    conf_file = str(tmpdir.join('orders.conf'))
+    with open(conf_file, 'w') as fp:
+        fp.write(CONF_ORDERS)
+    
+    conf = grismconf.aXeConf(conf_file)
+    conf.get_beams()
+    assert [conf.orders[beam] for beam in 'ABC'] == [1, 2, 3]
+    
+    rnd = np.random.RandomState(1)
+    x, y = rnd.uniform(0, 1014, size=(2, 12))
+    for beam in 'ABC':
+        dx = conf.dxlam[beam]
+        dx2d = dx[None,:] + rnd.normal(size=(12, 1))
+        for dxi in [dx, dx2d]:
+            dy, lam = conf.get_beam_traces(x=x, y=y, dx=dxi, beam=beam)
+            assert dy.shape == lam.shape == (12, len(dx))
+            
+            for i in range(12):
+                dxj = dxi if dxi.ndim == 1 else dxi[i,:]
+                dy0, lam0 = conf.get_beam_trace(x=x[i], y=y[i], dx=dxj, 
+                                                beam=beam)
+                assert np.allclose(dy[i,:], dy0, rtol=1.e-10, atol=1.e-10)
+                assert np.allclose(lam[i,:], lam0, rtol=1.e-10, atol=1.e-8)
+    
+    ### Single source
+    dy, lam = conf.get_beam_traces(x=100., y=200., dx=dx, beam='C')
+    dy0, lam0 = conf.get_beam_trace(x=100., y=200., dx=dx, beam='C')
+    assert dy.shape == (1, len(dx))
+    assert np.allclose(dy[0], dy0) & np.allclose(lam[0], lam0)
+    
+def touch(file, dt=10):
+    """
+    Move the modification time of `file` forward by `dt` seconds
+    """
+    mtime = os.path.getmtime(file)
+    os.utime(file, (mtime+dt, mtime+dt))
+
+def test_conf_registry(tmpdir):
+    """
+    `load_grism_config` reuses configurations from the registry until the 
+    configuration or sensitivity files are modified
+    """
+    make_conf(tmpdir)
+    conf_file = str(tmpdir.join('test.conf'))
+    sens_file = str(tmpdir.join('test_sens_A.fits'))
+    
+    conf = grismconf.load_grism_config(conf_file)
+    assert conf.beams == ['A']
+    assert grismconf.load_grism_config(conf_file) is conf
+    assert grismconf.load_grism_config(conf_file, use_registry=False) is not conf
+    
+    ### Nothing written by default
+    assert not os.path.exists(grismconf.get_conf_cache_filename(conf_file))
+    
+    for file in [conf_file, sens_file]:
+        touch(file)
+        conf2 = grismconf.load_grism_config(conf_file)
+        assert conf2 is not conf
+        assert grismconf.load_grism_config(conf_file) is conf2
+        conf = conf2
+
+def test_conf_cache(tmpdir):
+    """
+    The binary cache of `load_grism_config` has the same parameters and 
+    sensitivity curves as the configuration files and is rebuilt when they
+    are modified
+    """
+    ref = make_conf(tmpdir)
+    conf_file = str(tmpdir.join('test.conf'))
+    sens_file = str(tmpdir.join('test_sens_A.fits'))
+    cache_file = grismconf.get_conf_cache_filename(conf_file)
+    
+    kwargs = dict(use_registry=False, write_cache=True)
+    grismconf.load_grism_config(conf_file, **kwargs)
+    assert os.path.exists(cache_file)
+    
+    conf = grismconf.read_conf_cache(conf_file)
+    assert list(conf.conf.keys()) == list(ref.conf.keys())
+    for key in ref.conf:
+        assert np.all(conf.conf[key] == ref.conf[key])
+        assert type(conf.conf[key]) == type(ref.conf[key])
+        
+    for col in ref.sens['A'].colnames:
+        assert np.all(conf.sens['A'][col] == ref.sens['A'][col])
+    
+    assert conf.beams == ref.beams
+    for attr in ['dxlam', 'nx']:
+        assert np.all(getattr(conf, attr)['A'] == getattr(ref, attr)['A'])
+    
+    dy, lam = conf.get_beam_trace(x=100, y=100, dx=np.arange(10))
+    dy0, lam0 = ref.get_beam_trace(x=100, y=100, dx=np.arange(10))
+    assert np.all(dy == dy0) & np.all(lam == lam0)
+        
+    ### Invalidated and rebuilt when the files are modified
+    files = [conf_file, sens_file]
+    for file in files:
+        touch(file)
+        assert grismconf.read_conf_cache(conf_file) is None
+        
+        grismconf.load_grism_config(conf_file, **kwargs)
+        mtimes = np.load(cache_file)['mtimes']
+        assert np.all(mtimes == grismconf.get_file_mtimes(files))
+        assert grismconf.read_conf_cache(conf_file) is not None
+    
+    ### Read from the cache without opening the sensitivity files
+    os.remove(sens_file)
+    with open(sens_file, 'w') as fp:
+        fp.write('not a FITS file')
+    
+    os.utime(sens_file, (mtimes[1], mtimes[1]))
+    
+    conf = grismconf.load_grism_config(conf_file, use_registry=False)
+    assert np.all(conf.sens['A']['SENSITIVITY'] == 
+                  ref.sens['A']['SENSITIVITY'])
@@ -0,0 +1,427 @@
+"""
+Tests of `grizli.model` with a simple synthetic grism configuration
+"""
+import numpy as np
+
+from astropy.table import Table
+
+from grizli import grismconf, model
+
+CONF_LINES = """
+BEAMA -10 150
+MMAG_EXTRACT_A 30
+XOFF_A 0.0
+YOFF_A 0.0
+DYDX_A_0 0.5
+DYDX_A_1 0.01
+DLDP_A_0 10000.
+DLDP_A_1 46.5
+SENSITIVITY_A test_sens_A.fits
+"""
+
+def make_conf(path):
+    """
+    Write a single-beam configuration file and sensitivity curve to `path`
+    and read it into an `~grizli.grismconf.aXeConf` object.
+    """
+    wave = np.arange(9000, 19000, 10.)
+    sens = np.exp(-(wave-14000)**2/2/2000**2)*1.e18
+    Table([wave, sens], names=['WAVELENGTH', 'SENSITIVITY']).write(
+                          str(path.join('test_sens_A.fits')), format='fits',
+                          overwrite=True)
+    
+    conf_file = str(path.join('test.conf'))
+    with open(conf_file, 'w') as fp:
+        fp.write(CONF_LINES)
+    
+    conf = grismconf.aXeConf(conf_file)
+    conf.get_beams()
+    return conf
+    
+def make_object(id, sh=(21, 21), seed=1):
+    """
+    Direct image thumbnail and segmentation of a compact object
+    """
+    rnd = np.random.RandomState(seed)
+    yp, xp = np.indices(sh)
+    R = np.sqrt((xp-sh[1]//2)**2+(yp-sh[0]//2)**2)
+    direct = np.exp(-R**2/2/2.**2)*(1+0.1*rnd.rand(*sh))*1.e-18
+    seg = (R < 6)*id
+    return direct.astype(np.float32), seg.astype(np.float32)
+    
+def make_flt(tmpdir):
+    """
+    Minimal `~grizli.model.GrismFLT` with three objects, two of which 
+    overlap, and the synthetic configuration of `make_conf`
+    """
+    from collections import OrderedDict
+    
+    sh = (200, 400)
+    direct = np.zeros(sh, dtype=np.float32)
+    seg = np.zeros(sh, dtype=np.float32)
+    yp, xp = np.indices(sh)
+    for i, (xc, yc) in enumerate([(60, 50), (80, 56), (250, 150)]):
+        R = np.sqrt((xp-xc)**2+(yp-yc)**2)
+        direct += (np.exp(-R**2/2/2.**2)*1.e-18).astype(np.float32)
+        seg[R < 6] = i+1
+        
+    flt = model.GrismFLT.__new__(model.GrismFLT)
+    flt.direct = model.ImageData(sci=direct, filter='F140W')
+    flt.grism = model.ImageData(sci=np.zeros(sh, dtype=np.float32), 
+                                filter='G141')
+    flt.grism_file = 'test_flt.fits'
+    flt.seg = seg
+    flt.model = np.zeros(sh, dtype=np.float32)
+    flt.model_dtype = None
+    flt.conf = make_conf(tmpdir)
+    flt.pad = 0
+    flt.object_dispersers = OrderedDict()
+    flt.catalog = flt.catalog_index = None
+    flt.seg_table = None
+    flt.model_store = None
+    flt.footprint_index = None
+    flt.model_version = 0
+    flt.model_changes = []
+    flt.shared_arrays = flt.shared_path = flt.shared_finalizer = None
+    return flt
+    
+def test_model_store_get_beams(tmpdir):
+    """
+    `get_beams` returns the current models of objects in the sparse store
+    """
+    flt = make_flt(tmpdir)
+    flt.compute_full_model(ids=[1, 2, 3], mags=[20, 20, 20], store=False)
+    flt.init_model_store()
+    
+    wave = np.arange(9000, 19000, 20.)
+    spec = [wave, 1+(wave-9000)/1.e4]
+    flt.compute_model_orders(id=1, compute_size=True, spectrum_1d=spec, 
+                             store=False)
+    assert 1 in flt.model_store
+    
+    full = flt.model*1
+    beams = flt.compute_model_orders(id=1, compute_size=True, 
+                                     get_beams=['A'])
+    
+    ### Model not changed
+    assert np.all(flt.model == full)
+    
+    ### Same as the stored model of the object
+    beam = beams['A']
+    assert beam.model.sum() > 0
+    
+    stored = flt.model_store.get_dense_model(ids=[1], dtype=np.float64)
+    test = np.zeros(full.shape)
+    beam.add_to_full_image(beam.model, test)
+    assert np.allclose(test, stored, rtol=1.e-5, atol=1.e-6*stored.max())
+    
+def test_float32_model(tmpdir):
+    """
+    Single-precision full-frame models agree with double precision
+    """
+    conf = make_conf(tmpdir)
+    
+    full = {}
+    for dtype in [np.float64, np.float32]:
+        full[dtype] = np.zeros((200, 400), dtype=dtype)
+        for i, origin in enumerate([[40, 50], [45, 120], [120, 60]]):
+            direct, seg = make_object(i+1, seed=i)
+            beam = model.GrismDisperser(id=i+1, direct=direct, 
+                                        segmentation=seg, origin=origin,
+                                        conf=conf, beam='A', 
+                                        model_dtype=dtype)
+            
+            wave = np.arange(9000, 19000, 20.)
+            flux = 1+(wave-9000)/1.e4*(i+1)
+            beam.compute_model(spectrum_1d=[wave, flux])
+            
+            assert beam.model.dtype == dtype
+            beam.add_to_full_image(beam.model, full[dtype])
+    
+    ref = full[np.float64]
+    assert ref.max() > 0
+    assert np.allclose(full[np.float32], ref, rtol=1.e-5, 
+                       atol=1.e-6*ref.max())
+
+def test_shared_array_cleanup(tmpdir):
+    """
+    Scratch files of `GrismFLT.share_arrays` are removed with the object
+    """
+    import gc
+    import os
+    import pickle
+    
+    flt = model.GrismFLT.__new__(model.GrismFLT)
+    flt.direct = flt.grism = None
+    flt.grism_file = 'test_flt.fits'
+    flt.seg = np.ones((10, 10), dtype=np.float32)
+    flt.model = np.zeros((10, 10), dtype=np.float32)
+    
+    flt.share_arrays(scratch_dir=str(tmpdir))
+    path = flt.shared_path
+    assert os.path.exists(os.path.join(path, 'model.npy'))
+    
+    ### Unpickled copies don't remove the files
+    copy = pickle.loads(pickle.dumps(flt))
+    assert copy.shared_finalizer is None
+    copy.model += 1
+    del copy
+    gc.collect()
+    assert np.all(flt.model == 1)
+    
+    del flt
+    gc.collect()
+    assert not os.path.exists(path)
+    
+    ### Files kept with `remove_files=False`
+    flt = model.GrismFLT.__new__(model.GrismFLT)
+    flt.direct = flt.grism = None
+    flt.grism_file = 'test_flt.fits'
+    flt.seg = np.ones((10, 10), dtype=np.float32)
+    flt.model = np.zeros((10, 10), dtype=np.float32)
+    
+    flt.share_arrays(scratch_dir=str(tmpdir))
+    path = flt.shared_path
+    flt.release_shared_arrays(remove_files=False)
+    del flt
+    gc.collect()
+    assert os.path.exists(path)
+
+def test_incomplete_cache(tmpdir):
+    """
+    `GrismFLT.load_from_cache` needs the `seg` and `model` arrays
+    """
+    import pytest
+    
+    flt = model.GrismFLT.__new__(model.GrismFLT)
+    flt.direct = flt.grism = None
+    flt.seg = flt.model = None
+    
+    np.save(str(tmpdir.join('seg.npy')), np.ones((10, 10), dtype=np.float32))
+    with pytest.raises(IOError):
+        flt.load_from_cache(str(tmpdir))
+    
+    np.save(str(tmpdir.join('model.npy')), np.zeros((10,10), dtype=np.float32))
+    assert flt.load_from_cache(str(tmpdir))
+    assert flt.model_dtype == np.float32
+    assert flt.seg.shape == (10, 10)
+
+def test_model_change_log(tmpdir):
+    """
+    The log of model changes is bounded and isn't pickled
+    """
+    import pickle
+    
+    flt = make_flt(tmpdir)
+    flt.max_model_changes = 8
+    
+    flt.compute_full_model(ids=[1, 2, 3], mags=[20, 20, 20], store=False)
+    version = flt.model_version
+    assert len(flt.get_model_changes(since=0)) == version
+    
+    for i in range(20):
+        flt.record_model_change(slice(0, 10), slice(i, i+10))
+        assert len(flt.model_changes) <= 8
+    
+    assert flt.model_version == version+20
+    
+    ### Versions dropped from the log need a full update
+    assert flt.get_model_changes(since=version) is None
+    changes = flt.get_model_changes(since=flt.model_version-2)
+    assert changes == [(slice(0, 10), slice(18, 28)), 
+                       (slice(0, 10), slice(19, 29))]
+    
+    copy = pickle.loads(pickle.dumps(flt))
+    assert copy.model_changes == []
+    assert copy.model_version == flt.model_version
+    assert len(flt.model_changes) > 0
+
+def test_footprint_boxes(tmpdir):
+    """
+    Footprint boxes contain the dispersed models and the cutouts
+    """
+    flt = make_flt(tmpdir)
+    
+    ### Trace offset much larger than the margin
+    flt.conf.conf['DYDX_A_0'] = 12.3
+    flt.conf.init_trace_cache()
+    
+    size = 20
+    box_ids, box_beams, boxes = flt.get_footprint_boxes(ids=[1, 2, 3], 
+                                                        size=size, margin=0)
+    for id in [1, 2, 3]:
+        ylo, yhi, xlo, xhi = boxes[box_ids == id][0]
+        
+        beams, full = flt.compute_model_orders(id=id, compute_size=True, 
+                                               in_place=False)
+        yp, xp = np.nonzero(full)
+        assert len(yp) > 0
+        assert (yp.min() >= ylo) & (yp.max() < yhi)
+        assert (xp.min() >= xlo) & (xp.max() < xhi)
+        
+        beam = flt.compute_model_orders(id=id, size=size, store=False, 
+                                        get_beams=['A'])['A']
+        assert beam.sly_parent.start >= ylo
+        assert beam.sly_parent.stop <= yhi
+        assert beam.slx_parent.start >= xlo
+        assert beam.slx_parent.stop <= xhi
+
+def test_object_traces(tmpdir):
+    """
+    `compute_object_traces` gives the traces of `compute_model_orders` and 
+    skips IDs that aren't in the segmentation image
+    """
+    flt = make_flt(tmpdir)
+    flt.conf.conf['DYDX_A_0'] = np.array([0.5, 1.e-3, -2.e-3])
+    
+    traces = flt.compute_object_traces(ids=[3, 7, 1, -1])
+    assert np.all(traces['id'] == [3, 1])
+    
+    dx, dy, lam = traces['A']
+    assert dy.shape == lam.shape == (2, len(dx))
+    assert np.all(dx == flt.conf.dxlam['A'])
+    
+    for i, id in enumerate(traces['id']):
+        beam = flt.compute_model_orders(id=id, compute_size=True, 
+                                        store=False, get_beams=['A'])['A']
+        assert np.allclose(dy[i,:], beam.ytrace_beam, rtol=1.e-10)
+        assert np.allclose(lam[i,:], beam.lam_beam, rtol=1.e-10)
+
+def test_catalog_index(tmpdir):
+    """
+    `get_catalog_rows` finds the first catalog row of each ID and the 
+    index is rebuilt when the catalog changes
+    """
+    flt = make_flt(tmpdir)
+    assert flt.get_catalog_rows(1) is None
+    assert np.all(flt.get_catalog_rows([1, 2]) == -1)
+    
+    ids = [5, 3, 5, 9, 1, 3]
+    flt.catalog = Table([ids, np.arange(6.)+1, np.arange(6.)+11], 
+                        names=['id', 'x_flt', 'y_flt'])
+    
+    def brute_force(id):
+        rows = np.where(flt.catalog['id'] == id)[0]
+        return rows[0] if len(rows) > 0 else -1
+        
+    test_ids = [5, 4, 1, 9, 3, 100, -1, 0]
+    rows = flt.get_catalog_rows(test_ids)
+    assert np.all(rows == [brute_force(id) for id in test_ids])
+    for id in test_ids:
+        row = flt.get_catalog_rows(id)
+        assert (row is None) if brute_force(id) < 0 else (row == 
+                                                          brute_force(id))
+        
+    ### Appended rows
+    index = flt.catalog_index
+    flt.catalog.add_row([4, 7., 17.])
+    assert flt.get_catalog_rows(4) == 6
+    assert flt.catalog_index is not index
+    
+    ### New catalog with the same length
+    flt.catalog = Table([[2]*7, np.ones(7), np.ones(7)], 
+                        names=['id', 'x_flt', 'y_flt'])
+    assert np.all(flt.get_catalog_rows([2, 4]) == [0, -1])
+    
+    ### Position from the catalog in `compute_model_orders`
+    origin = []
+    for x, y in [(79, 58), (84, 53)]:
+        flt.catalog['x_flt'][0] = x
+        flt.catalog['y_flt'][0] = y
+        beam = flt.compute_model_orders(id=2, size=10, store=False, 
+                                        get_beams=['A'])['A']
+        origin.append(beam.origin)
+    
+    assert np.all(np.diff(origin, axis=0) == [-5, 5])
+
+def test_footprint_index():
+    """
+    `FootprintIndex.query` finds the same footprints as a brute-force 
+    overlap test
+    """
+    sh = (300, 500)
+    rnd = np.random.RandomState(3)
+    N = 200
+    ylo = rnd.randint(-40, sh[0]+20, size=N)
+    xlo = rnd.randint(-40, sh[1]+20, size=N)
+    boxes = np.array([ylo, ylo+rnd.randint(1, 60, size=N), 
+                      xlo, xlo+rnd.randint(1, 200, size=N)]).T
+    ids = rnd.randint(1, 50, size=N)
+    beams = rnd.choice(['A', 'B'], size=N)
+    
+    for cell_size in [16, 64, 1000]:
+        index = model.FootprintIndex(sh, cell_size=cell_size)
+        index.build(ids, beams, boxes)
+        
+        ### Clipped to the array
+        clip = boxes*1
+        clip[:,:2] = np.clip(clip[:,:2], 0, sh[0])
+        clip[:,2:] = np.clip(clip[:,2:], 0, sh[1])
+        keep = (clip[:,1] > clip[:,0]) & (clip[:,3] > clip[:,2])
+        assert len(index) == keep.sum() < N
+        assert np.all(index.boxes == clip[keep])
+        assert np.all(index.ids == ids[keep])
+        assert np.all(index.beams == beams[keep])
+        
+        for i in range(300):
+            qy, qx = rnd.randint(-30, sh[0]+10), rnd.randint(-30, sh[1]+10)
+            box = [qy, qy+rnd.randint(0, 80), qx, qx+rnd.randint(0, 150)]
+            exclude = list(rnd.choice(ids, size=i % 3))
+            
+            ylo, yhi = max(box[0], 0), min(box[1], sh[0])
+            xlo, xhi = max(box[2], 0), min(box[3], sh[1])
+            b = index.boxes
+            overlap = ((b[:,0] < yhi) & (b[:,1] > ylo) & 
+                       (b[:,2] < xhi) & (b[:,3] > xlo))
+            overlap &= ~np.in1d(index.ids, exclude)
+            overlap &= (yhi > ylo) & (xhi > xlo)
+            
+            assert np.all(np.sort(index.query(box, exclude=exclude)) == 
+                          np.where(overlap)[0])
+        
+        for id in np.unique(ids):
+            beams_i, boxes_i = index.get_footprints(id)
+            test = index.ids == id
+            assert np.all(beams_i == index.beams[test])
+            assert np.all(boxes_i == index.boxes[test])
+
+def test_sparse_operator(tmpdir):
+    """
+    The sparse operator of `GrismDisperser` gives the same models as the 
+    pixel loop and isn't used after the thumbnails are replaced
+    """
+    import pickle
+    
+    flt = make_flt(tmpdir)
+    beam = flt.compute_model_orders(id=1, compute_size=True, store=False, 
+                                    get_beams=['A'], in_place=False)['A']
+    
+    spectrum_1d = [np.arange(1.e4, 1.8e4, 100), np.linspace(1, 2, 80)]
+    ref = beam.compute_model(spectrum_1d=spectrum_1d, in_place=False)
+    
+    beam.init_sparse_operator()
+    assert beam.use_sparse_operator()
+    assert not beam.use_sparse_operator(id=2)
+    assert not beam.use_sparse_operator(thumb=beam.direct)
+    
+    out = beam.compute_model(spectrum_1d=spectrum_1d, in_place=False)
+    assert np.allclose(out, ref, rtol=1.e-5, atol=1.e-6*ref.max())
+    
+    ### Still used after pickling
+    beam2 = pickle.loads(pickle.dumps(beam))
+    assert beam2.use_sparse_operator()
+    
+    ### Replaced direct image
+    beam.direct = beam.direct*2
+    assert not beam.use_sparse_operator()
+    out = beam.compute_model(spectrum_1d=spectrum_1d, in_place=False)
+    assert np.allclose(out, 2*ref, rtol=1.e-5, atol=1.e-6*ref.max())
+    
+    beam.init_sparse_operator()
+    assert beam.use_sparse_operator()
+    
+    ### Replaced segmentation image
+    beam.seg = beam.seg*0
+    assert not beam.use_sparse_operator()
+    out = beam.compute_model(spectrum_1d=spectrum_1d, in_place=False)
+    assert np.all(out == 0)
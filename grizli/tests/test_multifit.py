@@ -0,0 +1,484 @@
+"""
+Tests of `grizli.multifit` with synthetic exposures and design matrices
+"""
+import os
+import gc
+import pickle
+from types import SimpleNamespace
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import astropy.io.fits as pyfits
+
+from grizli import multifit, model
+from grizli.tests.test_model import make_flt
+
+def make_group_files(tmpdir, N=2, cache=False):
+    """
+    Write `N` exposures like `test_model.make_flt` in the format of 
+    `~grizli.model.GrismFLT.save_full_pickle`, and optionally 
+    `~grizli.model.GrismFLT.save_full_cache`, which `GroupFLT` reads from
+    the working directory, `tmpdir`
+    
+    Returns
+    -------
+    grism_files : list
+        Filenames to pass to `GroupFLT`.
+    """
+    h = pyfits.Header()
+    h['CTYPE1'], h['CTYPE2'] = 'RA---TAN', 'DEC--TAN'
+    h['CRPIX1'], h['CRPIX2'] = 200., 100.
+    h['CRVAL1'], h['CRVAL2'] = 150., 2.
+    h['CD1_1'], h['CD2_2'] = -0.128/3600, 0.128/3600
+    h['CD1_2'] = h['CD2_1'] = 0.
+    
+    grism_files = []
+    for i in range(N):
+        flt = make_flt(tmpdir)
+        flt.grism_file = 'test{0}_flt.fits'.format(i)
+        for im in [flt.direct, flt.grism]:
+            im.header = h.copy()
+            im.wcs_is_lookup = False
+            im.get_wcs()
+            im.sci_extn = 1
+            im.parent_file = flt.grism_file
+        
+        flt.model += i+1
+        
+        hdu = pyfits.HDUList([pyfits.PrimaryHDU()])
+        for prefix, im in [('D', flt.direct), ('G', flt.grism)]:
+            for key in im.data:
+                hdu.append(pyfits.ImageHDU(data=im.data[key], 
+                                           header=im.header, 
+                                           name=prefix+key))
+        
+        hdu.append(pyfits.ImageHDU(data=flt.seg, name='SEG'))
+        hdu.append(pyfits.ImageHDU(data=flt.model, name='MODEL'))
+        hdu.writeto(str(tmpdir.join('test{0}.01.GrismFLT.fits'.format(i))),
+                    overwrite=True)
+        
+        if cache:
+            flt.save_full_cache(verbose=False)
+        
+        flt.direct.data = flt.grism.data = flt.seg = flt.model = None
+        with open(str(tmpdir.join('test{0}.01.GrismFLT.pkl'.format(i))), 
+                  'wb') as fp:
+            pickle.dump(flt, fp)
+        
+        grism_files.append(flt.grism_file)
+    
+    return grism_files
+    
+def test_group_shared_arrays(tmpdir, monkeypatch):
+    """
+    Exposures loaded with shared arrays in a pool of processes keep their 
+    scratch files until the `GroupFLT` object is deleted
+    """
+    monkeypatch.chdir(tmpdir)
+    grism_files = make_group_files(tmpdir)
+    scratch = tmpdir.mkdir('scratch')
+    
+    grp = multifit.GroupFLT(grism_files=grism_files, cpu_count=2,
+                            scratch_dir=str(scratch), verbose=False)
+    
+    paths = []
+    for i, flt in enumerate(grp.FLTs):
+        assert isinstance(flt.model, np.memmap)
+        assert np.all(flt.model == i+1)
+        assert flt.shared_finalizer.alive
+        assert os.path.exists(os.path.join(flt.shared_path, 'model.npy'))
+        paths.append(flt.shared_path)
+    
+    ### Workers see the same arrays
+    copy = pickle.loads(pickle.dumps(grp.FLTs[0]))
+    copy.model += 1
+    del copy
+    gc.collect()
+    assert np.all(grp.FLTs[0].model == 2)
+    assert os.path.exists(paths[0])
+    
+    del grp, flt
+    gc.collect()
+    for path in paths:
+        assert not os.path.exists(path)
+
+def make_multibeam(N=3, npix=300, seed=1):
+    """
+    Minimal `~grizli.multifit.MultiBeam` with `N` beams of `npix` pixels
+    whose template matrix is a function of redshift
+    """
+    rnd = np.random.RandomState(seed)
+    mb = multifit.MultiBeam.__new__(multifit.MultiBeam)
+    mb.N = N
+    mb.Ntot = N*npix
+
+    lam = np.linspace(1.1e4, 1.65e4, npix)
+    mb.beams = [SimpleNamespace(beam=SimpleNamespace(lam=lam))]
+
+    lamf = np.hstack([lam]*N)
+    mb.xpf = lamf/1.e4-1
+    mb.flat_flam = np.exp(-(lamf-1.4e4)**2/2/0.3e4**2)
+    mb.poly_order = None
+
+    mb.A_bg = np.zeros((N, mb.Ntot))
+    for i in range(N):
+        mb.A_bg[i, i*npix:(i+1)*npix] = 1.
+
+    def compute_template_matrix(z=0., templates={}):
+        A = np.zeros((len(templates), mb.Ntot))
+        for i, key in enumerate(templates):
+            center, width = templates[key]
+            dx = (lamf-center*(1+z))/width
+            A[i,:] = np.exp(-dx**2/2)*(np.abs(dx) < 5)
+
+        return A
+
+    mb.compute_template_matrix = compute_template_matrix
+
+    templates = OrderedDict()
+    templates['cont'] = (0.7e4, 0.5e4)
+    templates['line 1'] = (0.6563e4, 30.)
+    templates['line 2'] = (0.5007e4, 30.)
+
+    z = 1.1
+    model = np.dot([2., 0.8, 0.3], compute_template_matrix(z, templates))
+    model += np.dot(0.01*(rnd.rand(N)-0.5), mb.A_bg)
+
+    mb.ivarf = np.ones(mb.Ntot)/0.05**2
+    mb.scif = model + rnd.normal(size=mb.Ntot)*0.05
+    mb.fit_mask = np.ones(mb.Ntot, dtype=bool)
+    mb.fit_mask[:20] = False
+    mb.weight = np.ones(mb.Ntot)
+
+    return mb, templates
+
+@pytest.mark.parametrize('fitter', ['lstsq', 'nnls'])
+@pytest.mark.parametrize('fit_background', [True, False])
+def test_fit_at_z_normal(fitter, fit_background):
+    """
+    `fit_at_z_normal` has the same coefficients and chi-squared as
+    `fit_at_z`
+    """
+    mb, templates = make_multibeam()
+
+    ### Down-weighted pixels and a background without any pixels
+    mb.weight[100:150] = 0.5
+    mb.A_bg[1,:] = 0
+
+    init_coeffs = None
+    for z in [0.9, 1.1, 1.3]:
+        kwargs = dict(z=z, templates=templates, fitter=fitter,
+                      fit_background=fit_background, poly_order=1)
+
+        _, coeffs, chi2, _ = mb.fit_at_z(**kwargs)
+        _, ncoeffs, nchi2, _ = mb.fit_at_z_normal(init_coeffs=init_coeffs,
+                                                  **kwargs)
+
+        assert np.allclose(ncoeffs, coeffs, rtol=1.e-6, atol=1.e-8)
+        assert np.allclose(nchi2, chi2, rtol=1.e-8)
+        init_coeffs = ncoeffs
+
+        if fit_background:
+            assert ncoeffs[1] == 0
+
+    ### Normal equations recomputed for a new mask
+    mb.fit_mask[-50:] = False
+    _, coeffs, chi2, _ = mb.fit_at_z(**kwargs)
+    _, ncoeffs, nchi2, _ = mb.fit_at_z_normal(**kwargs)
+    assert np.allclose(ncoeffs, coeffs, rtol=1.e-6, atol=1.e-8)
+    assert np.allclose(nchi2, chi2, rtol=1.e-8)
+
+def test_eval_zgrid():
+    """
+    `eval_zgrid` matches serial fits and leaves the attributes of the best
+    fit
+    """
+    mb, templates = make_multibeam()
+    zgrid = np.arange(0.9, 1.3, 0.01)
+    kwargs = dict(templates=templates, fitter='nnls', fit_background=True,
+                  poly_order=1)
+
+    chi2, coeffs = mb.eval_zgrid(zgrid, normal_equations=True, cpu_count=4,
+                                 **kwargs)
+    y_poly = mb.y_poly*1
+
+    for i, z in enumerate(zgrid):
+        _, ncoeffs, nchi2, _ = mb.fit_at_z_normal(z=z, **kwargs)
+        assert np.allclose(coeffs[i], ncoeffs)
+        assert np.allclose(chi2[i], nchi2)
+
+    _ = mb.fit_at_z_normal(z=zgrid[np.argmin(chi2)], **kwargs)
+    assert np.allclose(y_poly, mb.y_poly)
+    assert mb.fit_bg
+
+def test_group_cache(tmpdir, monkeypatch):
+    """
+    Exposures loaded from the memory-mapped caches stay mapped in the 
+    parent process
+    """
+    monkeypatch.chdir(tmpdir)
+    grism_files = make_group_files(tmpdir, cache=True)
+    
+    grp = multifit.GroupFLT(grism_files=grism_files, cpu_count=2,
+                            verbose=False)
+    for i, flt in enumerate(grp.FLTs):
+        assert flt.grism_file == grism_files[i]
+        for data in [flt.model, flt.seg, flt.grism.data['SCI']]:
+            assert isinstance(data, np.memmap)
+            assert 'GrismFLT.cache' in data.filename
+            
+        assert np.all(flt.model == i+1)
+    
+    ### FITS file saved after the cache, loaded in the pool in the same 
+    ### order
+    os.utime('test0.01.GrismFLT.fits', None)
+    grp = multifit.GroupFLT(grism_files=grism_files, cpu_count=2,
+                            verbose=False)
+    assert not isinstance(grp.FLTs[0].model, np.memmap)
+    assert isinstance(grp.FLTs[1].model, np.memmap)
+    for i, flt in enumerate(grp.FLTs):
+        assert np.all(flt.model == i+1)
+    
+    ### Shared arrays replaced by the new cache
+    grp = multifit.GroupFLT(grism_files=grism_files, cpu_count=2,
+                            scratch_dir=str(tmpdir.mkdir('scratch')),
+                            verbose=False)
+    path = grp.FLTs[0].shared_path
+    grp.save_full_data(cache=True)
+    for i, flt in enumerate(grp.FLTs):
+        assert isinstance(flt.model, np.memmap)
+        assert 'GrismFLT.cache' in flt.model.filename
+        assert np.all(flt.model == i+1)
+    
+    assert not os.path.exists(path)
+
+class SlowHDU(object):
+    """
+    Stand-in for the `HDUList` of a beam, counting the ones not yet written
+    """
+    pending = []
+    
+    def __init__(self, id):
+        self.id = id
+        self.pending.append(id)
+    
+    def writeto(self, outfile, clobber=False):
+        import time
+        time.sleep(0.01)
+        if self.id == 4:
+            raise IOError('disk full')
+            
+        with open(outfile, 'w') as fp:
+            fp.write('{0}\n'.format(self.id))
+        
+        self.pending.remove(self.id)
+
+def test_iter_multibeams(tmpdir, monkeypatch):
+    """
+    `iter_multibeams` skips failed objects, limits the objects waiting to 
+    be written and resumes interrupted runs
+    """
+    monkeypatch.chdir(tmpdir)
+    
+    grp = multifit.GroupFLT.__new__(multifit.GroupFLT)
+    grp.group_name = 'grp'
+    grp.FLTs = []
+    
+    extracted = []
+    max_pending = [0]
+    def extract(id, write=True, **kwargs):
+        if id == 3:
+            raise ValueError('bad object')
+            
+        extracted.append(id)
+        max_pending[0] = max(max_pending[0], len(SlowHDU.pending))
+        return 'mb{0}'.format(id), [('beam_{0}.fits'.format(id), SlowHDU(id))]
+    
+    grp._extract_multibeam_products = extract
+    
+    ids = list(range(1, 21))
+    kwargs = dict(prefetch=2, threads=2, verbose=False)
+    
+    ### Interrupted run
+    out = []
+    for mb in grp.iter_multibeams(ids, **kwargs):
+        out.append(mb)
+        if len(out) == 10:
+            break
+    
+    ### Objects waiting to be written, extracted and being processed
+    assert max_pending[0] <= 2*kwargs['prefetch']+1
+    
+    assert out == ['mb{0}'.format(id) for id in ids[:11] if id != 3]
+    done = [id for id in ids if os.path.exists(grp.get_beams_manifest(id))]
+    assert done == [id for id in ids[:11] if id not in [3, 4]]
+    
+    ### Resumed run redoes the failed objects and the rest
+    extracted[:] = []
+    SlowHDU.pending[:] = []
+    out = list(grp.iter_multibeams(ids, **kwargs))
+    assert extracted == [id for id in ids if id not in done+[3]]
+    done = [id for id in ids if os.path.exists(grp.get_beams_manifest(id))]
+    assert done == [id for id in ids if id not in [3, 4]]
+    
+    with open(grp.get_beams_manifest(5)) as fp:
+        assert fp.read() == 'beam_5.fits\n'
+
+def test_catalog_positions(tmpdir):
+    """
+    `GroupFLT.get_catalog_positions` has the catalog positions of the 
+    objects in each exposure
+    """
+    from astropy.table import Table
+    
+    grp = multifit.GroupFLT.__new__(multifit.GroupFLT)
+    grp.FLTs = [make_flt(tmpdir) for i in range(3)]
+    grp.N = 3
+    
+    grp.FLTs[0].catalog = Table([[3, 1, 2], [1., 2., 3.], [11., 12., 13.]],
+                                names=['id', 'x_flt', 'y_flt'])
+    grp.FLTs[2].catalog = Table([[2, 5], [4., 5.], [14., 15.]],
+                                names=['id', 'x_flt', 'y_flt'])
+    
+    x_flt, y_flt = grp.get_catalog_positions([1, 2, 5, 4])
+    nan = np.nan
+    assert np.allclose(x_flt, [[2, 3, nan, nan], [nan]*4, [nan, 4, 5, nan]], 
+                       equal_nan=True)
+    assert np.allclose(y_flt-10, x_flt, equal_nan=True)
+
+def load_group(tmpdir, monkeypatch, N=2):
+    """
+    `GroupFLT` of the exposures of `make_group_files` with a constant grism 
+    image in each exposure
+    """
+    monkeypatch.chdir(tmpdir)
+    grism_files = make_group_files(tmpdir, N=N)
+    grp = multifit.GroupFLT(grism_files=grism_files, cpu_count=0,
+                            verbose=False)
+    for i, flt in enumerate(grp.FLTs):
+        flt.grism.data['SCI'][:] = i+1
+    
+    return grp
+    
+def test_beam_cutout_copy(tmpdir, monkeypatch):
+    """
+    `BeamCutout` objects made from a copy of the input `GrismDisperser` 
+    are the same as those made from a new one
+    """
+    grp = load_group(tmpdir, monkeypatch, N=1)
+    flt = grp.FLTs[0]
+    beam = flt.compute_model_orders(id=1, compute_size=True, store=False, 
+                                    get_beams=['A'], in_place=False)['A']
+    
+    cutouts = [model.BeamCutout(flt=flt, beam=beam, conf=flt.conf, 
+                                copy_beam=copy_beam) 
+               for copy_beam in [True, False]]
+    
+    bc, ref = cutouts
+    assert bc.beam is not beam
+    assert bc.beam.sensitivity_beam is beam.sensitivity_beam
+    assert ref.beam.sensitivity_beam is not beam.sensitivity_beam
+    assert bc.beam.model.sum() > 0
+    
+    for attr in ['model', 'modelf', 'lam', 'ytrace', 'sensitivity', 
+                 'lam_beam', 'ytrace_beam', 'sensitivity_beam']:
+        assert np.allclose(getattr(bc.beam, attr), getattr(ref.beam, attr),
+                           rtol=1.e-6)
+        
+    for attr in ['contam', 'scif', 'ivarf', 'fit_mask', 'model']:
+        assert np.allclose(getattr(bc, attr), getattr(ref, attr))
+    
+    ### Models computed from the copy don't change the input beam
+    model_in = beam.model*1
+    spectrum_1d = [np.arange(1.e4, 1.8e4, 100), 
+                   np.linspace(1, 2, 80)]
+    for cutout in cutouts:
+        cutout.compute_model(spectrum_1d=spectrum_1d)
+    
+    assert np.allclose(bc.model, ref.model, rtol=1.e-6)
+    assert not np.allclose(bc.model, model_in)
+    assert np.all(beam.model == model_in)
+
+def test_lazy_slices(tmpdir, monkeypatch):
+    """
+    Lazy `ImageData.get_slice` cutouts have the same arrays, origin, WCS 
+    and header as the full copies
+    """
+    grp = load_group(tmpdir, monkeypatch, N=1)
+    flt = grp.FLTs[0]
+    flt.grism.data['SCI'] += np.arange(flt.grism.sh[1])
+    
+    ### Scaled by `photflam` in the full copies
+    flt.direct.photflam = 2.5
+    
+    slx, sly = slice(30, 90), slice(40, 70)
+    for im in [flt.direct, flt.grism]:
+        for get_slice_header in [True, False]:
+            ref = im.get_slice(slx=slx, sly=sly, 
+                               get_slice_header=get_slice_header)
+            lazy = im.get_slice(slx=slx, sly=sly, 
+                                get_slice_header=get_slice_header, lazy=True)
+            
+            assert isinstance(lazy, model.ImageDataSlice)
+            assert lazy._wcs is None
+            assert list(lazy.data.keys()) == list(ref.data.keys())
+            for key in ref.data:
+                if ref.data[key] is None:
+                    assert lazy.data[key] is None
+                else:
+                    atol = 1.e-6*np.abs(ref.data[key]).max()
+                    assert np.allclose(lazy.data[key], ref.data[key], 
+                                       rtol=1.e-6, atol=atol)
+                    assert not lazy.data[key].flags.writeable
+                    assert np.shares_memory(lazy.data[key], im.data[key])
+            
+            assert np.all(lazy.origin == ref.origin)
+            assert np.all(lazy.sh == ref.sh)
+            assert lazy.photflam == ref.photflam
+            assert lazy.wcs.to_header_string() == ref.wcs.to_header_string()
+            assert lazy.wcs.naxis1 == ref.wcs.naxis1 == 60
+            assert lazy.wcs.naxis2 == ref.wcs.naxis2 == 30
+            assert list(lazy.header.items()) == list(ref.header.items())
+            assert (len(lazy.header) > 0) == get_slice_header
+    
+    ### Cutouts
+    beam = flt.compute_model_orders(id=1, compute_size=True, store=False, 
+                                    get_beams=['A'], in_place=False)['A']
+    
+    bc, ref = [model.BeamCutout(flt=flt, beam=beam, conf=flt.conf, 
+                                lazy_slices=lazy) for lazy in [True, False]]
+    
+    for attr in ['scif', 'ivarf', 'contam', 'fit_mask', 'model']:
+        assert np.allclose(getattr(bc, attr), getattr(ref, attr))
+    
+    assert np.all(bc.grism.origin == ref.grism.origin)
+    assert bc.grism.wcs.to_header_string() == ref.grism.wcs.to_header_string()
+
+def test_get_beams_threads(tmpdir, monkeypatch):
+    """
+    `GroupFLT.get_beams` with a pool of threads returns the same beams in 
+    the same order
+    """
+    grp = load_group(tmpdir, monkeypatch, N=5)
+    
+    ### No data in one exposure, and in most of the cutout in another
+    grp.FLTs[2].grism.data['SCI'][:] = 0
+    grp.FLTs[1].grism.data['SCI'][:,100:] = 0
+    
+    for min_overlap, files in zip([0.2, 0.5], [[0, 1, 3, 4], [0, 3, 4]]):
+        results = []
+        for threads in [1, 2, 4]:
+            beams = grp.get_beams(1, size=-1, min_overlap=min_overlap, 
+                                  threads=threads)
+            parent = ['test{0}_flt.fits'.format(i) for i in files]
+            assert [b.grism.parent_file for b in beams] == parent
+            results.append(beams)
+        
+        for beams in results[1:]:
+            for b, ref in zip(beams, results[0]):
+                assert np.all(b.grism['SCI'] == ref.grism['SCI'])
+                assert np.all(b.beam.model == ref.beam.model)
+                assert np.all(b.contam == ref.contam)
+                assert np.all(b.grism.origin == ref.grism.origin)
@@ -0,0 +1,163 @@
+"""
+Tests of `grizli.utils`
+"""
+import numpy as np
+import scipy.optimize
+
+from grizli import utils
+
+def test_nnls_normal(capsys):
+    """
+    `nnls_normal` has the same solution as `scipy.optimize.nnls`, with and
+    without an initial guess of the positive coefficients
+    """
+    rnd = np.random.RandomState(1)
+    for i in range(20):
+        A = rnd.normal(size=(200, 15))
+        b = rnd.normal(size=200)+np.dot(A, rnd.normal(size=15))
+
+        ### Degenerate columns
+        if i % 2:
+            A[:,3] = A[:,4]
+            A[:,5] = 0
+
+        x0, rnorm = scipy.optimize.nnls(A, b)
+        AtA, Atb = np.dot(A.T, A), np.dot(A.T, b)
+        chi2 = lambda x: np.sum((np.dot(A, x)-b)**2)
+
+        guesses = [None, x0 > 0, rnd.rand(15) > 0.5, np.ones(15, dtype=bool)]
+        for passive in guesses:
+            x, P = utils.nnls_normal(AtA, Atb, passive=passive)
+            assert np.isfinite(x).all()
+            assert (x >= 0).all()
+            assert np.all(P == (x > 0))
+            assert np.allclose(chi2(x), rnorm**2, rtol=1.e-10)
+            if i % 2 == 0:
+                assert np.allclose(x, x0, rtol=1.e-8, atol=1.e-10)
+
+    assert 'not converged' not in capsys.readouterr().out
+
+    ### Message when stopped early
+    x, P = utils.nnls_normal(AtA, Atb, max_iter=1)
+    assert 'not converged' in capsys.readouterr().out
+
+def make_chi2_curve(zr, seed=1):
+    """
+    Synthetic chi-squared(z) with broad features and several narrow minima
+    """
+    rnd = np.random.RandomState(seed)
+    zc = rnd.uniform(*zr, size=6)
+    width = rnd.uniform(0.002, 0.01, size=6)*(1+zc)
+    depth = rnd.uniform(5, 60, size=6)
+    phase = rnd.normal(size=3)
+    
+    def func(z):
+        x = np.log(1+z)
+        chi2 = 1000+30*np.sin(3*x+phase[0])+10*np.sin(11*x+phase[1])
+        chi2 += 2*np.sin(150*x+phase[2])
+        chi2 -= np.sum(depth*np.exp(-(z-zc)**2/2/width**2))
+        return chi2, None
+    
+    return func
+    
+def test_adaptive_zsearch():
+    """
+    `adaptive_zsearch` finds the minimum of a full grid with fewer
+    evaluations on chi-squared curves with narrow minima
+    """
+    zr = [0.7, 3.4]
+    zfull = utils.log_zgrid(zr, dz=0.0004)
+    
+    nmiss = 0
+    for i in range(50):
+        func = make_chi2_curve(zr, seed=i)
+        cfull = np.array([func(z)[0] for z in zfull])
+        
+        kwargs = dict(zr=zr, dz0=0.01, dz_min=0.0004)
+        zgrid, chi2, results, info = utils.adaptive_zsearch(func, **kwargs)
+        assert info['converged']
+        assert info['ninit'] == len(utils.log_zgrid(zr, dz=0.01))
+        nmiss += chi2.min() > cfull.min() + 1
+        
+        ### All local minima refined
+        out = utils.adaptive_zsearch(func, refine_minima=True, **kwargs)
+        assert out[3]['nevals'] >= info['nevals']
+        assert out[3]['nevals'] < len(zfull)/4
+        assert out[1].min() < cfull.min() + 1
+    
+    assert nmiss <= 2
+    
+def test_adaptive_zsearch_zoom():
+    """
+    With the settings of `StackFitter.fit_zgrid`, the search needs fewer
+    fits than the coarse grid and zoom that it replaces
+    """
+    zr, dz0 = [0.4, 3.4], 0.005
+    nevals, nbaseline = 0, 0
+    for i in range(20):
+        func = make_chi2_curve(zr, seed=i)
+        zgrid, chi2, results, info = utils.adaptive_zsearch(func, zr=zr, 
+                                              dz0=2*dz0, dz_min=dz0/2.02**6)
+        nevals += info['nevals']
+        
+        ### Coarse grid and zoom
+        z = utils.log_zgrid(zr, dz=dz0)
+        nbaseline += len(z)
+        zi, ci = z, np.array([func(zj)[0] for zj in z])
+        cbest = ci.min()
+        for iter in range(1, 7):
+            z0 = zi[np.argmin(ci)]
+            dz = dz0/2.02**iter
+            zi = utils.log_zgrid([z0-dz*4, z0+dz*4], dz=dz)
+            ci = np.array([func(zj)[0] for zj in zi])
+            nbaseline += len(zi)
+            cbest = np.minimum(cbest, ci.min())
+        
+        assert chi2.min() < cbest + 1
+    
+    assert nevals < nbaseline
+
+def test_igm_cache():
+    """
+    Cached IGM transmission curves are keyed by the full wavelength array
+    and limited in size
+    """
+    from types import SimpleNamespace
+
+    cache = utils.IGM_CACHE
+    saved = dict(cache)
+    calls = []
+    def full_IGM(z, lobs):
+        calls.append(z)
+        return np.exp(-z*1000./lobs)
+
+    try:
+        cache['igm'] = SimpleNamespace(full_IGM=full_IGM)
+        cache['available'] = True
+        cache['curves'] = utils.OrderedDict()
+        cache['nbytes'] = 0
+        cache['max_bytes'] = 4*(8*2+100*8)
+
+        wave = np.linspace(900, 1300, 100)
+        igmz = utils.get_igm_transmission(5., wave)
+        blue = wave < 1250
+        assert np.allclose(igmz[blue], np.exp(-5000./(6*wave[blue])))
+        assert np.all(igmz[wave >= 1250] == 1)
+        assert utils.get_igm_transmission(5., wave*1) is igmz
+        assert len(calls) == 1
+
+        ### Wavelengths that only differ in one element
+        wave2 = wave*1
+        wave2[0] += 1
+        igmz2 = utils.get_igm_transmission(5., wave2)
+        assert len(calls) == 2
+        assert igmz2[0] != igmz[0]
+
+        for z in np.arange(5, 6, 0.1):
+            utils.get_igm_transmission(z, wave)
+
+        assert cache['nbytes'] <= cache['max_bytes']
+        assert len(cache['curves']) == 2
+        assert cache['nbytes'] == 2*(100*8+wave.nbytes)
+    finally:
+        cache.update(saved)
@@ -15,7 +15,13 @@ ctypedef np.int64_t LINT_t
 ctypedef np.int32_t FINT_t
 ctypedef np.float32_t FTYPE_t
 
+### Output model arrays can be single or double precision
+ctypedef fused MTYPE_t:
+    np.float32_t
+    np.float64_t
+
 import cython
+from cython.parallel import prange, parallel, threadid
 
 cdef extern from "math.h":
     double sqrt(double x)
@@ -25,47 +31,235 @@ cdef extern from "math.h":
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.embedsignature(True)
-def disperse_grism_object(np.ndarray[FTYPE_t, ndim=2] flam, np.ndarray[FTYPE_t, ndim=2] segm, int seg_id, np.ndarray[LINT_t, ndim=1] idxl, np.ndarray[DTYPE_t, ndim=1] yfrac, np.ndarray[DTYPE_t, ndim=1] ysens, np.ndarray[DTYPE_t, ndim=1] full, np.ndarray[LINT_t, ndim=1] x0, np.ndarray[LINT_t, ndim=1] shd, np.ndarray[LINT_t, ndim=1] sh_thumb, np.ndarray[LINT_t, ndim=1] shg):
+def disperse_grism_object(const FTYPE_t[:,:] flam, const FTYPE_t[:,:] segm, int seg_id, const LINT_t[:] idxl, const DTYPE_t[:] yfrac, const DTYPE_t[:] ysens, MTYPE_t[:] full, const LINT_t[:] x0, const LINT_t[:] shd, const LINT_t[:] sh_thumb, const LINT_t[:] shg, int num_threads=1):
     """Compute a dispersed 2D spectrum
     
     Parameters
     ----------
     xxx
+    
+    full: ndarray (np.float32 or np.double)
+        Output (flattened) model array, to which the dispersed spectrum is 
+        added.  The flux of each dispersed pixel is computed in double 
+        precision and summed in the precision of `full`.
+    
+    num_threads: int
+        Number of OpenMP threads.  With `num_threads=1` the pixels are 
+        added directly into `full` in the original (column-major) order.
+        Otherwise the thumbnail rows are split between threads that 
+        accumulate into separate buffers, which are summed into `full` at
+        the end.  The GIL is released in both cases.
     """
-    cdef int i,j,k1,k2
-    cdef unsigned int nk,nl,k,shx,shy
+    cdef Py_ssize_t i, j, k, k1, k2, nk, nl, t, tid
+    cdef Py_ssize_t ilo, ihi, jlo, jhi
     cdef double fl_ij
+    cdef DTYPE_t[:,::1] acc
+    
+    nk = idxl.shape[0]
+    nl = full.shape[0]
+    
+    ### Limits of the thumbnail within the direct image
+    ilo = max(-sh_thumb[1], -x0[1])
+    ihi = min(sh_thumb[1], shd[1]-x0[1])
+    jlo = max(-sh_thumb[0], -x0[0])
+    jhi = min(sh_thumb[0], shd[0]-x0[0])
+    
+    if num_threads <= 1:
+        with nogil:
+            for i in range(ilo, ihi):
+                for j in range(jlo, jhi):
+                    fl_ij = flam[x0[0]+j, x0[1]+i]/1.e-17
+                    if (fl_ij == 0) | (segm[x0[0]+j, x0[1]+i] != seg_id):
+                        continue
+                
+                    for k in range(nk):
+                        k1 = idxl[k]+j*shg[1]+i
+                        if (k1 >= 0) & (k1 < nl):
+                            full[k1] += ysens[k]*fl_ij*yfrac[k]
+                    
+                        k2 = idxl[k]+(j-1)*shg[1]+i
+                        if (k2 >= 0) & (k2 < nl):
+                            full[k2] += ysens[k]*fl_ij*(1-yfrac[k])
+        
+        return True
     
-    nk = len(idxl)
-    nl = len(full)
+    ### Per-thread accumulators
+    acc = np.zeros((num_threads, nl), dtype=DTYPE)
     
-    for i in range(0-sh_thumb[1], sh_thumb[1]):
-        if (x0[1]+i < 0) | (x0[1]+i >= shd[1]):
-            continue
+    with nogil, parallel(num_threads=num_threads):
+        tid = threadid()
+        for j in prange(jlo, jhi, schedule='static'):
+            for i in range(ilo, ihi):
+                fl_ij = flam[x0[0]+j, x0[1]+i]/1.e-17
+                if (fl_ij == 0) | (segm[x0[0]+j, x0[1]+i] != seg_id):
+                    continue
+                
+                for k in range(nk):
+                    k1 = idxl[k]+j*shg[1]+i
+                    if (k1 >= 0) & (k1 < nl):
+                        acc[tid, k1] += ysens[k]*fl_ij*yfrac[k]
+                    
+                    k2 = idxl[k]+(j-1)*shg[1]+i
+                    if (k2 >= 0) & (k2 < nl):
+                        acc[tid, k2] += ysens[k]*fl_ij*(1-yfrac[k])
+    
+    ### Reduce
+    for k in prange(nl, nogil=True, num_threads=num_threads, 
+                    schedule='static'):
+        for t in range(num_threads):
+            full[k] += acc[t, k]
             
-        for j in range(0-sh_thumb[0], sh_thumb[0]):
-            if (x0[0]+j < 0) | (x0[0]+j >= shd[0]):
-                continue
+    return True
 
-            fl_ij = flam[x0[0]+j, x0[1]+i]/1.e-17
-            if (fl_ij == 0) | (segm[x0[0]+j, x0[1]+i] != seg_id):
-                continue
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.embedsignature(True)
+def disperse_grism_object_multi(const FTYPE_t[:,:] flam, const FTYPE_t[:,:] segm, int seg_id, const LINT_t[:] idxl, const DTYPE_t[:] yfrac, const DTYPE_t[:,:] ysens, MTYPE_t[:,:] full, const LINT_t[:] x0, const LINT_t[:] shd, const LINT_t[:] sh_thumb, const LINT_t[:] shg):
+    """Compute dispersed 2D spectra for multiple templates in one pass
+    
+    Same as `disperse_grism_object`, but `ysens` has shape `(N, len(idxl))`
+    and the output `full` has shape `(N, npix)` for `N` templates.  The 
+    thumbnail and segmentation arrays are only traversed once.
+    """
+    cdef Py_ssize_t i, j, k, k1, k2, n, nk, nl, nt
+    cdef Py_ssize_t ilo, ihi, jlo, jhi
+    cdef double fl_ij
+    
+    nk = idxl.shape[0]
+    nt = full.shape[0]
+    nl = full.shape[1]
+    
+    ilo = max(-sh_thumb[1], -x0[1])
+    ihi = min(sh_thumb[1], shd[1]-x0[1])
+    jlo = max(-sh_thumb[0], -x0[0])
+    jhi = min(sh_thumb[0], shd[0]-x0[0])
+    
+    with nogil:
+        for i in range(ilo, ihi):
+            for j in range(jlo, jhi):
+                fl_ij = flam[x0[0]+j, x0[1]+i]/1.e-17
+                if (fl_ij == 0) | (segm[x0[0]+j, x0[1]+i] != seg_id):
+                    continue
                 
+                for k in range(nk):
+                    k1 = idxl[k]+j*shg[1]+i
+                    if (k1 >= 0) & (k1 < nl):
+                        for n in range(nt):
+                            full[n,k1] += ysens[n,k]*fl_ij*yfrac[k]
+                    
+                    k2 = idxl[k]+(j-1)*shg[1]+i
+                    if (k2 >= 0) & (k2 < nl):
+                        for n in range(nt):
+                            full[n,k2] += ysens[n,k]*fl_ij*(1-yfrac[k])
+    
+    return True
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.embedsignature(True)
+def disperse_pixel_list(const LINT_t[:] jpix, const LINT_t[:] ipix, const DTYPE_t[:] flux, const LINT_t[:] idxl, const DTYPE_t[:] yfrac, const DTYPE_t[:] ysens, MTYPE_t[:] full, const LINT_t[:] shg, int num_threads=1):
+    """Compute a dispersed 2D spectrum from a list of pixels
+    
+    Same as `disperse_grism_object`, but only loops over a precomputed 
+    list of pixels of the segmentation region rather than the full 
+    thumbnail.  
+    
+    Parameters
+    ----------
+    jpix, ipix: ndarray (int64)
+        Row and column offsets of the pixels relative to the thumbnail 
+        center, `x0`.
+    
+    flux: ndarray (np.double)
+        Pixel fluxes, scaled by 1.e-17.
+    
+    num_threads: int
+        Number of OpenMP threads.  With `num_threads=1`, the pixels are
+        added in the order of the list, which is the same as the original
+        thumbnail loop for lists sorted by (ipix, jpix).
+    """
+    cdef Py_ssize_t p, k, k1, k2, nk, nl, np_, t, tid
+    cdef double fl_ij
+    cdef DTYPE_t[:,::1] acc
+    
+    nk = idxl.shape[0]
+    nl = full.shape[0]
+    np_ = flux.shape[0]
+    
+    if num_threads <= 1:
+        with nogil:
+            for p in range(np_):
+                fl_ij = flux[p]
+                for k in range(nk):
+                    k1 = idxl[k]+jpix[p]*shg[1]+ipix[p]
+                    if (k1 >= 0) & (k1 < nl):
+                        full[k1] += ysens[k]*fl_ij*yfrac[k]
+                    
+                    k2 = idxl[k]+(jpix[p]-1)*shg[1]+ipix[p]
+                    if (k2 >= 0) & (k2 < nl):
+                        full[k2] += ysens[k]*fl_ij*(1-yfrac[k])
+        
+        return True
+    
+    ### Per-thread accumulators
+    acc = np.zeros((num_threads, nl), dtype=DTYPE)
+    
+    with nogil, parallel(num_threads=num_threads):
+        tid = threadid()
+        for p in prange(np_, schedule='static'):
+            fl_ij = flux[p]
             for k in range(nk):
-                k1 = idxl[k]+j*shg[1]+i
+                k1 = idxl[k]+jpix[p]*shg[1]+ipix[p]
                 if (k1 >= 0) & (k1 < nl):
-                    full[k1] += ysens[k]*fl_ij*yfrac[k]
-                    
-                k2 = idxl[k]+(j-1)*shg[1]+i
+                    acc[tid, k1] += ysens[k]*fl_ij*yfrac[k]
+                
+                k2 = idxl[k]+(jpix[p]-1)*shg[1]+ipix[p]
+                if (k2 >= 0) & (k2 < nl):
+                    acc[tid, k2] += ysens[k]*fl_ij*(1-yfrac[k])
+    
+    for k in prange(nl, nogil=True, num_threads=num_threads, 
+                    schedule='static'):
+        for t in range(num_threads):
+            full[k] += acc[t, k]
+            
+    return True
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.embedsignature(True)
+def disperse_pixel_list_multi(const LINT_t[:] jpix, const LINT_t[:] ipix, const DTYPE_t[:] flux, const LINT_t[:] idxl, const DTYPE_t[:] yfrac, const DTYPE_t[:,:] ysens, MTYPE_t[:,:] full, const LINT_t[:] shg):
+    """Dispersed 2D spectra of multiple templates from a list of pixels
+    
+    Combination of `disperse_pixel_list` and `disperse_grism_object_multi`.
+    """
+    cdef Py_ssize_t p, k, k1, k2, n, nk, nl, nt, np_
+    cdef double fl_ij
+    
+    nk = idxl.shape[0]
+    nt = full.shape[0]
+    nl = full.shape[1]
+    np_ = flux.shape[0]
+    
+    with nogil:
+        for p in range(np_):
+            fl_ij = flux[p]
+            for k in range(nk):
+                k1 = idxl[k]+jpix[p]*shg[1]+ipix[p]
+                if (k1 >= 0) & (k1 < nl):
+                    for n in range(nt):
+                        full[n,k1] += ysens[n,k]*fl_ij*yfrac[k]
+                
+                k2 = idxl[k]+(jpix[p]-1)*shg[1]+ipix[p]
                 if (k2 >= 0) & (k2 < nl):
-                    full[k2] += ysens[k]*fl_ij*(1-yfrac[k])
+                    for n in range(nt):
+                        full[n,k2] += ysens[n,k]*fl_ij*(1-yfrac[k])
     
     return True
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.embedsignature(True)
-def compute_segmentation_limits(np.ndarray[FTYPE_t, ndim=2] segm, int seg_id, np.ndarray[FTYPE_t, ndim=2] flam, np.ndarray[LINT_t, ndim=1] shd):
+def compute_segmentation_limits(const FTYPE_t[:,:] segm, int seg_id, const FTYPE_t[:,:] flam, const LINT_t[:] shd, int num_threads=1):
     """Find pixel limits of a segmentation region
     
     Parameters
@@ -81,9 +275,51 @@ def compute_segmentation_limits(np.ndarray[FTYPE_t, ndim=2] segm, int seg_id, np
         
     shd: [int, int]
         Shape of segm
+    
+    num_threads: int
+        Number of OpenMP threads.  The rows of `segm` are split between 
+        threads with separate accumulators that are combined at the end.
     """
-    cdef int i, j, imin, imax, jmin, jmax, area
+    cdef Py_ssize_t i, j, t, tid, nthreads, ni, nj
+    cdef int imin, imax, jmin, jmax, area
     cdef double inumer, jnumer, denom, wht_ij
+    cdef LINT_t[:,::1] lim
+    cdef DTYPE_t[:,::1] sums
+    
+    nthreads = max(num_threads, 1)
+    ni = shd[0]
+    nj = shd[1]
+    
+    ### Per-thread accumulators: [area, imin, imax, jmin, jmax], 
+    ### [inumer, jnumer, denom]
+    lim = np.zeros((nthreads, 5), dtype=ITYPE)
+    sums = np.zeros((nthreads, 3), dtype=DTYPE)
+    for t in range(nthreads):
+        lim[t,1] = shd[0]
+        lim[t,3] = shd[1]
+    
+    with nogil, parallel(num_threads=nthreads):
+        tid = threadid()
+        for i in prange(ni, schedule='static'):
+            for j in range(nj):
+                if segm[i,j] != seg_id:
+                    continue
+            
+                lim[tid,0] += 1
+                wht_ij = flam[i,j]
+                sums[tid,0] += i*wht_ij
+                sums[tid,1] += j*wht_ij
+                sums[tid,2] += wht_ij
+            
+                if i < lim[tid,1]:
+                    lim[tid,1] = i
+                if i > lim[tid,2]:
+                    lim[tid,2] = i
+            
+                if j < lim[tid,3]: 
+                    lim[tid,3] = j
+                if j > lim[tid,4]:
+                    lim[tid,4] = j
     
     area = 0
     
@@ -96,27 +332,16 @@ def compute_segmentation_limits(np.ndarray[FTYPE_t, ndim=2] segm, int seg_id, np
     jnumer = 0.
     denom = 0.
     
-    for i in range(shd[0]):
-        for j in range(shd[1]):
-            if segm[i,j] != seg_id:
-                continue
-            
-            area += 1
-            wht_ij = flam[i,j]
-            inumer += i*wht_ij
-            jnumer += j*wht_ij
-            denom += wht_ij
-            
-            if i < imin:
-                imin = i
-            if i > imax:
-                imax = i
-            
-            if j < jmin: 
-                jmin = j
-            if j > jmax:
-                jmax = j
-    
+    for t in range(nthreads):
+        area += lim[t,0]
+        imin = min(imin, lim[t,1])
+        imax = max(imax, lim[t,2])
+        jmin = min(jmin, lim[t,3])
+        jmax = max(jmax, lim[t,4])
+        inumer += sums[t,0]
+        jnumer += sums[t,1]
+        denom += sums[t,2]
+        
     ### No matched pixels
     if denom == 0:
         denom = -99
@@ -125,6 +350,124 @@ def compute_segmentation_limits(np.ndarray[FTYPE_t, ndim=2] segm, int seg_id, np
             
             
             
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.embedsignature(True)
+def compute_segmentation_table(const FTYPE_t[:,:] segm, const FTYPE_t[:,:] flam, const FTYPE_t[:] ids):
+    """Pixel limits of all segmentation regions in a single pass
+    
+    Parameters
+    ----------
+    segm: ndarray (np.float32)
+        segmentation array
+    
+    flam: ndarray (np.float32)
+        Flux array to compute weighted centroid within segmentation region
+        
+    ids: ndarray (np.float32)
+        Sorted, unique values of `segm`, e.g., from `np.unique(segm)`.  
+        Pixels with values not in `ids` are ignored.
+    
+    Returns
+    -------
+    ilim, jlim: ndarray (int64), shape (N, 2)
+        Minimum and maximum row (`i`) and column (`j`) indices of each 
+        region.
+    
+    numer: ndarray (np.double), shape (N, 2)
+        Flux-weighted sums of the row and column indices
+    
+    area: ndarray (int64)
+        Number of pixels in each region
+    
+    denom: ndarray (np.double)
+        Total flux in each region
+        
+    The quantities are accumulated in the same order as 
+    `compute_segmentation_limits`, which returns 
+    
+        >>> (ilim[ix,0], ilim[ix,1], numer[ix,0]/denom[ix], 
+        >>>  jlim[ix,0], jlim[ix,1], numer[ix,1]/denom[ix], 
+        >>>  area[ix], denom[ix])
+    
+    for the region with `ids[ix] == seg_id`.
+    """
+    cdef Py_ssize_t i, j, ix, lo, hi, mid, nid, ni, nj
+    cdef FTYPE_t sval, last_val
+    cdef double wht_ij
+    cdef LINT_t[:,::1] ilim, jlim
+    cdef LINT_t[::1] area
+    cdef DTYPE_t[:,::1] numer
+    cdef DTYPE_t[::1] denom
+    
+    ni = segm.shape[0]
+    nj = segm.shape[1]
+    nid = ids.shape[0]
+    
+    ilim_arr = np.zeros((nid, 2), dtype=ITYPE)
+    jlim_arr = np.zeros((nid, 2), dtype=ITYPE)
+    numer_arr = np.zeros((nid, 2), dtype=DTYPE)
+    area_arr = np.zeros(nid, dtype=ITYPE)
+    denom_arr = np.zeros(nid, dtype=DTYPE)
+    
+    ilim = ilim_arr
+    jlim = jlim_arr
+    numer = numer_arr
+    area = area_arr
+    denom = denom_arr
+    
+    if nid == 0:
+        return ilim_arr, jlim_arr, numer_arr, area_arr, denom_arr
+        
+    for ix in range(nid):
+        ilim[ix,0] = ni
+        jlim[ix,0] = nj
+    
+    with nogil:
+        ix = 0
+        last_val = ids[0]
+        for i in range(ni):
+            for j in range(nj):
+                sval = segm[i,j]
+                
+                ### Binary search, but usually the same as the last pixel
+                if sval != last_val:
+                    lo = 0
+                    hi = nid-1
+                    ix = -1
+                    while lo <= hi:
+                        mid = (lo+hi) // 2
+                        if ids[mid] < sval:
+                            lo = mid+1
+                        elif ids[mid] > sval:
+                            hi = mid-1
+                        else:
+                            ix = mid
+                            break
+                    
+                    last_val = sval
+                
+                if ix < 0:
+                    continue
+                    
+                area[ix] += 1
+                wht_ij = flam[i,j]
+                numer[ix,0] += i*wht_ij
+                numer[ix,1] += j*wht_ij
+                denom[ix] += wht_ij
+                
+                if i < ilim[ix,0]:
+                    ilim[ix,0] = i
+                if i > ilim[ix,1]:
+                    ilim[ix,1] = i
+                
+                if j < jlim[ix,0]: 
+                    jlim[ix,0] = j
+                if j > jlim[ix,1]:
+                    jlim[ix,1] = j
+    
+    return ilim_arr, jlim_arr, numer_arr, area_arr, denom_arr
+    
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.embedsignature(True)
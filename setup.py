@@ -2,6 +2,7 @@ from distutils.core import setup
 from distutils.extension import Extension
 
 import os
+import sys
 import numpy
 
 try:
@@ -20,6 +21,13 @@ else:
 
 print('C extension: {0}'.format(cext))
 
+### OpenMP for the multithreaded dispersion kernels.  The default Apple 
+### compiler doesn't support it, where the kernels just run on one thread.
+if sys.platform == 'darwin':
+    openmp_args = []
+else:
+    openmp_args = ['-fopenmp']
+
 extensions = [
     Extension("grizli/utils_c/interp", ["grizli/utils_c/interp"+cext],
         include_dirs = [numpy.get_include()],),
@@ -28,7 +36,8 @@ extensions = [
     #     include_dirs = [numpy.get_include()],),
     
     Extension("grizli/utils_c/disperse", ["grizli/utils_c/disperse"+cext],
-        include_dirs = [numpy.get_include()],),
+        include_dirs = [numpy.get_include()],
+        extra_compile_args = openmp_args, extra_link_args = openmp_args),
 
 ]
 